@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+"""Runs router_reset_dns.py reset against local mock routers and reports throughput, latency and memory"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import click
+import psutil
+import yaml
+from loguru import logger
+
+from mock_routers import MOCK_MODELS, start_mock_routers
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(REPO_DIR, "router_reset_dns.py")
+DNS_SERVERS = ["8.8.8.8", "1.1.1.1"]
+
+
+def bench_config(config: str, alerts: bool) -> dict:
+    """the real config, with the alert the TP-Link mock shows on save acknowledged"""
+    with open(config, "r") as f:
+        cfg = yaml.safe_load(f)
+
+    if alerts:
+        cfg["routers"]["TP-Link WR841N"]["dns"]["submit"]["wait_for"] = {"condition": "alert", "accept": True}
+
+    return cfg
+
+
+def tree_rss(process: psutil.Process) -> int:
+    rss = 0
+    for p in [process] + process.children(recursive=True):
+        try:
+            rss += p.memory_info().rss
+        except psutil.Error:
+            pass
+
+    return rss
+
+
+def percentile(sorted_values: list, pct: float) -> float:
+    idx = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[idx]
+
+
+@click.command()
+@click.option("-d", "--driver-path", default="/usr/bin/chromedriver", type=click.Path(), help="Chromium driver path")
+@click.option("-c", "--config", default=os.path.join(REPO_DIR, "config.yaml"), type=click.Path(), help="Config file")
+@click.option("-n", "--routers", "count", default=20, help="Number of mock routers")
+@click.option("-m", "--model", "models", multiple=True, type=click.Choice(list(MOCK_MODELS.keys())),
+              help="Emulated model, can be repeated, all models by default")
+@click.option("--delay", default=0.0, help="Delay added to every mock response, seconds")
+@click.option("--alerts/--no-alerts", default=True, help="Show an alert after saving settings, where the model does")
+@click.option("-w", "--workers", default=1, help="Workers passed to reset")
+@click.option("--docker-runtime/--no-docker-runtime", default=False)
+@click.option("--extra", default="", help="Extra arguments passed to reset")
+def bench(driver_path: str, config: str, count: int, models: tuple, delay: float, alerts: bool, workers: int,
+          docker_runtime: bool, extra: str):
+    mock_routers = start_mock_routers(count=count, models=list(models or MOCK_MODELS.keys()), delay=delay,
+                                      alerts=alerts)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        routers_file = os.path.join(tmp, "routers.csv")
+        with open(routers_file, "w", encoding="utf8") as f:
+            f.write("IP;Port;None;None;User:pass;Model\n")
+            for server, router in mock_routers:
+                host, port = server.server_address
+                f.write(f"{host};{port};;;{router.username}:{router.password};{MOCK_MODELS[router.model]}\n")
+
+        config_file = os.path.join(tmp, "config.yaml")
+        with open(config_file, "w") as f:
+            yaml.safe_dump(bench_config(config, alerts), f)
+
+        trace_file = os.path.join(tmp, "trace.jsonl")
+        cmd = [sys.executable, SCRIPT, "reset",
+               "--driver-path", driver_path,
+               "--routers", routers_file,
+               "--config", config_file,
+               "--dns", ",".join(DNS_SERVERS),
+               "--workers", str(workers),
+               # every mock listens on the same ip
+               "--host-concurrency", str(count),
+               "--trace", trace_file,
+               "--journal", os.path.join(tmp, "journal.jsonl"),
+               "--skip-report", os.path.join(tmp, "skipped.csv"),
+               ]
+        if docker_runtime:
+            cmd.append("--docker-runtime")
+        cmd += extra.split()
+
+        logger.info(f"Running {count} mock routers with {workers} workers")
+        started = time.monotonic()
+        log_file = os.path.join(tmp, "reset.log")
+        with open(log_file, "w") as log:
+            process = psutil.Popen(cmd, stdout=log, stderr=subprocess.STDOUT)
+            peak_rss = 0
+            while process.poll() is None:
+                peak_rss = max(peak_rss, tree_rss(process))
+                time.sleep(0.5)
+        elapsed = time.monotonic() - started
+
+        if process.returncode:
+            with open(log_file) as log:
+                logger.error(log.read()[-5000:])
+            sys.exit(process.returncode)
+
+        phases = defaultdict(list)
+        with open(trace_file) as f:
+            for line in f:
+                entry = json.loads(line)
+                phases[entry["phase"]].append(entry["duration"])
+
+    updated = sum(1 for _, router in mock_routers if router.dns == DNS_SERVERS)
+    logger.info(f"Routers updated: {updated} of {count}")
+    logger.info(f"Wall time: {elapsed:.1f}s, {count / elapsed * 60:.1f} routers per minute")
+    logger.info(f"Peak RSS of reset and browsers: {peak_rss / 1024 / 1024:.0f} MB")
+    logger.info(f"{'phase':<28} {'count':>7} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for phase, durations in sorted(phases.items()):
+        durations.sort()
+        logger.info(f"{phase:<28} {len(durations):>7} {percentile(durations, 50):>8.2f} "
+                    f"{percentile(durations, 95):>8.2f} {percentile(durations, 99):>8.2f}")
+
+    for server, _ in mock_routers:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    bench()
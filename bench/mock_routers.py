@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+"""Local mock admin UIs that mimic the page structures described in config.yaml"""
+import base64
+import os
+import threading
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep
+from typing import List, Optional
+from urllib.parse import parse_qs, urlparse
+
+import click
+from loguru import logger
+
+SESSION_COOKIE = "mock_sid"
+
+LOGIN_PAGE = """<html><body>
+<form method="post" action="/login">
+<input type="text" id="{username_id}" name="username">
+<input type="password" id="{password_id}" name="password">
+<input type="submit" id="{submit_id}" value="Login">
+</form>
+</body></html>"""
+
+# braces are doubled, every page using it goes through str.format
+SHOW_SCRIPT = "<script>function show(id) {{ document.getElementById(id).style.display = 'block'; }}</script>"
+
+ZTE_H298A_MAIN = """<html><head>""" + SHOW_SCRIPT + """</head><body>
+<a id="LANUrl" href="#" onclick="show('smDns')">Local Network</a>
+<a id="smDns" href="#" style="display:none" onclick="show('LocalDnsServerBar')">DNS</a>
+<div id="LocalDnsServerBar" style="display:none" onclick="show('dnsform')">Local DNS Server</div>
+<form id="dnsform" style="display:none" method="post" action="/dns">
+{octets}
+<input type="submit" id="Btn_apply_LocalDnsServer" value="Apply">
+</form>
+</body></html>"""
+
+ZTE_H108N_MAIN = """<html><body><iframe id="mainFrame" name="mainFrame" src="/frame" width="100%" height="600">
+</iframe></body></html>"""
+
+ZTE_H108N_FRAME = """<html><head>""" + SHOW_SCRIPT + """</head><body>
+<div>ZXHN H108N</div>
+<div><a id="mmNet" href="#" onclick="show('menu')">Network</a></div>
+<div><div><div><table id="menu" style="display:none"><tbody><tr><td><table><tbody>
+{rows}
+</tbody></table></td></tr></tbody></table></div></div></div>
+</body></html>"""
+
+ZTE_H108N_WAN = """<html><body>
+<form method="post" action="/dns">
+<input type="text" id="Frm_DNSServer1" name="dns1" value="{dns1}">
+<input type="text" id="Frm_DNSServer2" name="dns2" value="{dns2}">
+<input type="submit" id="Btn_Submit" value="Submit">
+</form>
+</body></html>"""
+
+SERCOMM_MAIN = """<html><head>""" + SHOW_SCRIPT + """</head><body>
+<table><tbody><tr>
+<td><a id="Menu1Txt1" href="#" onclick="show('dnsform')">Basic Setup</a></td>
+<td></td>
+<td><table><tbody><tr><td></td></tr><tr><td></td></tr><tr><td>
+<table><tbody><tr><td><form id="dnsform" method="post" action="/dns">
+<table><tbody><tr><td><table><tbody><tr><td></td></tr><tr><td><table><tbody>
+<tr id="id_dns_servers_1"><td>DNS 1</td><td>{dns1_octets}</td></tr>
+<tr id="id_dns_servers_2"><td>DNS 2</td><td>{dns2_octets}</td></tr>
+<tr><td></td></tr><tr><td></td></tr><tr><td></td></tr><tr><td></td></tr><tr><td></td></tr>
+<tr><td><p><input type="submit" value="Apply"><input type="reset" value="Cancel"></p></td></tr>
+</tbody></table></td></tr></tbody></table></td></tr></tbody></table>
+</form></td></tr></tbody></table>
+</td></tr></tbody></table></td>
+</tr></tbody></table>
+</body></html>"""
+
+TP_LINK_MAIN = """<html><body>
+<iframe id="bottomLeftFrame" name="bottomLeftFrame" src="/menu" width="20%" height="600"></iframe>
+<iframe id="mainFrame" name="mainFrame" src="/status" width="75%" height="600"></iframe>
+</body></html>"""
+
+TP_LINK_MENU = """<html><body><a id="a14" href="/dhcp" target="mainFrame">DHCP Settings</a></body></html>"""
+
+TP_LINK_DHCP = """<html><body>{alert}<center><form method="post" action="/dns"><table><tbody>
+<tr><td>Primary DNS</td><td><input type="text" id="dnsserver" name="dns1" value="{dns1}"></td></tr>
+<tr><td>Secondary DNS</td><td><input type="text" id="dnsserver2" name="dns2" value="{dns2}"></td></tr>
+{rows}
+<tr><td></td><td><input type="submit" value="Save"></td></tr>
+</tbody></table></form></center></body></html>"""
+
+
+class MockRouter:
+    """state of one emulated router"""
+
+    def __init__(self, model: str, username: str, password: str, delay: float, alerts: bool) -> None:
+        self.model = model
+        self.username = username
+        self.password = password
+        self.delay = delay
+        self.alerts = alerts
+        self.dns = ["", ""]
+        self.dns_updates = 0
+        self.logins = 0
+        self._lock = threading.Lock()
+
+    def login(self, username: str, password: str) -> bool:
+        with self._lock:
+            if username == self.username and password == self.password:
+                self.logins += 1
+                return True
+
+        return False
+
+    def set_dns(self, dns: List[str]) -> None:
+        with self._lock:
+            self.dns = dns
+            self.dns_updates += 1
+
+    def login_page(self) -> Optional[str]:
+        if self.model == "SERCOMM_RV6699":
+            return None  # basic auth
+        if self.model == "TP-Link WR841N":
+            return LOGIN_PAGE.format(username_id="userName", password_id="pcPassword", submit_id="loginBtn")
+        return LOGIN_PAGE.format(username_id="Frm_Username", password_id="Frm_Password", submit_id="LoginId")
+
+    def page(self, path: str, saved: bool = False) -> Optional[str]:
+        model = self.model
+        dns1, dns2 = self.dns
+
+        if model == "ZTE_ZXHN_H298A" and path == "/main":
+            octets = octet_inputs([f"dns1_{o}" for o in range(4)], dns1, ids=[f"sub_SerIPAddress1{o}" for o in range(4)])
+            octets += octet_inputs([f"dns2_{o}" for o in range(4)], dns2, ids=[f"sub_SerIPAddress2{o}" for o in range(4)])
+            return ZTE_H298A_MAIN.format(octets=octets)
+
+        if model == "ZTE_ZXHN_H108N":
+            if path == "/main":
+                return ZTE_H108N_MAIN
+            if path == "/frame":
+                rows = "".join(f"<tr><td>{n}</td><td>Item {n}</td></tr>" for n in range(1, 12))
+                rows += "<tr><td>12</td><td onclick=\"location='/frame/wan'\">WAN Connection</td></tr>"
+                return ZTE_H108N_FRAME.format(rows=rows)
+            if path == "/frame/wan":
+                return ZTE_H108N_WAN.format(dns1=dns1, dns2=dns2)
+
+        if model == "SERCOMM_RV6699":
+            return SERCOMM_MAIN.format(
+                dns1_octets=octet_inputs([f"dns1_{o}" for o in range(4)], dns1),
+                dns2_octets=octet_inputs([f"dns2_{o}" for o in range(4)], dns2),
+            )
+
+        if model == "TP-Link WR841N":
+            if path == "/main":
+                return TP_LINK_MAIN
+            if path == "/menu":
+                return TP_LINK_MENU
+            if path == "/status":
+                return "<html><body>Status</body></html>"
+            if path == "/dhcp":
+                alert = "<script>alert('Settings saved');</script>" if saved and self.alerts else ""
+                rows = "".join(f"<tr><td>Option {n}</td><td></td></tr>" for n in range(3, 13))
+                return TP_LINK_DHCP.format(alert=alert, dns1=dns1, dns2=dns2, rows=rows)
+
+        return None
+
+
+def octet_inputs(names: List[str], value: str, ids: Optional[List[str]] = None) -> str:
+    octets = (value.split(".") + [""] * 4)[:4] if value else [""] * 4
+    id_attrs = [f' id="{id_}"' for id_ in ids] if ids else [""] * 4
+    return "".join(f'<input type="text" size="3"{id_attr} name="{name}" value="{octet}">'
+                   for id_attr, name, octet in zip(id_attrs, names, octets))
+
+
+class MockRouterHandler(BaseHTTPRequestHandler):
+    router = None  # type: MockRouter
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, body: str, status: int = 200, headers: dict = None) -> None:
+        sleep(self.router.delay)
+        data = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _redirect(self, location: str, headers: dict = None) -> None:
+        self._send("", status=302, headers={"Location": location, **(headers or {})})
+
+    def _form(self) -> dict:
+        length = int(self.headers.get("Content-Length", 0))
+        form = parse_qs(self.rfile.read(length).decode())
+        return {k: v[0] for k, v in form.items()}
+
+    def _logged_in(self) -> bool:
+        cookie = SimpleCookie(self.headers.get("Cookie", ""))
+        return SESSION_COOKIE in cookie
+
+    def _basic_auth(self) -> bool:
+        expected = base64.b64encode(f"{self.router.username}:{self.router.password}".encode()).decode()
+        if self.headers.get("Authorization") == f"Basic {expected}":
+            return True
+
+        self._send("Unauthorized", status=401, headers={"WWW-Authenticate": 'Basic realm="router"'})
+        return False
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        model = self.router.model
+
+        if model == "SERCOMM_RV6699":
+            if not self._basic_auth():
+                return
+            return self._send(self.router.page("/main"))
+
+        if path == "/" and not self._logged_in():
+            return self._send(self.router.login_page())
+
+        if not self._logged_in():
+            return self._redirect("/")
+
+        if path == "/":
+            path = "/main"
+
+        page = self.router.page(path)
+        if page is None:
+            return self._send("Not found", status=404)
+
+        self._send(page)
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        form = self._form()
+
+        if path == "/login":
+            if not self.router.login(form.get("username", ""), form.get("password", "")):
+                return self._redirect("/")
+            return self._redirect("/main", headers={"Set-Cookie": f"{SESSION_COOKIE}=1; Path=/"})
+
+        if self.router.model == "SERCOMM_RV6699":
+            if not self._basic_auth():
+                return
+        elif not self._logged_in():
+            return self._redirect("/")
+
+        if path != "/dns":
+            return self._send("Not found", status=404)
+
+        if self.router.model in ("ZTE_ZXHN_H298A", "SERCOMM_RV6699"):
+            dns = [".".join(form.get(f"dns{n}_{o}", "") for o in range(4)) for n in (1, 2)]
+        else:
+            dns = [form.get("dns1", ""), form.get("dns2", "")]
+        self.router.set_dns(dns)
+
+        if self.router.model == "TP-Link WR841N":
+            return self._send(self.router.page("/dhcp", saved=True))
+        if self.router.model == "ZTE_ZXHN_H108N":
+            return self._send(self.router.page("/frame/wan"))
+        self._send(self.router.page("/main"))
+
+
+# model group -> router model string written to the routers file
+MOCK_MODELS = {
+    "ZTE_ZXHN_H298A": "ZTE ZXHN H298A V1.1",
+    "ZTE_ZXHN_H108N": "ZTE ZXHN H108N",
+    "SERCOMM_RV6699": "SERCOMM RV6699",
+    "TP-Link WR841N": "TP-LINK TL-WR841N",
+}
+# pages of every model, logged in, written as snapshots for optimize-locators
+MOCK_PAGES = {
+    "ZTE_ZXHN_H298A": ["/main"],
+    "ZTE_ZXHN_H108N": ["/main", "/frame", "/frame/wan"],
+    "SERCOMM_RV6699": ["/main"],
+    "TP-Link WR841N": ["/main", "/menu", "/status", "/dhcp"],
+}
+
+
+def write_snapshots(directory: str) -> None:
+    """writes the login and settings pages of every model to directory/<model group>/"""
+    for model, paths in MOCK_PAGES.items():
+        router = MockRouter(model=model, username="admin", password="admin", delay=0, alerts=False)
+        pages = {"login": router.login_page(), **{path.strip("/").replace("/", "_"): router.page(path) for path in paths}}
+        os.makedirs(os.path.join(directory, model), exist_ok=True)
+        for name, page in pages.items():
+            if page is not None:
+                with open(os.path.join(directory, model, f"{name}.html"), "w", encoding="utf8") as f:
+                    f.write(page)
+
+
+def start_mock_routers(count: int, models: List[str], delay: float, alerts: bool,
+                       host: str = "127.0.0.1") -> List[tuple]:
+    """starts count mock routers, models are assigned round robin, returns (server, router) pairs"""
+    started = []
+    for n in range(count):
+        router = MockRouter(model=models[n % len(models)], username="admin", password=f"admin{n}", delay=delay,
+                            alerts=alerts)
+        handler = type("Handler", (MockRouterHandler,), {"router": router})
+        server = ThreadingHTTPServer((host, 0), handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        started.append((server, router))
+
+    return started
+
+
+@click.command()
+@click.option("-n", "--count", default=4, help="Number of mock routers")
+@click.option("-m", "--model", "models", multiple=True, type=click.Choice(list(MOCK_MODELS.keys())),
+              help="Emulated model, can be repeated, all models by default")
+@click.option("--delay", default=0.0, help="Delay added to every response, seconds")
+@click.option("--alerts/--no-alerts", default=True, help="Show an alert after saving settings, where the model does")
+@click.option("-o", "--output", default="routers_mock.csv", type=click.Path(), help="Routers file to write")
+@click.option("--snapshots", type=click.Path(file_okay=False),
+              help="Only write the pages of every model to this directory, for optimize-locators")
+def serve(count: int, models: tuple, delay: float, alerts: bool, output: str, snapshots: Optional[str]):
+    """serves mock routers until interrupted and writes a routers file pointing to them"""
+    if snapshots:
+        write_snapshots(snapshots)
+        logger.info(f"Pages of {len(MOCK_PAGES)} models are written to {snapshots}")
+        return
+
+    routers = start_mock_routers(count=count, models=list(models or MOCK_MODELS.keys()), delay=delay, alerts=alerts)
+    with open(output, "w", encoding="utf8") as f:
+        f.write("IP;Port;None;None;User:pass;Model\n")
+        for server, router in routers:
+            host, port = server.server_address
+            f.write(f"{host};{port};;;{router.username}:{router.password};{MOCK_MODELS[router.model]}\n")
+
+    logger.info(f"{len(routers)} mock routers are listed in {output}, press Ctrl-C to stop")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    serve()
@@ -1,9 +1,13 @@
 #!/usr/bin/env python
 import sys
-from typing import Optional
+from typing import Callable, Iterable, Iterator, NamedTuple, Optional, Tuple, Union
 import click
+import psutil
 import csv
 import yaml
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.chrome.service import Service
@@ -11,15 +15,213 @@ from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.select import Select
-from selenium.common.exceptions import WebDriverException, TimeoutException, NoSuchElementException
+from selenium.common.exceptions import WebDriverException, TimeoutException, NoSuchElementException, \
+    NoAlertPresentException, NoSuchFrameException, InvalidSessionIdException, NoSuchWindowException
 from loguru import logger
 from time import sleep
+from collections import Counter, defaultdict, deque
+from contextlib import asynccontextmanager, contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import islice
+import asyncio
+import atexit
+import bisect
+import contextvars
+import hashlib
+import heapq
+import hmac
+import io
+import itertools
+import json
+import os
+import re
+import queue
+import random
 import subprocess
 import signal
+import socket
+import sqlite3
+import ssl
+import string
+import threading
+import time
+import warnings
+
+try:
+    # only needed by --browser-engine playwright
+    from playwright.async_api import async_playwright, Error as PlaywrightError, TimeoutError as PlaywrightTimeoutError
+except ImportError:
+    async_playwright = None
+
+    class PlaywrightError(Exception):
+        pass
+
+    PlaywrightTimeoutError = PlaywrightError
+
+try:
+    # only needed by optimize-locators
+    import lxml.etree
+    import lxml.html
+except ImportError:
+    lxml = None
+
+try:
+    # only needed by --session-cache
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:
+    Fernet = None
 
 
 VERSION = "0.1"
 
+OUTCOME_SUCCEEDED = "succeeded"
+OUTCOME_FAILED = "failed"
+OUTCOME_SKIPPED = "skipped"
+# dns servers already matched, nothing was submitted
+OUTCOME_COMPLIANT = "already compliant"
+# the password form was submitted and a later step failed, the router may have the new password already
+OUTCOME_UNCONFIRMED = "password unconfirmed"
+OUTCOMES = (OUTCOME_SUCCEEDED, OUTCOME_COMPLIANT, OUTCOME_FAILED, OUTCOME_UNCONFIRMED, OUTCOME_SKIPPED)
+
+BY = {"id": By.ID, "xpath": By.XPATH}
+
+# arguments[0] is [quiet ms, timeOrigin and now() taken before the click]: the click has navigated or started
+# a request, the document is loaded and no resource has finished loading for the quiet ms
+NETWORK_IDLE_SCRIPT = """
+const [quiet, origin, mark] = arguments[0];
+const entries = performance.getEntriesByType("resource");
+const requested = performance.timeOrigin !== origin || entries.some(e => e.startTime > mark);
+return requested && document.readyState === "complete" &&
+    entries.every(e => performance.now() - e.responseEnd > quiet);
+"""
+PAGE_TIME_SCRIPT = "return [performance.timeOrigin, performance.now()];"
+NETWORK_IDLE_MS = 500
+
+WAIT_CONDITIONS = ("element_present", "element_gone", "url_changes", "alert", "network_idle")
+
+PASSWORD_INPUT_ROLES = ("current_username", "current_password", "new_username", "new_password", "new_password_confirm")
+
+# bumped whenever the plan types change, so stale cached plans are never loaded
+PLAN_CACHE_FORMAT = 4
+LOCATOR_CACHE_FORMAT = 1
+# snapshot elements with a text no longer than this can be located by their text
+LOCATOR_TEXT_LENGTH = 40
+
+# url patterns blocked for the resource types a model lists under block.types
+BLOCK_RESOURCE_TYPES = {
+    "images": ("*.png", "*.jpg", "*.jpeg", "*.gif", "*.bmp", "*.ico", "*.svg", "*.webp"),
+    "fonts": ("*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot"),
+    "css": ("*.css",),
+    "media": ("*.mp3", "*.mp4", "*.webm", "*.swf"),
+}
+# chrome arguments of the --lean profile
+LEAN_CHROME_ARGUMENTS = (
+    "--disable-extensions",
+    "--disable-gpu",
+    "--disable-background-networking",
+    "--disable-component-update",
+    "--disable-default-apps",
+    "--disable-sync",
+    "--disable-features=Translate,MediaRouter,OptimizationHints",
+    "--no-first-run",
+    "--mute-audio",
+    "--disk-cache-size=1",
+    "--media-cache-size=1",
+    "--aggressive-cache-discard",
+)
+# wait timeouts until a model group has LATENCY_MIN_SAMPLES observed waits, learned timeouts never exceed them
+WAIT_TIMEOUTS = {"element": 60.0, "alert": 10.0}
+LATENCY_MIN_SAMPLES = 20
+# most recent waits kept per model group and wait kind
+LATENCY_SAMPLES = 500
+DEFAULT_CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "router_reset_dns")
+
+MODEL_SUFFIX_RE = re.compile(r",?\s*\b(hardware|firmware)\b.*$")
+MODEL_PUNCTUATION_RE = re.compile(r"[^a-z0-9@.]+|(?<![0-9])\.|\.(?![0-9])")
+
+# routers probed per pre-flight batch, as a multiple of the probe concurrency
+PREFLIGHT_BATCH_FACTOR = 4
+# sets [type, location, value] fields the way typing would, firing the events router pages listen to,
+# returns the values read back from the page, null for fields that were not found
+FILL_FIELDS_SCRIPT = """
+return arguments[0].map(([type, location, value]) => {
+    const el = type === "id" ? document.getElementById(location) : document.evaluate(
+        location, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+    if (!el) {
+        return null;
+    }
+    const setter = Object.getOwnPropertyDescriptor(Object.getPrototypeOf(el), "value").set;
+    el.focus();
+    setter.call(el, value);
+    for (const event of ["keydown", "keyup", "input", "change", "blur"]) {
+        el.dispatchEvent(new Event(event, {bubbles: true}));
+    }
+    return el.value;
+});
+"""
+
+# local and session storage of the current document, restored along with the cookies of a cached session
+READ_STORAGE_SCRIPT = """
+try {
+    return {local: Object.assign({}, localStorage), session: Object.assign({}, sessionStorage)};
+} catch (e) {
+    return {local: {}, session: {}};
+}
+"""
+RESTORE_STORAGE_SCRIPT = """
+for (const [name, storage] of [["local", localStorage], ["session", sessionStorage]]) {
+    for (const [key, value] of Object.entries(arguments[0][name])) {
+        storage.setItem(key, value);
+    }
+}
+"""
+
+SKIP_REPORT_HEADER = ["IP", "Port", "None", "None", "User:pass", "Model", "Reason"]
+
+HTTP_TIMEOUT = 30
+
+JOB_PENDING = "pending"
+JOB_LEASED = "leased"
+JOB_DONE = "done"
+# routers inserted into the job queue per transaction
+JOB_QUEUE_BATCH = 1000
+COORDINATOR_STATUS_INTERVAL = 10
+
+# failure classes, failed routers are retried when their class is one of --retry-on
+FAILURE_TIMEOUT = "timeout"
+FAILURE_CONNECTION = "connection"
+FAILURE_LOGIN = "login"
+FAILURE_ELEMENT = "element"
+FAILURE_VERIFY = "verify"
+FAILURE_CLASSES = (FAILURE_TIMEOUT, FAILURE_CONNECTION, FAILURE_LOGIN, FAILURE_ELEMENT, FAILURE_VERIFY)
+# errors of either browser engine, the playwright ones are placeholders when playwright is missing
+BROWSER_ERRORS = (WebDriverException, PlaywrightError)
+BROWSER_TIMEOUTS = (TimeoutException, PlaywrightTimeoutError)
+
+# seconds between the supervisor's checks of the browser process trees
+SUPERVISOR_INTERVAL = 5.0
+# Xvfb displays of the workers are numbered from here, the docker image uses :99 as well
+XVFB_FIRST_DISPLAY = 99
+
+# seconds before a router whose ip is at its concurrency limit is tried again
+HOST_BUSY_DELAY = 1.0
+
+# phases with duration histograms on the metrics endpoint, and their buckets in seconds
+METRIC_PHASES = ("router", "open_main_page", "do_login", "open_dns_page", "update_dns_settings")
+METRIC_BUCKETS = (0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0)
+# routers finished in the last this many seconds give the rate the eta is estimated from
+METRIC_RATE_WINDOW = 300.0
+# longest running sessions listed in the json status
+METRIC_SESSIONS = 20
+
+JOURNAL_STARTED = "started"
+# journal statuses that are not retried on resume, a run with the old password can't log in to unconfirmed ones
+JOURNAL_DONE = (OUTCOME_SUCCEEDED, OUTCOME_COMPLIANT, OUTCOME_UNCONFIRMED)
+
+LOG_FORMAT = "<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level: <8}</level> | " \
+             "<cyan>{extra[worker]}</cyan> | <cyan>{extra[router]}</cyan> - <level>{message}</level>"
+
+
 @click.group()
 def cli():
     pass
@@ -29,541 +231,3789 @@ def preexec_function():
     signal.signal(signal.SIGINT, signal.SIG_IGN)
 
 
-def map_model(cfg: dict, router_model: str) -> str:
-    # logger.info(cfg)
-    # logger.info(router_model)
-    for model_group in cfg.keys():
-        if cfg[model_group]:
-            for model in cfg[model_group]:
-                if model == router_model:
-                    return model_group
+def normalize_model(model: str) -> str:
+    """lowercase, drop firmware/hardware suffixes, collapse punctuation and whitespace"""
+    model = MODEL_SUFFIX_RE.sub("", model.lower())
+    return " ".join(MODEL_PUNCTUATION_RE.sub(" ", model).split())
 
-    return ""
+
+class ModelIndex:
+    """models section of the config compiled into a hash index of normalized aliases"""
+
+    def __init__(self, models: dict, fuzzy: bool = False) -> None:
+        self.fuzzy = fuzzy
+        self._index = {}
+        for model_group, aliases in models.items():
+            for alias in aliases or []:
+                key = normalize_model(str(alias))
+                if self._index.setdefault(key, model_group) != model_group:
+                    logger.warning(f"Model {alias} is configured for both {self._index[key]} and {model_group}")
+
+        self._keys_by_length = sorted(self._index.keys(), key=len, reverse=True)
+        self._tokens = {key: set(key.split()) for key in self._keys_by_length}
+        self._lock = threading.Lock()
+        self._cache = {}
+        self.unmatched = Counter()
+        # routers of models matched by a prefix or by tokens, by model and guessed group
+        self.guessed = Counter()
+
+    def lookup(self, router_model: str) -> str:
+        if router_model in self._cache:
+            model_group, guessed = self._cache[router_model]
+        else:
+            key = normalize_model(router_model)
+            model_group, guessed = self._index.get(key, ""), False
+            if not model_group and self.fuzzy:
+                model_group = self._match_prefix(key) or self._match_tokens(key)
+                guessed = bool(model_group)
+                if guessed:
+                    logger.warning(f"Model \"{router_model}\" is not configured, guessed {model_group}")
+            self._cache[router_model] = model_group, guessed
+
+        with self._lock:
+            if not model_group:
+                self.unmatched[router_model] += 1
+            elif guessed:
+                self.guessed[(router_model, model_group)] += 1
+
+        return model_group
+
+    def _match_prefix(self, key: str) -> str:
+        for indexed in self._keys_by_length:
+            if key.startswith(indexed + " "):
+                return self._index[indexed]
+
+        return ""
+
+    def _match_tokens(self, key: str) -> str:
+        tokens = set(key.split())
+        for indexed in self._keys_by_length:
+            if self._tokens[indexed] and self._tokens[indexed] <= tokens:
+                return self._index[indexed]
+
+        return ""
+
+    def report_unmatched(self) -> None:
+        for (router_model, model_group), count in self.guessed.most_common():
+            logger.warning(f"Guessed model \"{router_model}\" as {model_group}: {count} router(s)")
+        for router_model, count in self.unmatched.most_common():
+            logger.warning(f"Unmatched model \"{router_model}\": {count} router(s)")
+
+
+class ConfigError(Exception):
+    """config.yaml has invalid model entries"""
+
+
+class Locator(NamedTuple):
+    kind: str  # id, xpath or frame
+    location: str
+    value: Optional[str] = None  # option selected after a step is clicked
+    alert_confirm: bool = False  # input is clicked and an alert accepted before typing
+    fallback: Optional["Locator"] = None  # configured xpath of an optimized locator, used when this one is missing
+
+    @property
+    def by(self) -> str:
+        return BY[self.kind]
+
+
+class WaitFor(NamedTuple):
+    condition: str
+    locator: Optional[Locator]
+    accept: bool
+
+
+class PageMark(NamedTuple):
+    """url and page clock before a click, completion conditions look for changes after it"""
+    url: str
+    time_origin: float = 0.0
+    now: float = 0.0
+
+
+class LoginPlan(NamedTuple):
+    basic: bool
+    iframe: Optional[str]
+    username: Optional[Locator]
+    password: Optional[Locator]
+    submit: Optional[Locator]
+    check_login: Optional[Locator]
+    check_login_iframe: Optional[str]
+    wait_for: Optional[WaitFor]
+
+
+class DnsPlan(NamedTuple):
+    iframe: Optional[str]
+    split_octets: bool
+    fields: Tuple[Tuple[Locator, ...], ...]  # inputs of every dns server, four octet inputs when split
+    submit: Locator
+    wait: float
+    wait_for: Optional[WaitFor]
+    check_dhcp_mode: Optional[Locator]
+    dhcp_mode: Optional[str]
+    fill: Optional[str]
+
+
+class PasswordInput(NamedTuple):
+    role: str  # one of PASSWORD_INPUT_ROLES
+    locator: Locator
+
+
+class PasswordResetPlan(NamedTuple):
+    goto_iframe: Optional[str]
+    goto_steps: Tuple[Locator, ...]
+    form_iframe: Optional[str]
+    inputs: Tuple[PasswordInput, ...]
+    submit: Locator
+    alert_confirm: bool
+    reboot: bool
+    reboot_steps: Tuple[Locator, ...]
+    reboot_alert_confirm: bool
+    reboot_wait_for: Optional[WaitFor]
+
+
+class ModelPlan(NamedTuple):
+    name: str
+    engine: str
+    login: Optional[LoginPlan]
+    iframe: Optional[str]
+    steps: Tuple[Locator, ...]
+    switch_to_parent_frame: bool
+    dns: Optional[DnsPlan]
+    password_reset: Optional[PasswordResetPlan]
+    http: Optional[dict]
+    block: Tuple[str, ...] = ()  # url patterns the browser doesn't load
+
+
+class CompiledConfig(NamedTuple):
+    version: str
+    models: dict
+    plans: dict
+
+
+# types of the cached plans, by name
+PLAN_TYPES = {plan_type.__name__: plan_type for plan_type in (Locator, WaitFor, LoginPlan, DnsPlan, PasswordInput,
+                                                              PasswordResetPlan, ModelPlan, CompiledConfig)}
+
+
+def _mapping(cfg, path: str) -> dict:
+    if not isinstance(cfg, dict):
+        raise ConfigError(f"{path} should be a mapping")
+    return cfg
+
+
+def _locator(cfg, path: str, kinds: tuple = ("id", "xpath")) -> Locator:
+    _mapping(cfg, path)
+    if cfg.get("type") not in kinds:
+        raise ConfigError(f"{path}.type should be one of {', '.join(kinds)}, got {cfg.get('type')!r}")
+    if not isinstance(cfg.get("location"), str) or not cfg["location"]:
+        raise ConfigError(f"{path}.location should be a non-empty string")
+
+    value = cfg.get("value")
+    return Locator(kind=cfg["type"],
+                   location=cfg["location"],
+                   value=None if value is None else str(value),
+                   alert_confirm=bool(cfg.get("alert_confirm", False)),
+                   )
+
+
+def _optional_locator(cfg: dict, key: str, path: str) -> Optional[Locator]:
+    return _locator(cfg[key], f"{path}.{key}") if key in cfg else None
+
+
+def _locators(cfg, path: str, kinds: tuple = ("id", "xpath")) -> Tuple[Locator, ...]:
+    if not isinstance(cfg, list):
+        raise ConfigError(f"{path} should be a list")
+    return tuple(_locator(step, f"{path}[{idx}]", kinds) for idx, step in enumerate(cfg))
+
+
+def _frame(cfg: dict, key: str, path: str) -> Optional[str]:
+    if key not in cfg:
+        return None
+    if not isinstance(cfg[key], (str, int)):
+        raise ConfigError(f"{path}.{key} should be a frame name or index")
+    return cfg[key]
+
+
+def _wait_for(cfg: dict, path: str) -> Optional[WaitFor]:
+    if "wait_for" not in cfg:
+        return None
+
+    path = f"{path}.wait_for"
+    wait_for = _mapping(cfg["wait_for"], path)
+    condition = wait_for.get("condition")
+    if condition not in WAIT_CONDITIONS:
+        raise ConfigError(f"{path}.condition should be one of {', '.join(WAIT_CONDITIONS)}, got {condition!r}")
+
+    locator = None
+    if condition in ("element_present", "element_gone"):
+        locator = _locator(wait_for, path)
+
+    return WaitFor(condition=condition, locator=locator, accept=bool(wait_for.get("accept", False)))
+
+
+def _compile_login(cfg, path: str) -> LoginPlan:
+    login = _mapping(cfg, path)
+    basic = bool(login.get("basic", False))
+    if not basic and ("password" not in login or "submit" not in login):
+        raise ConfigError(f"{path} should have password and submit, or basic: true")
+
+    check_login = login.get("check_login")
+    return LoginPlan(basic=basic,
+                     iframe=_frame(login, "iframe", path),
+                     username=_optional_locator(login, "username", path),
+                     password=_optional_locator(login, "password", path),
+                     submit=_optional_locator(login, "submit", path),
+                     check_login=_optional_locator(login, "check_login", path),
+                     check_login_iframe=_frame(check_login, "iframe", f"{path}.check_login") if check_login else None,
+                     wait_for=_wait_for(login, path),
+                     )
+
+
+def _compile_dns(cfg, path: str) -> DnsPlan:
+    dns = _mapping(cfg, path)
+    split_octets = bool(dns.get("split_octets", False))
+
+    fields = []
+    dns_fields_num = len([k for k in dns.keys() if k.startswith("dns_")])
+    if not dns_fields_num:
+        raise ConfigError(f"{path} should have at least dns_1")
+
+    for dns_idx in range(1, dns_fields_num + 1):
+        field_path = f"{path}.dns_{dns_idx}"
+        if f"dns_{dns_idx}" not in dns:
+            raise ConfigError(f"{field_path} is missing, dns fields should be numbered from 1 without gaps")
+
+        field = _mapping(dns[f"dns_{dns_idx}"], field_path)
+        if split_octets:
+            if not isinstance(field.get("location"), list) or len(field["location"]) != 4:
+                raise ConfigError(f"{field_path}.location should be a list of 4 octet locations")
+            fields.append(tuple(_locator({"type": field.get("type"), "location": loc}, f"{field_path}.location[{idx}]")
+                                for idx, loc in enumerate(field["location"])))
+        else:
+            fields.append((_locator(field, field_path),))
+
+    if "submit" not in dns:
+        raise ConfigError(f"{path}.submit is missing")
+    submit = _mapping(dns["submit"], f"{path}.submit")
+    wait = submit.get("wait", 5)
+    if not isinstance(wait, (int, float)) or wait < 0:
+        raise ConfigError(f"{path}.submit.wait should be a number of seconds")
+
+    dhcp_mode = None
+    if "check_dhcp_mode" in dns:
+        if "value" not in dns.get("update_dhcp_mode", {}):
+            raise ConfigError(f"{path}.update_dhcp_mode.value is required with check_dhcp_mode")
+        dhcp_mode = str(dns["update_dhcp_mode"]["value"])
+
+    if dns.get("fill") not in (None, "fields", "script"):
+        raise ConfigError(f"{path}.fill should be fields or script")
+
+    return DnsPlan(iframe=_frame(dns, "iframe", path),
+                   split_octets=split_octets,
+                   fields=tuple(fields),
+                   submit=_locator(submit, f"{path}.submit"),
+                   wait=wait,
+                   wait_for=_wait_for(submit, f"{path}.submit"),
+                   check_dhcp_mode=_optional_locator(dns, "check_dhcp_mode", path),
+                   dhcp_mode=dhcp_mode,
+                   fill=dns.get("fill"),
+                   )
+
+
+def _compile_password_reset(cfg, path: str) -> PasswordResetPlan:
+    password_reset = _mapping(cfg, path)
+
+    # navigation steps are either under goto, with an optional iframe, or directly under password_reset
+    goto = _mapping(password_reset.get("goto", {"steps": password_reset.get("steps", [])}), f"{path}.goto")
+    form = _mapping(password_reset.get("form"), f"{path}.form")
+
+    form_inputs = form.get("input")
+    if isinstance(form_inputs, dict):
+        for role in form_inputs.keys():
+            if role not in PASSWORD_INPUT_ROLES:
+                raise ConfigError(f"{path}.form.input.{role} should be one of {', '.join(PASSWORD_INPUT_ROLES)}")
+        inputs = tuple(PasswordInput(role=role, locator=_locator(form_inputs[role], f"{path}.form.input.{role}"))
+                       for role in PASSWORD_INPUT_ROLES if role in form_inputs)
+    elif isinstance(form_inputs, list):
+        # a plain list of inputs all take the new password
+        inputs = tuple(PasswordInput(role="new_password", locator=locator)
+                       for locator in _locators(form_inputs, f"{path}.form.input"))
+    else:
+        raise ConfigError(f"{path}.form.input should be a mapping of roles or a list of inputs")
+
+    if "submit" not in form:
+        raise ConfigError(f"{path}.form.submit is missing")
+
+    reboot = _mapping(password_reset.get("reboot", {}), f"{path}.reboot")
+    return PasswordResetPlan(goto_iframe=_frame(goto, "iframe", f"{path}.goto"),
+                             goto_steps=_locators(goto.get("steps", []), f"{path}.goto.steps"),
+                             form_iframe=_frame(form, "iframe", f"{path}.form"),
+                             inputs=inputs,
+                             submit=_locator(form["submit"], f"{path}.form.submit"),
+                             alert_confirm=bool(form.get("alert_confirm", False)),
+                             reboot="reboot" in password_reset,
+                             reboot_steps=_locators(reboot.get("steps", []), f"{path}.reboot.steps"),
+                             reboot_alert_confirm=bool(reboot.get("alert_confirm", False)),
+                             reboot_wait_for=_wait_for(reboot, f"{path}.reboot"),
+                             )
+
+
+def _check_template(value, path: str) -> None:
+    """fails on strings that HttpRouter._render can't fill from named variables"""
+    if isinstance(value, list):
+        for idx, item in enumerate(value):
+            _check_template(item, f"{path}[{idx}]")
+    elif isinstance(value, dict):
+        for key, item in value.items():
+            _check_template(item, f"{path}.{key}")
+    elif isinstance(value, str):
+        try:
+            fields = [field for _, field, _, _ in string.Formatter().parse(value) if field is not None]
+        except ValueError as e:
+            raise ConfigError(f"{path} is not a valid template: {e}, braces are escaped as {{{{ and }}}}")
+        for field in fields:
+            if not field.isidentifier():
+                raise ConfigError(f"{path} should only have named variables like {{dns_1}}, got {{{field}}}")
+
+
+def _compile_http(cfg, path: str) -> dict:
+    http = _mapping(cfg, path)
+    _check_template(http.get("headers", {}), f"{path}.headers")
+    for flow in ("login", "dns", "verify", "password_reset"):
+        steps = http.get(flow, [])
+        if not isinstance(steps, list):
+            raise ConfigError(f"{path}.{flow} should be a list of requests")
+        for idx, step in enumerate(steps):
+            step_path = f"{path}.{flow}[{idx}]"
+            if not isinstance(_mapping(step, step_path).get("path"), str):
+                raise ConfigError(f"{step_path}.path should be a string")
+            for key in ("path", "params", "data", "headers"):
+                _check_template(step.get(key), f"{step_path}.{key}")
+            _check_template(_mapping(step.get("expect", {}), f"{step_path}.expect").get("contains"),
+                            f"{step_path}.expect.contains")
+            for name, source in _mapping(step.get("extract", {}), f"{step_path}.extract").items():
+                if not set(_mapping(source, f"{step_path}.extract.{name}")) & {"regex", "cookie", "header"}:
+                    raise ConfigError(f"{step_path}.extract.{name} should have regex, cookie or header")
+
+    return http
+
+
+def _compile_block(cfg, path: str) -> Tuple[str, ...]:
+    block = _mapping(cfg, path)
+    patterns = []
+    for resource_type in block.get("types", []):
+        if resource_type not in BLOCK_RESOURCE_TYPES:
+            raise ConfigError(f"{path}.types should only have {', '.join(BLOCK_RESOURCE_TYPES)}, got {resource_type!r}")
+        patterns += BLOCK_RESOURCE_TYPES[resource_type]
+
+    urls = block.get("urls", [])
+    if not isinstance(urls, list) or not all(isinstance(url, str) for url in urls):
+        raise ConfigError(f"{path}.urls should be a list of url patterns")
+
+    return tuple(patterns + urls)
+
+
+def compile_model(name: str, cfg) -> ModelPlan:
+    model = _mapping(cfg, name)
+    engine = model.get("engine", "browser")
+    if engine not in ("browser", "http"):
+        raise ConfigError(f"{name}.engine should be browser or http, got {engine!r}")
+
+    if engine == "http":
+        return ModelPlan(name=name, engine=engine, login=None, iframe=None, steps=(), switch_to_parent_frame=False,
+                         dns=None, password_reset=None, http=_compile_http(model.get("http"), f"{name}.http"))
+
+    return ModelPlan(name=name,
+                     engine=engine,
+                     login=_compile_login(model.get("login"), f"{name}.login"),
+                     iframe=_frame(model, "iframe", name),
+                     steps=_locators(model.get("steps"), f"{name}.steps", kinds=("id", "xpath", "frame")),
+                     switch_to_parent_frame=bool(model.get("switch_to_parent_frame", False)),
+                     dns=_compile_dns(model.get("dns"), f"{name}.dns"),
+                     password_reset=_compile_password_reset(model["password_reset"], f"{name}.password_reset")
+                     if "password_reset" in model else None,
+                     http=None,
+                     block=_compile_block(model["block"], f"{name}.block") if "block" in model else (),
+                     )
+
+
+def compile_config(cfg) -> CompiledConfig:
+    """validates the whole config and compiles every model, the first problem of every model is reported"""
+    cfg = _mapping(cfg, "config")
+    errors = []
+    plans = {}
+    for name, model_cfg in _mapping(cfg.get("routers"), "routers").items():
+        try:
+            plans[name] = compile_model(name, model_cfg)
+        except ConfigError as e:
+            errors.append(str(e))
+
+    models = _mapping(cfg.get("models"), "models")
+    for model_group in models.keys():
+        if model_group not in cfg["routers"]:
+            errors.append(f"models.{model_group} has no entry in routers")
+
+    if errors:
+        raise ConfigError("\n".join(errors))
+
+    return CompiledConfig(version=str(cfg.get("version", "not_set")), models=models, plans=plans)
+
+
+def _plan_to_json(value):
+    """json form of compiled plans, plan types, tuples and dicts are tagged so they load back as they were"""
+    if isinstance(value, tuple) and hasattr(value, "_fields"):
+        return {"plan": type(value).__name__, "fields": [_plan_to_json(item) for item in value]}
+    if isinstance(value, tuple):
+        return {"tuple": [_plan_to_json(item) for item in value]}
+    if isinstance(value, list):
+        return [_plan_to_json(item) for item in value]
+    if isinstance(value, dict):
+        return {"dict": [[_plan_to_json(key), _plan_to_json(item)] for key, item in value.items()]}
+
+    return value
+
+
+def _plan_from_json(value):
+    if isinstance(value, list):
+        return [_plan_from_json(item) for item in value]
+    if not isinstance(value, dict):
+        return value
+    if "tuple" in value:
+        return tuple(_plan_from_json(item) for item in value["tuple"])
+    if "dict" in value:
+        return {_plan_from_json(key): _plan_from_json(item) for key, item in value["dict"]}
+
+    return PLAN_TYPES[value["plan"]](*(_plan_from_json(item) for item in value["fields"]))
+
+
+def load_config(config: str, cache_dir: Optional[str]) -> CompiledConfig:
+    """compiles the config file, compiled configs are cached on disk by content hash"""
+    with open(config, "rb") as f:
+        content = f.read()
+
+    cache_file = None
+    if cache_dir:
+        # json rather than pickle, whoever can write to the cache dir must not be able to run code through it
+        digest = hashlib.sha256(f"{PLAN_CACHE_FORMAT}:".encode() + content).hexdigest()
+        cache_file = os.path.join(cache_dir, f"plans-{digest}.json")
+        try:
+            with open(cache_file) as f:
+                return _plan_from_json(json.load(f))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.debug(f"Ignoring unreadable plan cache {cache_file}: {e}")
+
+    compiled = compile_config(yaml.safe_load(content))
+
+    if cache_file:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            plans = json.dumps(_plan_to_json(compiled))
+            tmp_file = f"{cache_file}.{os.getpid()}"
+            with open(tmp_file, "w") as f:
+                f.write(plans)
+            os.replace(tmp_file, cache_file)
+        except (OSError, TypeError, ValueError) as e:
+            # TypeError for yaml values json has no type for, like dates in http request data
+            logger.warning(f"Can't write plan cache {cache_file}: {e}")
+
+    return compiled
+
+
+def _map_locators(value, function: Callable):
+    """copy of a plan, or any part of it, with function applied to every locator"""
+    if isinstance(value, Locator):
+        return function(value)
+    if isinstance(value, tuple) and hasattr(value, "_fields"):
+        return value._replace(**{field: _map_locators(getattr(value, field), function) for field in value._fields})
+    if isinstance(value, tuple):
+        return tuple(_map_locators(item, function) for item in value)
+
+    return value
+
+
+def _xpath_literal(value: str) -> Optional[str]:
+    """quoted xpath string, None for values with both kinds of quotes"""
+    if '"' not in value:
+        return f'"{value}"'
+    if "'" not in value:
+        return f"'{value}'"
+
+    return None
+
+
+def apply_locator_cache(cfg: CompiledConfig, path: str) -> CompiledConfig:
+    """replaces configured xpaths with the locators optimize-locators found for them, the xpath becomes the fallback"""
+    try:
+        with open(path, "r") as f:
+            cache = json.load(f)
+    except FileNotFoundError:
+        return cfg
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable locator cache {path}: {e}")
+        return cfg
+
+    if cache.get("format") != LOCATOR_CACHE_FORMAT:
+        logger.warning(f"Ignoring locator cache {path} of another format, run optimize-locators again")
+        return cfg
+
+    replaced = 0
+
+    def optimized(locator: Locator, model_locators: dict) -> Locator:
+        nonlocal replaced
+        found = model_locators.get(locator.location) if locator.kind == "xpath" else None
+        if not found:
+            return locator
+
+        replaced += 1
+        return locator._replace(kind=found["type"], location=found["location"], fallback=locator)
+
+    plans = {name: _map_locators(plan, lambda locator: optimized(locator, cache["models"].get(name, {})))
+             for name, plan in cfg.plans.items()}
+    logger.debug(f"Using {replaced} optimized locators from {path}")
+
+    return cfg._replace(plans=plans)
+
+
+def find_element(driver: webdriver.Chrome, locator: Locator):
+    """element of the locator, or of its fallback when the optimized locator no longer matches"""
+    try:
+        return driver.find_element(locator.by, locator.location)
+    except NoSuchElementException:
+        if locator.fallback is None:
+            raise
+
+    return driver.find_element(locator.fallback.by, locator.fallback.location)
 
 
 class Element():
-    def __init__(self, driver: webdriver, element: dict):
+    def __init__(self, driver: webdriver, locator: Locator, timeout: float = WAIT_TIMEOUTS["element"],
+                 alert_timeout: float = WAIT_TIMEOUTS["alert"]):
         self.driver = driver
-        self.kind = element["type"]
-        self.loc = element["location"]
+        self.locator = locator
+        self.timeout = timeout
+        self.alert_timeout = alert_timeout
 
     def _wait(self):
         """waiter for elements"""
-        timeout = 60
-
-        logger.debug(f"Waiting for {self.kind} {self.loc}")
+        logger.debug(f"Waiting for {self.locator.kind} {self.locator.location}")
         try:
-            if self.kind == "id":
-                WebDriverWait(self.driver, timeout=timeout).until(EC.element_to_be_clickable((By.ID, self.loc)))
-
-            elif self.kind == "xpath":
-                WebDriverWait(self.driver, timeout=timeout).until(
-                    EC.element_to_be_clickable((By.XPATH, self.loc)))
-
-            else:
-                raise NotImplementedError
+            WebDriverWait(self.driver, timeout=self.timeout).until(
+                lambda d: EC.element_to_be_clickable(find_element(d, self.locator))(d))
 
         except TimeoutException:
-            logger.warning(f"Timed out waiting for {self.loc} element, apparently login failed, skipping ...")
+            logger.warning(f"Timed out waiting for {self.locator.location} element, apparently login failed, skipping ...")
             raise
 
     def click(self):
         self._wait()
-
-        if self.kind == "id":
-            self.driver.find_element(By.ID, self.loc).click()
-
-        elif self.kind == "xpath":
-            self.driver.find_element(By.XPATH, self.loc).click()
-
-        else:
-            raise NotImplementedError
+        find_element(self.driver, self.locator).click()
 
     def input(self, input_value: str, click_alert: bool = False):
         w = self._wait()
 
         if click_alert:
             self.click()
-            WebDriverWait(self.driver, timeout=10).until(EC.alert_is_present())
+            WebDriverWait(self.driver, timeout=self.alert_timeout).until(EC.alert_is_present())
             self.driver.switch_to.alert.accept()
 
-        if self.kind == "id":
-            input_element = self.driver.find_element(By.ID, self.loc)
+        input_element = find_element(self.driver, self.locator)
+        input_element.clear()
+        input_element.send_keys(input_value)
+
 
-        elif self.kind == "xpath":
-            input_element = self.driver.find_element(By.XPATH, self.loc)
+class CountingChrome(webdriver.Chrome):
+    """chrome driver that counts the WebDriver commands sent by each thread"""
+    _sent = threading.local()
+    # url patterns currently blocked through CDP, kept across routers of a pooled driver
+    blocked_urls = ()
 
+    def execute(self, driver_command: str, params: dict = None):
+        self._sent.count = getattr(self._sent, "count", 0) + 1
+        return super().execute(driver_command, params)
+
+    @classmethod
+    def commands_sent(cls) -> int:
+        return getattr(cls._sent, "count", 0)
+
+
+class Tracer:
+    """times router phases, writes them to a jsonl trace and summarizes percentiles at exit"""
+
+    def __init__(self, path: Optional[str], samples: int = 10000, metrics: Optional["Metrics"] = None) -> None:
+        self.samples = samples
+        self.metrics = metrics
+        self._file = open(path, mode="a", encoding="utf8") if path else None
+        self._lock = threading.Lock()
+        # router ip and model group, per worker thread and per playwright router task
+        self._router = contextvars.ContextVar("router", default=("", ""))
+        self._durations = defaultdict(list)
+        self._seen = Counter()
+        self._commands = Counter()
+
+    def start_router(self, router_ip: str, model_group: str) -> None:
+        self._router.set((router_ip, model_group))
+
+    @contextmanager
+    def phase(self, name: str, step: str = ""):
+        commands = CountingChrome.commands_sent()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._add(name=name, step=step, duration=time.perf_counter() - started,
+                      commands=CountingChrome.commands_sent() - commands)
+
+    def _add(self, name: str, step: str, duration: float, commands: int) -> None:
+        router_ip, model_group = self._router.get()
+        entry = {
+            "ts": time.time(),
+            "router_ip": router_ip,
+            "model_group": model_group,
+            "phase": name,
+            "step": step,
+            "duration": round(duration, 4),
+            "commands": commands,
+        }
+        with self._lock:
+            if self._file:
+                self._file.write(json.dumps(entry) + "\n")
+
+            for key in ((model_group, name), (f"step {step}", name)) if step else ((model_group, name),):
+                self._sample(key, duration)
+                self._commands[key] += commands
+
+        if self.metrics and not step:
+            self.metrics.observe(model_group, name, duration)
+
+    def _sample(self, key: tuple, duration: float) -> None:
+        """reservoir sampling keeps memory bounded on long runs"""
+        self._seen[key] += 1
+        durations = self._durations[key]
+        if len(durations) < self.samples:
+            durations.append(duration)
         else:
-            raise NotImplementedError
+            idx = random.randrange(self._seen[key])
+            if idx < self.samples:
+                durations[idx] = duration
+
+    def report(self) -> None:
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+            if not self._durations:
+                return
+
+            logger.info(f"{'scope':<40} {'phase':<22} {'count':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'cmds':>6}")
+            for key in sorted(self._durations.keys()):
+                durations = sorted(self._durations[key])
+                scope, name = key
+                logger.info(f"{scope[:40]:<40} {name:<22} {self._seen[key]:>7} "
+                            f"{percentile(durations, 50):>8.2f} {percentile(durations, 95):>8.2f} "
+                            f"{percentile(durations, 99):>8.2f} {self._commands[key] / self._seen[key]:>6.1f}")
+
+
+def percentile(sorted_values: list, pct: float) -> float:
+    idx = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[idx]
+
+
+class LatencyStats:
+    """latencies of successful waits per model group, kept across runs, wait timeouts are derived from them"""
+
+    def __init__(self, path: Optional[str], limits: dict, factor: float, floor: float, adaptive: bool) -> None:
+        self.path = path
+        self.limits = limits
+        self.factor = factor
+        self.floor = floor
+        self.adaptive = adaptive
+        self._lock = threading.Lock()
+        self._samples = defaultdict(lambda: defaultdict(list))
+        self._load()
+
+    def _load(self) -> None:
+        if not self.path:
+            return
 
-        input_element.clear()
-        input_element.send_keys(input_value)
+        try:
+            with open(self.path, "r") as f:
+                stored = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable latency stats {self.path}: {e}")
+            return
+
+        for model_group, kinds in stored.items():
+            for kind, samples in kinds.items():
+                self._samples[model_group][kind] = samples[-LATENCY_SAMPLES:]
+
+    def observe(self, model_group: str, kind: str, seconds: float) -> None:
+        with self._lock:
+            samples = self._samples[model_group][kind]
+            samples.append(round(seconds, 3))
+            if len(samples) > LATENCY_SAMPLES:
+                del samples[:-LATENCY_SAMPLES]
+
+    def timeout(self, model_group: str, kind: str) -> float:
+        """p99 of the observed waits times the safety factor, between the floor and the configured limit"""
+        limit = self.limits[kind]
+        with self._lock:
+            samples = sorted(self._samples[model_group][kind]) if self.adaptive else []
+
+        if len(samples) < LATENCY_MIN_SAMPLES:
+            return limit
+
+        return min(limit, max(self.floor, percentile(samples, 99) * self.factor))
+
+    def save(self) -> None:
+        if not self.path:
+            return
+
+        with self._lock:
+            stored = {model_group: dict(kinds) for model_group, kinds in self._samples.items()}
 
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            tmp_file = f"{self.path}.{os.getpid()}"
+            with open(tmp_file, "w") as f:
+                json.dump(stored, f)
+            os.replace(tmp_file, self.path)
+        except OSError as e:
+            logger.warning(f"Can't write latency stats {self.path}: {e}")
+
+    def report(self) -> None:
+        for model_group in sorted(self._samples.keys()):
+            timeouts = ", ".join(f"{kind} {self.timeout(model_group, kind):.1f}s" for kind in sorted(self.limits))
+            logger.debug(f"Wait timeouts for {model_group}: {timeouts}")
+
+
+class SessionCache:
+    """encrypted sessions of logged in routers, one file per router, sessions older than ttl seconds are ignored"""
+
+    def __init__(self, directory: str, key: Optional[str], ttl: int) -> None:
+        self.directory = directory
+        self.ttl = ttl
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        self._fernet = Fernet(key or self._stored_key())
+
+    def _stored_key(self) -> bytes:
+        """key generated on first use, readable by the owner only"""
+        path = os.path.join(self.directory, "session.key")
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            with open(path, "rb") as f:
+                return f.read().strip()
+
+        key = Fernet.generate_key()
+        with os.fdopen(fd, "wb") as f:
+            f.write(key)
+        return key
+
+    def _path(self, key: tuple) -> str:
+        # router addresses are not kept in file names either
+        return os.path.join(self.directory, hashlib.sha256(json.dumps(key).encode()).hexdigest())
+
+    def load(self, key: tuple) -> Optional[dict]:
+        try:
+            with open(self._path(key), "rb") as f:
+                token = f.read()
+        except FileNotFoundError:
+            return None
+
+        try:
+            return json.loads(self._fernet.decrypt(token, ttl=self.ttl))
+        except (InvalidToken, ValueError):
+            # expired, or encrypted with another key
+            self.drop(key)
+            return None
+
+    def save(self, key: tuple, session: dict) -> None:
+        path = self._path(key)
+        tmp_file = f"{path}.{os.getpid()}.{threading.get_ident()}"
+        try:
+            with os.fdopen(os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "wb") as f:
+                f.write(self._fernet.encrypt(json.dumps(session).encode()))
+            os.replace(tmp_file, path)
+        except OSError as e:
+            logger.warning(f"Can't write session cache {path}: {e}")
+
+    def drop(self, key: tuple) -> None:
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+
+class Supervisor:
+    """watches the process trees of the drivers, kills the ones over their memory or time caps and owns Xvfb displays"""
+
+    def __init__(self, max_rss: int, max_session: float, xvfb: bool) -> None:
+        self.max_rss = max_rss  # bytes, 0 disables the cap
+        self.max_session = max_session  # seconds a router may hold a browser, 0 disables the cap
+        self.xvfb = xvfb
+        self._lock = threading.Lock()
+        # start of the current router of every tracked driver pid, None while the driver is idle
+        self._sessions = {}
+        self._local = threading.local()
+        self._displays = []
+        self._next_display = XVFB_FIRST_DISPLAY
+        self._stopped = threading.Event()
+        threading.Thread(target=self._run, name="supervisor", daemon=True).start()
+
+    def track(self, pid: int) -> None:
+        with self._lock:
+            self._sessions[pid] = None
+
+    def session_started(self, pid: int) -> None:
+        with self._lock:
+            if pid in self._sessions:
+                self._sessions[pid] = time.monotonic()
+
+    def session_ended(self, pid: int) -> None:
+        with self._lock:
+            if pid in self._sessions:
+                self._sessions[pid] = None
+
+    def retire(self, pid: int, quit_driver: Callable) -> None:
+        """quits a driver, then kills whatever is left of its process tree"""
+        with self._lock:
+            self._sessions.pop(pid, None)
+
+        tree = self._tree(pid)
+        try:
+            quit_driver()
+        except Exception:
+            pass
+        self._kill(tree)
+
+    def display(self) -> Optional[str]:
+        """Xvfb display of the current worker, started on first use"""
+        if not self.xvfb:
+            return None
+
+        display = getattr(self._local, "display", None)
+        if display is None:
+            with self._lock:
+                while os.path.exists(f"/tmp/.X{self._next_display}-lock"):
+                    self._next_display += 1
+                display = f":{self._next_display}"
+                self._next_display += 1
+
+            try:
+                xvfb = subprocess.Popen(["Xvfb", display, "-nolisten", "tcp"],
+                                        stdout=subprocess.DEVNULL,
+                                        stderr=subprocess.DEVNULL,
+                                        preexec_fn=preexec_function
+                                        )
+            except OSError as e:
+                logger.warning(f"Can't start Xvfb: {e}, browsers will use the default display")
+                self.xvfb = False
+                return None
+
+            logger.debug(f"Started Xvfb on display {display}")
+            with self._lock:
+                self._displays.append(xvfb)
+            self._local.display = display
+
+        return display
+
+    @staticmethod
+    def _tree(pid: int) -> list:
+        try:
+            process = psutil.Process(pid)
+            return [process] + process.children(recursive=True)
+        except psutil.Error:
+            return []
+
+    @staticmethod
+    def _kill(processes: list) -> None:
+        for process in processes:
+            try:
+                process.kill()
+            except psutil.Error:
+                pass
+        psutil.wait_procs(processes, timeout=5)
+
+    def _run(self) -> None:
+        while not self._stopped.wait(SUPERVISOR_INTERVAL):
+            try:
+                self.check()
+            except Exception:
+                logger.exception("Supervisor check failed")
+
+    def check(self) -> None:
+        """kills driver trees over the caps, the pool replaces them after their router fails, and reaps zombies"""
+        now = time.monotonic()
+        with self._lock:
+            sessions = list(self._sessions.items())
+
+        for pid, started in sessions:
+            tree = self._tree(pid)
+            if not tree:
+                continue
+
+            rss = 0
+            for process in tree:
+                try:
+                    rss += process.memory_info().rss
+                except psutil.Error:
+                    pass
+
+            if self.max_rss and rss > self.max_rss:
+                reason = f"uses {rss // 1024 // 1024} MB"
+            elif self.max_session and started is not None and now - started > self.max_session:
+                reason = f"has been on one router for {now - started:.0f} seconds"
+            else:
+                continue
+
+            logger.warning(f"Browser of driver {pid} {reason}, killing it")
+            with self._lock:
+                self._sessions.pop(pid, None)
+            self._kill(tree)
+
+        self._reap()
+
+    @staticmethod
+    def _reap() -> None:
+        for child in psutil.Process().children():
+            try:
+                if child.status() == psutil.STATUS_ZOMBIE:
+                    child.wait(timeout=0)
+            except (psutil.Error, psutil.TimeoutExpired):
+                pass
+
+    def close(self) -> None:
+        """kills every tracked tree, the Xvfb displays and any other process this one started"""
+        self._stopped.set()
+        with self._lock:
+            pids, self._sessions = list(self._sessions), {}
+            displays, self._displays = self._displays, []
+
+        for pid in pids:
+            self._kill(self._tree(pid))
+
+        for xvfb in displays:
+            xvfb.terminate()
+            try:
+                xvfb.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                xvfb.kill()
+                xvfb.wait()
+
+        self._kill(psutil.Process().children(recursive=True))
+
+
+class DriverPool:
+    """keeps one warmed browser per worker thread and resets it between routers"""
+
+    def __init__(self, driver_path: str, driver_options: Options, max_uses: int, tracer: Tracer,
+                 supervisor: Supervisor) -> None:
+        self.driver_path = driver_path
+        self.driver_options = driver_options
+        self.max_uses = max_uses
+        self.tracer = tracer
+        self.supervisor = supervisor
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._drivers = []
+
+    def acquire(self) -> webdriver.Chrome:
+        driver = getattr(self._local, "driver", None)
+        if driver is None:
+            logger.debug("Starting browser")
+            display = self.supervisor.display()
+            with self.tracer.phase("browser_start"):
+                # a service binds its own port, so it can't be shared between drivers
+                service = Service(self.driver_path, env={**os.environ, "DISPLAY": display} if display else None)
+                driver = CountingChrome(service=service, options=self.driver_options)
+            self.supervisor.track(driver.service.process.pid)
+            self._local.driver = driver
+            self._local.uses = 0
+            with self._lock:
+                self._drivers.append(driver)
+
+        self.supervisor.session_started(driver.service.process.pid)
+        return driver
+
+    def release(self, driver: webdriver.Chrome, broken: bool = False) -> None:
+        self._local.uses += 1
+        if broken or self._local.uses >= self.max_uses or not self._reset(driver):
+            logger.debug(f"Recycling browser after {self._local.uses} uses")
+            self._local.driver = None
+            self._quit(driver)
+        else:
+            self.supervisor.session_ended(driver.service.process.pid)
+
+    def close(self) -> None:
+        with self._lock:
+            drivers, self._drivers = self._drivers, []
+
+        for driver in drivers:
+            self.supervisor.retire(driver.service.process.pid, driver.quit)
+
+    def _quit(self, driver: webdriver.Chrome) -> None:
+        with self._lock:
+            if driver in self._drivers:
+                self._drivers.remove(driver)
+
+        self.supervisor.retire(driver.service.process.pid, driver.quit)
+
+    @staticmethod
+    def _reset(driver: webdriver.Chrome) -> bool:
+        """drops everything the previous router left behind, returns False if the browser is unusable"""
+        try:
+            try:
+                driver.switch_to.alert.dismiss()
+            except NoAlertPresentException:
+                pass
+
+            handles = driver.window_handles
+            for handle in handles[1:]:
+                driver.switch_to.window(handle)
+                driver.close()
+            driver.switch_to.window(handles[0])
+
+            try:
+                driver.execute_script("window.localStorage.clear(); window.sessionStorage.clear();")
+            except WebDriverException:
+                pass  # storage is not accessible on error and blank pages
+
+            driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+            # basic auth credentials are cached per origin, leaving the origin drops them
+            driver.get("about:blank")
+        except WebDriverException as e:
+            logger.warning(f"Browser reset failed: {e.msg}")
+            return False
+
+        return True
+
+
+def _error_message(e: Exception) -> str:
+    """message of a webdriver or playwright error"""
+    return getattr(e, "msg", None) or getattr(e, "message", None) or str(e)
+
+
+class BrowserRouter:
+    """model steps of a router, shared by the browser engines, which only implement the element primitives"""
+    engine = ""
 
-class Router:
     def __init__(self,
-                 cfg: dict,
+                 plan: ModelPlan,
                  router_ip: str,
                  router_port: str,
                  router_user: str,
                  router_password: str,
-                 dns_servers: list,
-                 driver_srv: Optional[Service],
-                 driver_options: Optional[Options],
+                 dns_servers: tuple,
+                 tracer: Tracer,
+                 latency: LatencyStats,
+                 fill_mode: str = "fields",
+                 skip_compliant: bool = False,
+                 sessions: Optional[SessionCache] = None,
                  ) -> None:
-        self.cfg = cfg
+        self.plan = plan
+        self.sessions = sessions
+        self.tracer = tracer
+        self.latency = latency
+        self.skip_compliant = skip_compliant
+        # set when the dns settings already matched and were not submitted
+        self.compliant = False
+        # set once the new password was submitted, the router is not logged into again with the old one
+        self.password_submitted = False
+        # class of the first failure
+        self.failure = ""
+        self.fill_mode = plan.dns.fill or fill_mode
         self.router_ip = router_ip
         self.router_port = router_port
         self.router_user = router_user
         self.router_password = router_password
-        self.dns_servers = dns_servers
+        self.dns_servers = tuple(dns_servers)
         if self.router_port == "443":
             self.router_proto = "https"
         else:
             self.router_proto = "http"
-        if "basic" in self.cfg["login"] and self.cfg["login"]["basic"]:
-            self.router_url = f"{self.router_proto}://{self.router_user}:{self.router_password}@{self.router_ip}:{self.router_port}"
-        else:
-            self.router_url = f"{self.router_proto}://{self.router_ip}:{self.router_port}"
-        self.driver = webdriver.Chrome(service=driver_srv, options=driver_options)
-        # self.driver.set_page_load_timeout(60)
+        self.router_url = f"{self.router_proto}://{self.router_ip}:{self.router_port}"
+        self.session_key = (self.engine, router_ip, router_port, router_user)
 
-    def __del__(self):
-        try:
-            self.driver.close()
-        except:
-            pass
+    # element primitives of the engines
+    async def _goto(self, url: str) -> None:
+        raise NotImplementedError
 
-    def _waiter(self, element: dict) -> bool:
-        """waiter for elements"""
-        timeout = 60
-        type = element["type"]
-        loc = element["location"]
-        logger.debug(f"Waiting for {type} {loc}")
-        try:
-            if type == "id":
-                WebDriverWait(self.driver, timeout=timeout).until(lambda d: d.find_element(By.ID, loc))
-            elif type == "xpath":
-                WebDriverWait(self.driver, timeout=timeout).until(lambda d: d.find_element(By.XPATH, loc))
-            else:
-                logger.error(f"Not implemented")
-                return False
-        except TimeoutException:
-            logger.warning(f"Timed out waiting for {loc} element, apparently login failed, skipping ...")
+    async def _url(self) -> str:
+        raise NotImplementedError
+
+    async def _page_time(self) -> list:
+        """performance.timeOrigin and performance.now() of the current frame"""
+        raise NotImplementedError
+
+    async def _block_resources(self) -> None:
+        raise NotImplementedError
+
+    async def _wait_present(self, locator: Locator, timeout: float) -> None:
+        """raises a timeout error when the element doesn't show up"""
+        raise NotImplementedError
+
+    async def _wait_until(self, wait_for: WaitFor, timeout: float, mark: PageMark) -> bool:
+        """waits for a completion condition other than a sleep, False when it was not met"""
+        raise NotImplementedError
+
+    async def _wait_alert(self, timeout: float) -> None:
+        """waits for an alert and accepts it"""
+        raise NotImplementedError
+
+    async def _click(self, locator: Locator) -> None:
+        raise NotImplementedError
+
+    async def _input(self, locator: Locator, input_value: str, click_alert: bool = False) -> None:
+        raise NotImplementedError
+
+    async def _fill(self, locator: Locator, value: str) -> None:
+        """fills a present input without waiting, raises NoSuchElementException when it is missing"""
+        raise NotImplementedError
+
+    async def _fill_script(self, fields: list) -> list:
+        """fills [kind, location, value] fields with FILL_FIELDS_SCRIPT, returns the values read back"""
+        raise NotImplementedError
+
+    async def _value(self, locator: Locator) -> str:
+        raise NotImplementedError
+
+    async def _select(self, locator: Locator, value: str) -> None:
+        raise NotImplementedError
+
+    async def _switch_to_frame(self, reference) -> None:
+        """raises NoSuchFrameException when the frame is missing"""
+        raise NotImplementedError
+
+    async def _switch_to_parent_frame(self) -> None:
+        raise NotImplementedError
+
+    async def _switch_to_default_content(self) -> None:
+        raise NotImplementedError
+
+    async def _restore_session(self, session: dict) -> None:
+        raise NotImplementedError
+
+    async def _read_session(self) -> dict:
+        raise NotImplementedError
+
+    async def _clear_session(self) -> None:
+        raise NotImplementedError
+
+    async def _waiter(self, locator: Locator, failure: Optional[str] = FAILURE_TIMEOUT) -> bool:
+        """waiter for elements, an element that doesn't show up in time is a timeout unless failure says otherwise"""
+        timeout = self.latency.timeout(self.plan.name, "element")
+        logger.debug(f"Waiting up to {timeout:.1f}s for {locator.kind} {locator.location}")
+        started = time.monotonic()
+        try:
+            with self.tracer.phase("wait", step=locator.location):
+                await self._wait_present(locator, timeout)
+        except BROWSER_TIMEOUTS:
+            logger.warning(f"Timed out waiting for {locator.location} element, skipping ...")
+            if failure:
+                self._fail(failure)
             return False
 
+        self.latency.observe(self.plan.name, "element", time.monotonic() - started)
         return True
 
-    def reset_dns(self) -> bool:
-        res = self.open_main_page()
-        if not res:
+    async def _accept_alert(self) -> None:
+        started = time.monotonic()
+        await self._wait_alert(self.latency.timeout(self.plan.name, "alert"))
+        self.latency.observe(self.plan.name, "alert", time.monotonic() - started)
+
+    async def _mark(self, wait_for: Optional[WaitFor]) -> PageMark:
+        """taken before the click that _settle waits for, the page clock is only read for network_idle"""
+        if wait_for and wait_for.condition == "network_idle":
+            return PageMark(await self._url(), *await self._page_time())
+
+        return PageMark(await self._url())
+
+    async def _settle(self, wait_for: Optional[WaitFor], timeout: float, mark: PageMark) -> None:
+        """waits until the configured completion condition is met, timeout is an upper bound"""
+        if not wait_for:
+            with self.tracer.phase("settle", step="sleep"):
+                await asyncio.sleep(timeout)
+            return
+
+        condition = wait_for.condition
+        with self.tracer.phase("settle", step=condition):
+            met = await self._wait_until(wait_for, timeout, mark)
+        if met:
+            logger.debug(f"Condition {condition} met")
+        else:
+            logger.debug(f"Condition {condition} was not met in {timeout} seconds, moving on")
+
+    def _fail(self, failure: str) -> bool:
+        self.failure = self.failure or failure
+        return False
+
+    async def _run(self, new_password: Optional[str], verify: bool) -> bool:
+        """logs in once, then updates dns, reads it back, changes the password and reboots, as requested"""
+        if new_password and not self.plan.password_reset:
+            logger.error(f"Password reset is not configured for {self.plan.name}, skipping...")
             return False
 
-        if not "basic" in self.cfg["login"]:
-            res = self.do_login()
+        with self.tracer.phase("open_main_page"):
+            res = await self.open_main_page()
+        if not res:
+            return self._fail(FAILURE_CONNECTION)
+
+        if not self.plan.login.basic and not await self.resume_session():
+            with self.tracer.phase("do_login"):
+                res = await self.do_login()
 
             if not res:
-                return False
+                return self._fail(FAILURE_LOGIN)
+            await self.save_session()
 
-        res = self.open_dns_page()
-        if not res:
-            return False
+        if self.dns_servers:
+            with self.tracer.phase("open_dns_page"):
+                res = await self.open_dns_page()
+            if not res:
+                return self._fail(FAILURE_ELEMENT)
 
-        res = self.update_dns_settings()
-        if not res:
-            return False
+            with self.tracer.phase("update_dns_settings"):
+                res = await self.update_dns_settings()
+            if not res:
+                return self._fail(FAILURE_ELEMENT)
+
+            if verify and not self.compliant:
+                with self.tracer.phase("verify_dns"):
+                    res = await self.verify_dns()
+                if not res:
+                    return self._fail(FAILURE_VERIFY)
+
+        if new_password:
+            # the next action navigates from the top document of the page the previous one ended on
+            await self._switch_to_default_content()
+            with self.tracer.phase("open_password_change_page"):
+                await self.open_password_change_page()
+
+            with self.tracer.phase("change_password"):
+                await self.change_password(new_password)
+
+            if self.plan.password_reset.reboot:
+                with self.tracer.phase("reboot"):
+                    await self.reboot()
+
+            # the password, or the reboot, ended the session
+            if self.sessions:
+                self.sessions.drop(self.session_key)
 
         return True
 
-    def open_main_page(self) -> bool:
+    async def open_main_page(self) -> bool:
+        await self._block_resources()
         try:
-            self.driver.get(self.router_url)
-        except WebDriverException:
-            self.driver.close()
+            await self._goto(self.router_url)
+        except BROWSER_ERRORS:
             logger.warning(f"Connection to {self.router_ip} failed, skipping...")
             return False
 
         return True
 
-    # login wrapper
-    def do_login(self) -> bool:
-        res = False
-        # both username and password are present
-        if "username" in self.cfg["login"] and "password" in self.cfg["login"]:
-            res = self._do_login_with_login_and_password()
+    async def resume_session(self) -> bool:
+        """restores the cached session and confirms it with check_login, the page is left logged out otherwise"""
+        if not self.sessions or not self.plan.login.check_login:
+            return False
+
+        session = self.sessions.load(self.session_key)
+        if session is None:
+            return False
 
-        # only password is present
-        if not "username" in self.cfg["login"] and "password" in self.cfg["login"]:
-            res = self._do_login_with_password_only()
+        with self.tracer.phase("resume_session"):
+            try:
+                await self._restore_session(session)
+                await self._goto(self.router_url)
+                resumed = await self._check_login()
+            except BROWSER_ERRORS as e:
+                logger.warning(f"Can't restore the cached session: {_error_message(e)}")
+                resumed = False
+
+            if resumed:
+                logger.info("Resumed the cached session")
+                return True
+
+            logger.info("Cached session has expired, logging in")
+            self.sessions.drop(self.session_key)
+            await self._clear_session()
+            await self._goto(self.router_url)
+
+        return False
+
+    async def _check_login(self) -> bool:
+        login = self.plan.login
+        try:
+            if login.iframe is not None:
+                await self._switch_to_frame(login.iframe)
+            if login.check_login_iframe is not None:
+                await self._switch_to_frame(login.check_login_iframe)
+        except NoSuchFrameException:
+            return False
 
+        # a cached session that expired is no failure, the router is logged into again
+        res = await self._waiter(locator=login.check_login, failure=None)
+        await self._switch_to_default_content()
         return res
 
+    async def save_session(self) -> None:
+        # a cached session that can't be confirmed is never used
+        if not self.sessions or not self.plan.login.check_login:
+            return
+
+        try:
+            self.sessions.save(self.session_key, await self._read_session())
+        except BROWSER_ERRORS as e:
+            logger.warning(f"Can't read the session: {_error_message(e)}")
+
+    # login wrapper
+    async def do_login(self) -> bool:
+        if self.plan.login.username:
+            return await self._do_login_with_login_and_password()
+
+        return await self._do_login_with_password_only()
+
     # password only login
-    def _do_login_with_password_only(self) -> bool:
-        if "iframe" in self.cfg["login"]:
-            self.driver.switch_to.frame(self.cfg["login"]["iframe"])
+    async def _do_login_with_password_only(self) -> bool:
+        login = self.plan.login
+        if login.iframe is not None:
+            await self._switch_to_frame(login.iframe)
 
-        w = self._waiter(element=self.cfg["login"]["password"])
+        w = await self._waiter(locator=login.password)
         if not w:
-            logger.warning(
-                f"Timed out waiting for {self.cfg['login']['password']['location']}, skipping...")
+            logger.warning(f"Timed out waiting for {login.password.location}, skipping...")
             return False
 
-        password_input = Element(driver=self.driver, element=self.cfg["login"]["password"])
-        password_input.input(input_value=self.router_password)
+        await self._input(locator=login.password, input_value=self.router_password)
+        await self._click(locator=login.submit)
 
-        Element(driver=self.driver, element=self.cfg["login"]["submit"]).click()
-
-        if "iframe" in self.cfg["login"]:
-            self.driver.switch_to.parent_frame()
+        if login.iframe is not None:
+            await self._switch_to_parent_frame()
 
         return True
 
     # common login with username and password
-    def _do_login_with_login_and_password(self) -> bool:
+    async def _do_login_with_login_and_password(self) -> bool:
+        login = self.plan.login
 
         logger.info(f"Username: {self.router_user}")
         logger.info(f"Password: {self.router_password}")
 
-        if "iframe" in self.cfg["login"]:
-            self.driver.switch_to.frame(self.cfg["login"]["iframe"])
-
-        username_input = Element(driver=self.driver, element=self.cfg["login"]["username"])
-        username_input.input(input_value=self.router_user)
+        if login.iframe is not None:
+            await self._switch_to_frame(login.iframe)
 
-        password_input = Element(driver=self.driver, element=self.cfg["login"]["password"])
-        password_input.input(input_value=self.router_password)
+        await self._input(locator=login.username, input_value=self.router_user)
+        await self._input(locator=login.password, input_value=self.router_password)
 
-        Element(driver=self.driver, element=self.cfg["login"]["submit"]).click()
+        mark = await self._mark(login.wait_for)
+        await self._click(locator=login.submit)
 
-        sleep(2)
+        await self._settle(wait_for=login.wait_for, timeout=2, mark=mark)
         # check if login was successful
-        if "check_login" in self.cfg["login"]:
-            if "iframe" in self.cfg["login"]["check_login"].keys():
-                self.driver.switch_to.frame(self.cfg["login"]["check_login"]["iframe"])
+        if login.check_login:
+            if login.check_login_iframe is not None:
+                await self._switch_to_frame(login.check_login_iframe)
 
-            w = self._waiter(element=self.cfg["login"]["check_login"])
+            # the page after a wrong password doesn't have it either, retrying won't help
+            w = await self._waiter(locator=login.check_login, failure=FAILURE_LOGIN)
             if not w:
                 logger.error(f"Login failed, skipping...")
                 return False
 
-            if "iframe" in self.cfg["login"].keys():
-                self.driver.switch_to.parent_frame()
+            if login.iframe is not None:
+                await self._switch_to_parent_frame()
 
-        if "iframe" in self.cfg["login"]:
-            self.driver.switch_to.parent_frame()
+        if login.iframe is not None:
+            await self._switch_to_parent_frame()
 
         logger.info(f"Logged in")
         return True
 
-    def open_dns_page(self) -> bool:
-        if "iframe" in self.cfg.keys():
-            self.driver.switch_to.frame(self.cfg["iframe"])
-            logger.debug(f"Switched to frame {self.cfg['iframe']}")
+    async def open_dns_page(self) -> bool:
+        if self.plan.iframe is not None:
+            await self._switch_to_frame(self.plan.iframe)
+            logger.debug(f"Switched to frame {self.plan.iframe}")
 
-        for step in self.cfg["steps"]:
-            w = self._waiter(element=step)
-            if not w:
-                logger.error(f"Element {step['location']} was not found, skipping router...")
+        for step in self.plan.steps:
+            with self.tracer.phase("step", step=step.location):
+                res = await self._do_step(step)
+            if not res:
                 return False
 
-            if step["type"] == "id":
-                try:
-                    self.driver.find_element(By.ID, step["location"]).click()
-                except TimeoutException:
-                    logger.error(f"Timed out waiting for step {step['location']}, skipping...")
-                    return False
-                if "value" in step.keys():
-                    try:
-                        value_mode = self.driver.find_element(By.ID, step["location"])
-                        value_mode = Select(value_mode)
-                        value_mode.select_by_value(str(step["value"]))
-                    except TimeoutException:
-                        logger.error(f"Timed out waiting for step {step['location']}, skipping...")
-
-            if step["type"] == "frame":
-                try:
-                    self.driver.switch_to.parent_frame()
-                    #                    fr = self.driver.findElementById(step["location"])
-                    self.driver.switch_to.frame(step["location"])
-                    logger.debug(f"Switched to frame {step['location']}")
-                except NameError:
-                    logger.error(f"Can't switch to frame:  {step['location']}, skipping...{(NameError)}")
-                    return False
-            elif step["type"] == "xpath":
-                try:
-                    self.driver.find_element(By.XPATH, step["location"]).click()
-                except TimeoutException:
-                    logger.error(f"Timed out waiting for step {step['location']}, skipping...")
-                    return False
-
-        if "switch_to_parent_frame" in self.cfg.keys() and self.cfg["switch_to_parent_frame"]:
-            self.driver.switch_to.parent_frame()
+        if self.plan.switch_to_parent_frame:
+            await self._switch_to_parent_frame()
             logger.debug(f"Switched to parent frame")
 
         return True
 
-    def open_password_change_page(self):
-        if "iframe" in self.cfg["password_reset"]["goto"]:
-            self.driver.switch_to.frame(frame_reference=self.cfg["password_reset"]["goto"]["iframe"])
+    async def _do_step(self, step: Locator) -> bool:
+        if step.kind == "frame":
+            try:
+                await self._switch_to_parent_frame()
+                await self._switch_to_frame(step.location)
+                logger.debug(f"Switched to frame {step.location}")
+            except NoSuchFrameException:
+                logger.error(f"Can't switch to frame: {step.location}, skipping...")
+                return False
+
+            return True
+
+        w = await self._waiter(locator=step)
+        if not w:
+            logger.error(f"Element {step.location} was not found, skipping router...")
+            return False
 
-        for step in self.cfg["password_reset"]["goto"]["steps"]:
-            logger.debug(f"Step {step}")
+        try:
+            await self._click(locator=step)
+        except BROWSER_TIMEOUTS:
+            logger.error(f"Timed out waiting for step {step.location}, skipping...")
+            return False
 
-            el = Element(driver=self.driver, element=step)
-            el.click()
-            logger.info(f"Step {step} passed")
+        if step.kind == "id" and step.value is not None:
+            try:
+                await self._select(step, step.value)
+            except BROWSER_TIMEOUTS:
+                logger.error(f"Timed out waiting for step {step.location}, skipping...")
 
-        if "iframe" in self.cfg["password_reset"]["goto"]:
-            self.driver.switch_to.parent_frame()
+        return True
 
-    def set_dhcp_mode(self):
-        if "check_dhcp_mode" in self.cfg["dns"]:
-            w = self._waiter(element=self.cfg["dns"]["check_dhcp_mode"])
-            if not w:
-                return False
+    async def open_password_change_page(self) -> None:
+        password_reset = self.plan.password_reset
+        if password_reset.goto_iframe is not None:
+            await self._switch_to_frame(password_reset.goto_iframe)
 
-            if self.cfg["dns"]["check_dhcp_mode"]["type"] == "id":
-                dhcp_mode = self.driver.find_element(By.ID, self.cfg["dns"]["check_dhcp_mode"]["location"])
+        for step in password_reset.goto_steps:
+            logger.debug(f"Step {step.location}")
 
-            elif self.cfg["dns"]["check_dhcp_mode"]["type"] == "xpath":
-                dhcp_mode = self.driver.find_element(By.XPATH, self.cfg["dns"]["check_dhcp_mode"]["location"])
+            await self._click(locator=step)
+            logger.info(f"Step {step.location} passed")
 
-            if dhcp_mode.get_attribute("value") != self.cfg["dns"]["update_dhcp_mode"]["value"]:
-                logger.info("Updating DHCP mode")
-                dhcp_mode = Select(dhcp_mode)
-                try:
-                    dhcp_mode.select_by_value(str(self.cfg["dns"]["update_dhcp_mode"]["value"]))
-                except NoSuchElementException as e:
-                    logger.error(e)
-                    return False
+        if password_reset.goto_iframe is not None:
+            await self._switch_to_parent_frame()
+
+    async def _read_dhcp_mode(self) -> Optional[str]:
+        """value of the dhcp mode select, None if it is missing"""
+        if not await self._waiter(locator=self.plan.dns.check_dhcp_mode):
+            return None
+
+        return await self._value(self.plan.dns.check_dhcp_mode)
+
+    async def set_dhcp_mode(self, dhcp_mode: Optional[str]) -> bool:
+        """selects the configured dhcp mode, dhcp_mode is the value read by _read_dhcp_mode"""
+        dns = self.plan.dns
+        if dns.check_dhcp_mode and dhcp_mode != dns.dhcp_mode:
+            logger.info("Updating DHCP mode")
+            try:
+                await self._select(dns.check_dhcp_mode, dns.dhcp_mode)
+            except (NoSuchElementException, PlaywrightError) as e:
+                logger.error(_error_message(e))
+                return False
 
         return True
 
-    def update_dns_settings(self) -> bool:
-        logger.info(f"Updating DNS server settings")
+    def _dns_field_values(self) -> list:
+        """(locator, value) of every dns input, octet inputs included, fields past the given servers are left alone"""
+        fields = []
+        for locators, dns_server in zip(self.plan.dns.fields, self.dns_servers):
+            if self.plan.dns.split_octets:
+                fields += zip(locators, dns_server.split("."))
+            else:
+                fields.append((locators[0], dns_server))
 
-        if "iframe" in self.cfg["dns"].keys():
-            self.driver.switch_to.frame(self.cfg["dns"]["iframe"])
+        return fields
 
-        res = self.set_dhcp_mode()
-        if not res:
+    async def _fill_dns_fields(self) -> bool:
+        for locator, value in self._dns_field_values():
+            if not self.plan.dns.split_octets and not await self._waiter(locator=locator):
+                return False
+
+            try:
+                await self._fill(locator, value)
+            except NoSuchElementException:
+                logger.error(f"Element {locator.location} was not found, skipping...")
+                return False
+
+        return True
+
+    async def _fill_dns_fields_with_script(self, fields: list) -> bool:
+        """fills every dns field in a single browser call, returns False if the fields should be filled one by one"""
+        try:
+            values = await self._fill_script([[loc.kind, loc.location, value] for loc, value in fields])
+        except BROWSER_ERRORS as e:
+            logger.warning(f"Filling DNS fields by script failed: {_error_message(e)}, falling back to filling one by one")
             return False
 
-        dns_fields_num = len([k for k in self.cfg["dns"].keys() if k.startswith("dns_")])
-        for dns_idx in range(dns_fields_num):
-            if self.cfg["dns"]["split_octets"]:
-                octets = self.dns_servers[dns_idx].split(".")
-
-                for idx, loc in enumerate(self.cfg["dns"][f"dns_{dns_idx + 1}"]["location"]):
-                    if self.cfg["dns"][f"dns_{dns_idx + 1}"]["type"] == "id":
-                        try:
-                            octet_input = self.driver.find_element(By.ID, loc)
-                        except NoSuchElementException:
-                            logger.error(f"Element {loc} was not found, skipping...")
-                            return False
-                        octet_input.clear()
-                        octet_input.send_keys(octets[idx])
-
-                    elif self.cfg["dns"][f"dns_{dns_idx + 1}"]["type"] == "xpath":
-                        try:
-                            octet_input = self.driver.find_element(By.XPATH, loc)
-                        except NoSuchElementException:
-                            logger.error(f"Element {loc} was not found, skipping...")
-                            return False
-                        octet_input.clear()
-                        octet_input.send_keys(octets[idx])
+        expected = [value for _, value in fields]
+        if values != expected:
+            logger.warning(f"DNS fields read back as {values} instead of {expected}, falling back to filling one by one")
+            return False
 
-            else:
-                loc = self.cfg["dns"][f"dns_{dns_idx + 1}"]["location"]
-                w = self._waiter(element=self.cfg["dns"][f"dns_{dns_idx + 1}"])
-                if not w:
-                    return False
+        return True
+
+    async def update_dns_settings(self) -> bool:
+        dns = self.plan.dns
 
-                if self.cfg["dns"][f"dns_{dns_idx + 1}"]["type"] == "id":
-                    octet_input = self.driver.find_element(By.ID, loc)
-                    octet_input.clear()
-                    octet_input.send_keys(self.dns_servers[dns_idx])
+        if dns.iframe is not None:
+            await self._switch_to_frame(dns.iframe)
+
+        # read once, the compliance check and set_dhcp_mode would otherwise both wait for a missing select
+        dhcp_mode = None
+        if dns.check_dhcp_mode:
+            dhcp_mode = await self._read_dhcp_mode()
+            if dhcp_mode is None:
+                return False
+
+        if self.skip_compliant and (not dns.check_dhcp_mode or dhcp_mode == dns.dhcp_mode) \
+                and await self._read_dns_fields() == self.dns_servers[:len(dns.fields)]:
+            logger.info("DNS settings are already compliant, not submitting")
+            self.compliant = True
+            return True
+
+        logger.info(f"Updating DNS server settings")
+        res = await self.set_dhcp_mode(dhcp_mode)
+        if not res:
+            return False
+
+        if self.fill_mode == "script":
+            fields = self._dns_field_values()
+            # the per-field path waits for every non split field, a single wait for the first one is enough here
+            if not await self._waiter(locator=fields[0][0]):
+                return False
+            filled = await self._fill_dns_fields_with_script(fields)
+        else:
+            filled = False
 
-                elif self.cfg["dns"][f"dns_{dns_idx + 1}"]["type"] == "xpath":
-                    octet_input = self.driver.find_element(By.XPATH, loc)
-                    octet_input.clear()
-                    octet_input.send_keys(self.dns_servers[dns_idx])
+        if filled:
+            logger.debug("DNS fields were filled by script")
+        elif not await self._fill_dns_fields():
+            return False
 
-        w = self._waiter(element=self.cfg["dns"]["submit"])
+        w = await self._waiter(locator=dns.submit)
         if not w:
             return False
 
-        Element(driver=self.driver, element=self.cfg["dns"]["submit"]).click()
+        mark = await self._mark(dns.wait_for)
+        await self._click(locator=dns.submit)
         logger.info("DNS settings were updated")
 
-        if "wait" in self.cfg["dns"]["submit"]:
-            logger.info(f"Waiting {self.cfg['dns']['submit']['wait']} seconds")
-            sleep(self.cfg["dns"]["submit"]["wait"])
-        else:
-            sleep(5)
+        logger.info(f"Waiting up to {dns.wait} seconds")
+        await self._settle(wait_for=dns.wait_for, timeout=dns.wait, mark=mark)
 
         return True
 
-    def reset_password(self, password: str) -> bool:
-        logger.info(f"Resetting password")
-        res = self.open_main_page()
-        if not res:
-            return False
+    async def _read_dns_fields(self) -> Optional[tuple]:
+        """values of the dns inputs, octets of split fields joined, None if an input is missing"""
+        values = []
+        for locator, _ in self._dns_field_values():
+            if not await self._waiter(locator=locator):
+                return None
+            values.append(await self._value(locator))
 
-        if not "basic" in self.cfg["login"]:
-            res = self.do_login()
+        if not self.plan.dns.split_octets:
+            return tuple(values)
 
-            if not res:
-                return False
+        return tuple(".".join(values[idx:idx + 4]) for idx in range(0, len(values), 4))
 
-        self.open_password_change_page()
+    async def verify_dns(self) -> bool:
+        """opens the dns page again and checks the saved servers"""
+        await self._switch_to_default_content()
+        if not await self.open_dns_page():
+            return False
 
-        if "iframe" in self.cfg["password_reset"]["form"]:
-            self.driver.switch_to.frame(frame_reference=self.cfg["password_reset"]["form"]["iframe"])
+        if self.plan.dns.iframe is not None:
+            await self._switch_to_frame(self.plan.dns.iframe)
 
-        if "current_username" in self.cfg["password_reset"]["form"]["input"]:
-            Element(self.driver, element=self.cfg["password_reset"]["form"]["input"]["current_username"]).input(input_value=self.router_user)
+        values = await self._read_dns_fields()
+        if values is None:
+            return self._fail(FAILURE_ELEMENT)
 
-        if "current_password" in self.cfg["password_reset"]["form"]["input"]:
-            Element(self.driver, element=self.cfg["password_reset"]["form"]["input"]["current_password"]).input(input_value=self.router_password)
+        if values != self.dns_servers[:len(self.plan.dns.fields)]:
+            logger.error(f"DNS servers read back as {values}, skipping...")
+            return False
 
-        if "new_username" in self.cfg["password_reset"]["form"]["input"]:
-            Element(self.driver, element=self.cfg["password_reset"]["form"]["input"]["new_username"]).input(input_value=self.router_user)
+        logger.info("DNS settings were verified")
+        return True
 
-        if "new_password" in self.cfg["password_reset"]["form"]["input"]:
-            Element(self.driver, element=self.cfg["password_reset"]["form"]["input"]["new_password"]).input(input_value=password)
+    async def change_password(self, password: str) -> None:
+        logger.info(f"Resetting password")
+        password_reset = self.plan.password_reset
 
-        if "new_password_confirm" in self.cfg["password_reset"]["form"]["input"]:
-            Element(self.driver, element=self.cfg["password_reset"]["form"]["input"]["new_password_confirm"]).input(input_value=password)
+        if password_reset.form_iframe is not None:
+            await self._switch_to_frame(password_reset.form_iframe)
 
-        submit_btn = Element(driver=self.driver, element=self.cfg["password_reset"]["form"]["submit"])
-        submit_btn.click()
+        values = {"current_username": self.router_user,
+                  "current_password": self.router_password,
+                  "new_username": self.router_user,
+                  "new_password": password,
+                  "new_password_confirm": password,
+                  }
+        for form_input in password_reset.inputs:
+            await self._input(locator=form_input.locator, input_value=values[form_input.role],
+                              click_alert=form_input.locator.alert_confirm)
 
-        if "iframe" in self.cfg["password_reset"]["form"]:
-            self.driver.switch_to.parent_frame()
+        await self._click(locator=password_reset.submit)
+        self.password_submitted = True
+
+        if password_reset.form_iframe is not None:
+            await self._switch_to_parent_frame()
 
         # ack popup
-        if "alert_confirm" in self.cfg["password_reset"]["form"] and self.cfg["password_reset"]["form"][
-            "alert_confirm"]:
-            WebDriverWait(self.driver, timeout=10).until(EC.alert_is_present())
-            self.driver.switch_to.alert.accept()
+        if password_reset.alert_confirm:
+            await self._accept_alert()
 
         logger.info(f"Password has been updated")
 
-        # optionally reboot
-        if "reboot" in self.cfg["password_reset"]:
-            logger.info("Rebooting")
+    async def reboot(self) -> None:
+        logger.info("Rebooting")
+        password_reset = self.plan.password_reset
 
-            for step in self.cfg["password_reset"]["reboot"]["steps"]:
-                Element(driver=self.driver, element=step).click()
+        mark = await self._mark(password_reset.reboot_wait_for)
+        for step in password_reset.reboot_steps:
+            await self._click(locator=step)
 
-            if "alert_confirm" in self.cfg["password_reset"]["reboot"]:
-                WebDriverWait(self.driver, timeout=10).until(EC.alert_is_present())
-                self.driver.switch_to.alert.accept()
+        if password_reset.reboot_alert_confirm:
+            await self._accept_alert()
 
-            sleep(5)
+        await self._settle(wait_for=password_reset.reboot_wait_for, timeout=5, mark=mark)
 
-        return True
 
+class Router(BrowserRouter):
+    """runs the browser steps of a model through chromedriver, the primitives block the worker thread"""
+    engine = "selenium"
 
-@cli.command()
-@click.option("-d", "--driver-path", type=click.Path(), help="Chromium driver path")
-@click.option("-r", "--routers", type=click.Path(), help="CSV file containing router data")
-@click.option("--dns", help="Comma separated list of dns servers: 8.8.8.8,1.1.1.1")
-@click.option("--start-from", default=0, help="Start from line N in router-data file")
-@click.option("-c", "--config", type=click.Path(), help="Config file, yaml")
-@click.option("--skip-header/--no-skip-header", default=True)
-@click.option("--debug/--no-debug", default=False)
-@click.option("--docker-runtime/--no-docker-runtime", default=False)
-@click.option("--new-password", help="Password will be updated, if specified")
-def reset(driver_path: str, routers: str, dns: str, start_from: int, config: str, skip_header: bool, debug: bool,
-          docker_runtime: bool, new_password: str):
-    if docker_runtime:
-        subprocess.Popen(["Xvfb"],
-                         stdout=open("/dev/null", "w"),
-                         stderr=open("/dev/null", "w"),
-                         preexec_fn=preexec_function
-                         )
-
-    routers_data = []
-    with open(routers, mode="r", encoding="utf8", errors="ignore") as csv_file:
-        csv_reader = csv.reader(csv_file, delimiter=";")
-        if skip_header:
-            next(csv_reader)  # skip header
-        for row in csv_reader:
-            routers_data.append(row)
+    def __init__(self, plan: ModelPlan, router_ip: str, router_port: str, router_user: str, router_password: str,
+                 dns_servers: tuple, driver: webdriver.Chrome, tracer: Tracer, latency: LatencyStats,
+                 **options) -> None:
+        super().__init__(plan=plan, router_ip=router_ip, router_port=router_port, router_user=router_user,
+                         router_password=router_password, dns_servers=dns_servers, tracer=tracer, latency=latency,
+                         **options)
+        if self.plan.login.basic:
+            self.router_url = f"{self.router_proto}://{self.router_user}:{self.router_password}@{self.router_ip}:{self.router_port}"
+        self.driver = driver
 
-    with open(config, "r") as f:
-        cfg = yaml.safe_load(f)
+    def run(self, new_password: Optional[str], verify: bool) -> bool:
+        # nothing is awaited for real, the loop only drives the shared steps on the worker thread
+        return asyncio.run(self._run(new_password, verify))
 
-    if str(cfg.get("version", "not_set")) != VERSION:
-        logger.error(f"Config file version \"{cfg.get('version', 'not_set')}\" is not compatible with script version \"{VERSION}\"")
-        exit(1)
+    def _element(self, locator: Locator) -> Element:
+        return Element(driver=self.driver,
+                       locator=locator,
+                       timeout=self.latency.timeout(self.plan.name, "element"),
+                       alert_timeout=self.latency.timeout(self.plan.name, "alert"),
+                       )
 
-    routers_data = routers_data[start_from:]
-    if debug:
-        routers_data = routers_data[:1]
+    async def _goto(self, url: str) -> None:
+        self.driver.get(url)
 
-    srv = Service(driver_path)
-    op = webdriver.ChromeOptions()
+    async def _url(self) -> str:
+        return self.driver.current_url
 
-    op.add_argument("--disable-notifications")
-    op.add_argument("--disable-popup-blocking")
+    async def _page_time(self) -> list:
+        return self.driver.execute_script(PAGE_TIME_SCRIPT)
 
-    if docker_runtime:
-        op.add_argument("--headless")
-        op.add_argument("--no-sandbox")
-        op.add_argument("--disable-dev-shm-usage")
+    async def _block_resources(self) -> None:
+        """blocks the model's url patterns, the patterns of the previous router's model are replaced"""
+        if getattr(self.driver, "blocked_urls", ()) == self.plan.block:
+            return
 
-    for idx, router_data in enumerate(routers_data):
-        logger.info(f"Started {idx} router {router_data[0]} {router_data[5]}")
-        model = router_data[5]
-        group_model = map_model(cfg=cfg["models"], router_model=model)
-        if not group_model:
-            logger.warning(f"Model {model} for {router_data[0]} was not found in configured models, skipping ...")
-            continue
+        try:
+            self.driver.execute_cdp_cmd("Network.enable", {})
+            self.driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": list(self.plan.block)})
+            self.driver.blocked_urls = self.plan.block
+        except WebDriverException as e:
+            logger.warning(f"Can't block resources: {e.msg}")
+
+    async def _wait_present(self, locator: Locator, timeout: float) -> None:
+        WebDriverWait(self.driver, timeout=timeout, poll_frequency=0.2).until(lambda d: find_element(d, locator))
 
-        if ":" in router_data[4]:
-            router_user, router_password = router_data[4].split(":")
+    def _gone(self, locator: Locator) -> bool:
+        try:
+            return EC.invisibility_of_element_located(find_element(self.driver, locator))(self.driver)
+        except NoSuchElementException:
+            return True
+
+    async def _wait_until(self, wait_for: WaitFor, timeout: float, mark: PageMark) -> bool:
+        condition = wait_for.condition
+        if condition == "element_present":
+            check = lambda d: find_element(d, wait_for.locator)
+        elif condition == "element_gone":
+            check = lambda d: self._gone(wait_for.locator)
+        elif condition == "url_changes":
+            check = EC.url_changes(mark.url)
+        elif condition == "alert":
+            check = EC.alert_is_present()
         else:
-            router_user = ""
-            router_password = router_data[4]
+            check = lambda d: d.execute_script(NETWORK_IDLE_SCRIPT, [NETWORK_IDLE_MS, mark.time_origin, mark.now])
+
+        try:
+            WebDriverWait(self.driver, timeout=timeout, poll_frequency=0.2,
+                          ignored_exceptions=[WebDriverException]).until(check)
+        except TimeoutException:
+            return False
+
+        if condition == "alert" and wait_for.accept:
+            self.driver.switch_to.alert.accept()
+        return True
+
+    async def _wait_alert(self, timeout: float) -> None:
+        WebDriverWait(self.driver, timeout=timeout, poll_frequency=0.2).until(EC.alert_is_present())
+        self.driver.switch_to.alert.accept()
+
+    async def _click(self, locator: Locator) -> None:
+        self._element(locator=locator).click()
+
+    async def _input(self, locator: Locator, input_value: str, click_alert: bool = False) -> None:
+        self._element(locator=locator).input(input_value=input_value, click_alert=click_alert)
+
+    async def _fill(self, locator: Locator, value: str) -> None:
+        field_input = find_element(self.driver, locator)
+        field_input.clear()
+        field_input.send_keys(value)
+
+    async def _fill_script(self, fields: list) -> list:
+        return self.driver.execute_script(FILL_FIELDS_SCRIPT, fields)
+
+    async def _value(self, locator: Locator) -> str:
+        return find_element(self.driver, locator).get_attribute("value")
+
+    async def _select(self, locator: Locator, value: str) -> None:
+        Select(find_element(self.driver, locator)).select_by_value(value)
+
+    async def _switch_to_frame(self, reference) -> None:
+        self.driver.switch_to.frame(reference)
+
+    async def _switch_to_parent_frame(self) -> None:
+        self.driver.switch_to.parent_frame()
 
-        if dns:
-            if "," in dns:
-                dns_servers = dns.split(",")
+    async def _switch_to_default_content(self) -> None:
+        self.driver.switch_to.default_content()
+
+    async def _restore_session(self, session: dict) -> None:
+        for cookie in session["cookies"]:
+            self.driver.add_cookie(cookie)
+        self.driver.execute_script(RESTORE_STORAGE_SCRIPT, session["storage"])
+
+    async def _read_session(self) -> dict:
+        return {"cookies": self.driver.get_cookies(), "storage": self.driver.execute_script(READ_STORAGE_SCRIPT)}
+
+    async def _clear_session(self) -> None:
+        self.driver.delete_all_cookies()
+        self.driver.execute_script("window.localStorage.clear(); window.sessionStorage.clear();")
+
+
+def _selector(locator: Locator) -> str:
+    """playwright selector of an id or xpath locator"""
+    return f"{locator.kind}={locator.location}"
+
+
+def _any_selector(locator: Locator) -> str:
+    """xpath union of an optimized locator and its fallback, for waits that either of them satisfies"""
+    if locator.fallback is None:
+        return _selector(locator)
+
+    if locator.kind == "id":
+        return f"xpath=//*[@id={_xpath_literal(locator.location)}] | {locator.fallback.location}"
+
+    return f"xpath={locator.location} | {locator.fallback.location}"
+
+
+def _page_function(script: str) -> str:
+    """turns a webdriver script, which reads arguments[0], into a function playwright calls with one argument"""
+    return f"arg => (function () {{ {script} }})(arg)"
+
+
+def _milliseconds(seconds: float) -> float:
+    # playwright treats a timeout of 0 as no timeout at all
+    return max(1.0, seconds * 1000)
+
+
+class PlaywrightPool:
+    """a few shared browsers driven over CDP from one event loop thread, every router gets its own browser context"""
+
+    def __init__(self, browsers: int, arguments: list, executable_path: Optional[str], tracer: Tracer) -> None:
+        self.browsers = browsers
+        self.arguments = arguments
+        self.executable_path = executable_path
+        self.tracer = tracer
+        self._lock = threading.Lock()
+        self._loop = None
+        self._playwright = None
+        # launch futures of the browsers, a browser that crashed is launched again
+        self._launches = [None] * browsers
+        self._contexts = [0] * browsers
+
+    def run(self, coroutine) -> bool:
+        """runs a router coroutine on the event loop, the calling worker thread waits for its result"""
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="playwright", daemon=True).start()
+                try:
+                    self._playwright = asyncio.run_coroutine_threadsafe(self._start(), loop).result()
+                except Exception:
+                    loop.call_soon_threadsafe(loop.stop)
+                    raise
+                self._loop = loop
+
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    @staticmethod
+    async def _start():
+        return await async_playwright().start()
+
+    async def _launch(self):
+        logger.debug("Starting browser")
+        with self.tracer.phase("browser_start"):
+            return await self._playwright.chromium.launch(args=self.arguments, executable_path=self.executable_path)
+
+    def _reserve(self) -> int:
+        """slot with the fewest contexts, counted before any await so concurrent routers spread over the browsers"""
+        slot = min(range(self.browsers), key=lambda idx: self._contexts[idx])
+        self._contexts[slot] += 1
+        return slot
+
+    async def _browser(self, slot: int):
+        launch = self._launches[slot]
+        if launch is None or launch.done() and (launch.cancelled() or launch.exception()
+                                                or not launch.result().is_connected()):
+            launch = self._launches[slot] = asyncio.ensure_future(self._launch())
+
+        return await launch
+
+    @asynccontextmanager
+    async def context(self, http_credentials: Optional[dict]):
+        slot = self._reserve()
+        try:
+            browser = await self._browser(slot)
+            context = await browser.new_context(ignore_https_errors=True, http_credentials=http_credentials)
+            try:
+                yield context
+            finally:
+                try:
+                    await context.close()
+                except PlaywrightError:
+                    pass  # the browser is gone, it is launched again for the next router
+        finally:
+            self._contexts[slot] -= 1
+
+    async def _stop(self) -> None:
+        for launch in self._launches:
+            if launch is not None and launch.done() and not launch.cancelled() and not launch.exception():
+                try:
+                    await launch.result().close()
+                except PlaywrightError:
+                    pass
+        await self._playwright.stop()
+
+    def close(self) -> None:
+        with self._lock:
+            loop, self._loop = self._loop, None
+
+        if loop is None:
+            return
+
+        try:
+            asyncio.run_coroutine_threadsafe(self._stop(), loop).result(timeout=30)
+        except Exception as e:
+            logger.warning(f"Stopping browsers failed: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+
+
+class PlaywrightRouter(BrowserRouter):
+    """runs the browser steps of a model as a coroutine in a playwright browser context"""
+    engine = "playwright"
+
+    def __init__(self, plan: ModelPlan, router_ip: str, router_port: str, router_user: str, router_password: str,
+                 dns_servers: tuple, pool: PlaywrightPool, tracer: Tracer, latency: LatencyStats, **options) -> None:
+        super().__init__(plan=plan, router_ip=router_ip, router_port=router_port, router_user=router_user,
+                         router_password=router_password, dns_servers=dns_servers, tracer=tracer, latency=latency,
+                         **options)
+        self.pool = pool
+        # basic auth credentials are answered by the context instead of being put in the url
+        self.http_credentials = {"username": router_user, "password": router_password} if plan.login.basic else None
+        self.page = None
+        # playwright has no frame switching, steps run in the frame selected last
+        self.frame = None
+        self._dialog = None
+
+    def run(self, new_password: Optional[str], verify: bool) -> bool:
+        return self.pool.run(self._run_in_context(new_password, verify))
+
+    async def _run_in_context(self, new_password: Optional[str], verify: bool) -> bool:
+        async with self.pool.context(http_credentials=self.http_credentials) as context:
+            self.page = await context.new_page()
+            self.frame = self.page.main_frame
+            self._dialog = asyncio.Event()
+            self.page.on("dialog", self._on_dialog)
+            return await self._run(new_password, verify)
+
+    async def _on_dialog(self, dialog) -> None:
+        """dialogs are accepted as soon as they show up, steps waiting for an alert wait for this"""
+        logger.debug(f"Accepting {dialog.type}: {dialog.message}")
+        self._dialog.set()
+        await dialog.accept()
+
+    def _timeout(self, kind: str) -> float:
+        return _milliseconds(self.latency.timeout(self.plan.name, kind))
+
+    async def _goto(self, url: str) -> None:
+        await self.page.goto(url)
+
+    async def _url(self) -> str:
+        return self.page.url
+
+    async def _page_time(self) -> list:
+        return await self.frame.evaluate(_page_function(PAGE_TIME_SCRIPT), None)
+
+    async def _block_resources(self) -> None:
+        if not self.plan.block:
+            return
+
+        try:
+            cdp = await self.page.context.new_cdp_session(self.page)
+            await cdp.send("Network.enable")
+            await cdp.send("Network.setBlockedURLs", {"urls": list(self.plan.block)})
+        except PlaywrightError as e:
+            logger.warning(f"Can't block resources: {e.message}")
+
+    async def _locate(self, locator: Locator, wait: bool = True) -> str:
+        """selector of the locator, or of its fallback when the optimized one matches nothing, like find_element"""
+        if locator.fallback is None:
+            return _selector(locator)
+
+        # not the union, actions on it would use whichever of the two comes first in the page
+        if wait:
+            await self._wait_present(locator, self.latency.timeout(self.plan.name, "element"))
+        if await self.frame.query_selector(_selector(locator)) is not None:
+            return _selector(locator)
+
+        return _selector(locator.fallback)
+
+    async def _wait_present(self, locator: Locator, timeout: float) -> None:
+        await self.frame.wait_for_selector(_any_selector(locator), state="attached", timeout=_milliseconds(timeout))
+
+    async def _wait_until(self, wait_for: WaitFor, timeout: float, mark: PageMark) -> bool:
+        condition = wait_for.condition
+        try:
+            if condition == "element_present":
+                await self._wait_present(wait_for.locator, timeout)
+            elif condition == "element_gone":
+                await self.frame.wait_for_selector(_any_selector(wait_for.locator), state="hidden",
+                                                   timeout=_milliseconds(timeout))
+            elif condition == "url_changes":
+                await self.page.wait_for_url(lambda url: url != mark.url, timeout=_milliseconds(timeout))
+            elif condition == "alert":
+                await asyncio.wait_for(self._dialog.wait(), timeout=timeout)
             else:
-                dns_servers = dns
+                await self.frame.wait_for_function(_page_function(NETWORK_IDLE_SCRIPT),
+                                                   arg=[NETWORK_IDLE_MS, mark.time_origin, mark.now],
+                                                   polling=200, timeout=_milliseconds(timeout))
+        except (PlaywrightError, asyncio.TimeoutError):
+            return False
+
+        return True
+
+    async def _wait_alert(self, timeout: float) -> None:
+        await asyncio.wait_for(self._dialog.wait(), timeout=timeout)
+        self._dialog.clear()
+
+    async def _click(self, locator: Locator) -> None:
+        # an alert that shows up after this click is the one the next _accept_alert waits for
+        self._dialog.clear()
+        await self.frame.click(await self._locate(locator), timeout=self._timeout("element"))
+
+    async def _input(self, locator: Locator, input_value: str, click_alert: bool = False) -> None:
+        if click_alert:
+            await self._click(locator=locator)
+            await self._accept_alert()
+
+        await self.frame.fill(await self._locate(locator), input_value, timeout=self._timeout("element"))
+
+    async def _fill(self, locator: Locator, value: str) -> None:
+        field_input = await self.frame.query_selector(await self._locate(locator, wait=False))
+        if field_input is None:
+            raise NoSuchElementException(f"Unable to locate element: {locator.location}")
+        await field_input.fill(value)
+
+    async def _fill_script(self, fields: list) -> list:
+        return await self.frame.evaluate(_page_function(FILL_FIELDS_SCRIPT), fields)
+
+    async def _value(self, locator: Locator) -> str:
+        return await self.frame.input_value(await self._locate(locator, wait=False))
+
+    async def _select(self, locator: Locator, value: str) -> None:
+        await self.frame.select_option(await self._locate(locator), value=value, timeout=self._timeout("element"))
+
+    async def _switch_to_frame(self, reference) -> None:
+        """finds a frame like webdriver's switch_to.frame does, by frame element name, id or index"""
+        if isinstance(reference, int):
+            elements = await self.frame.query_selector_all("frame, iframe")
+            element = elements[reference] if reference < len(elements) else None
         else:
-            dns_servers = []
+            name = json.dumps(str(reference))
+            element = await self.frame.query_selector(
+                f"frame[name={name}], iframe[name={name}], frame[id={name}], iframe[id={name}]")
+
+        frame = await element.content_frame() if element else None
+        if frame is None:
+            raise NoSuchFrameException(f"Unable to locate frame: {reference}")
+        self.frame = frame
+
+    async def _switch_to_parent_frame(self) -> None:
+        self.frame = self.frame.parent_frame or self.frame
+
+    async def _switch_to_default_content(self) -> None:
+        self.frame = self.page.main_frame
+
+    async def _restore_session(self, session: dict) -> None:
+        await self.page.context.add_cookies(session["cookies"])
+        await self.page.evaluate(_page_function(RESTORE_STORAGE_SCRIPT), session["storage"])
+
+    async def _read_session(self) -> dict:
+        return {"cookies": await self.page.context.cookies(),
+                "storage": await self.page.evaluate(_page_function(READ_STORAGE_SCRIPT), None)}
+
+    async def _clear_session(self) -> None:
+        await self.page.context.clear_cookies()
+        await self.page.evaluate("() => { localStorage.clear(); sessionStorage.clear(); }")
+
+
+def _preflight_ssl_context() -> ssl.SSLContext:
+    """accepts the old protocols, ciphers and self-signed certificates of router firmware"""
+    ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    ssl_context.check_hostname = False
+    ssl_context.verify_mode = ssl.CERT_NONE
+    try:
+        # deprecated on purpose, old firmware speaks nothing newer
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", DeprecationWarning)
+            ssl_context.minimum_version = ssl.TLSVersion.TLSv1
+        ssl_context.set_ciphers("DEFAULT:@SECLEVEL=0")
+    except (ValueError, ssl.SSLError) as e:
+        logger.debug(f"Can't relax the pre-flight tls settings: {e}")
+
+    return ssl_context
+
+
+async def _probe_router(router_ip: str, router_port: str, timeout: float, http_head: bool,
+                        semaphore: asyncio.Semaphore, ssl_context: Optional[ssl.SSLContext] = None) -> str:
+    """returns the reason the router is unreachable, empty string if it is reachable"""
+    async with semaphore:
+        # a tcp connect is the reachability check, tls is only spoken for a HEAD request to port 443
+        use_ssl = ssl_context if http_head and router_port == "443" else None
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(router_ip, int(router_port), ssl=use_ssl), timeout=timeout)
+        except asyncio.TimeoutError:
+            return "connect timeout"
+        except ssl.SSLError as e:
+            # the port answered, a handshake this python can't do says nothing about the browser
+            logger.debug(f"Pre-flight tls handshake with {router_ip}:{router_port} failed: {e}")
+            return ""
+        except (OSError, ValueError) as e:
+            return f"connect failed: {e}"
+
+        try:
+            if http_head:
+                writer.write(f"HEAD / HTTP/1.0\r\nHost: {router_ip}\r\n\r\n".encode())
+                await writer.drain()
+                status_line = await asyncio.wait_for(reader.readline(), timeout=timeout)
+                if not status_line.startswith(b"HTTP/"):
+                    return "no http response"
+        except asyncio.TimeoutError:
+            return "http timeout"
+        except OSError as e:
+            return f"http failed: {e}"
+        finally:
+            writer.close()
+
+    return ""
+
+
+def preflight(routers_data: list, concurrency: int, timeout: float, http_head: bool) -> dict:
+    """probes every ip:port concurrently, returns unreachable (ip, port) pairs with the reason"""
+    hosts = list({(router_data[0], router_data[1]) for router_data in routers_data})
+
+    ssl_context = _preflight_ssl_context() if http_head else None
+
+    async def probe_all() -> list:
+        semaphore = asyncio.Semaphore(concurrency)
+        return await asyncio.gather(*(_probe_router(router_ip=router_ip,
+                                                    router_port=router_port,
+                                                    timeout=timeout,
+                                                    http_head=http_head,
+                                                    semaphore=semaphore,
+                                                    ssl_context=ssl_context,
+                                                    ) for router_ip, router_port in hosts))
+
+    reasons = asyncio.run(probe_all())
+    return {host: reason for host, reason in zip(hosts, reasons) if reason}
+
+
+class HttpRouter:
+    """runs the login, dns and password flows of http engine models as plain http requests"""
+
+    def __init__(self,
+                 http: dict,
+                 router_ip: str,
+                 router_port: str,
+                 router_user: str,
+                 router_password: str,
+                 dns_servers: tuple,
+                 session: requests.Session,
+                 tracer: Tracer,
+                 skip_compliant: bool = False,
+                 ) -> None:
+        self.http = http
+        self.tracer = tracer
+        self.dns_servers = tuple(dns_servers)
+        self.skip_compliant = skip_compliant
+        self.compliant = False
+        self.password_submitted = False
+        self.failure = ""
+        self.router_ip = router_ip
+        self.session = session
+        if router_port == "443":
+            router_proto = "https"
+        else:
+            router_proto = "http"
+        self.variables = {
+            "base_url": f"{router_proto}://{router_ip}:{router_port}",
+            "router_ip": router_ip,
+            "router_port": router_port,
+            "username": router_user,
+            "password": router_password,
+        }
+        for dns_idx, dns_server in enumerate(dns_servers):
+            self.variables[f"dns_{dns_idx + 1}"] = dns_server
+            for octet_idx, octet in enumerate(dns_server.split(".")):
+                self.variables[f"dns_{dns_idx + 1}_{octet_idx + 1}"] = octet
+
+        # routers use self-signed certificates
+        self.session.verify = False
+        if self.http.get("auth") == "basic":
+            self.session.auth = (router_user, router_password)
+        self.session.headers.update(self._render(self.http.get("headers", {})))
+
+    def _render(self, value):
+        """substitutes {variables} in strings, lists and dicts"""
+        if isinstance(value, str):
+            return value.format_map(self.variables)
+        if isinstance(value, list):
+            return [self._render(v) for v in value]
+        if isinstance(value, dict):
+            return {k: self._render(v) for k, v in value.items()}
+        return value
+
+    @staticmethod
+    def _extract(response: requests.Response, source: dict) -> Optional[str]:
+        if "regex" in source:
+            match = re.search(source["regex"], response.text)
+            return match.group(1) if match else None
+        if "cookie" in source:
+            return response.cookies.get(source["cookie"]) or None
+        if "header" in source:
+            return response.headers.get(source["header"])
+        raise NotImplementedError(f"Unknown extract source {source}")
+
+    def _request(self, step: dict, quiet: bool = False) -> bool:
+        """quiet requests log unmet expectations at debug level, for checks that are expected to fail"""
+        try:
+            url = self.variables["base_url"] + self._render(step["path"])
+            params = self._render(step.get("params"))
+            data = self._render(step.get("data"))
+            headers = self._render(step.get("headers"))
+            contains = self._render(step.get("expect", {}).get("contains"))
+        except KeyError as e:
+            logger.error(f"Variable {e} is not set for {step['path']}, skipping...")
+            return False
+
+        logger.debug(f"{step.get('method', 'GET')} {url}")
+        try:
+            response = self.session.request(method=step.get("method", "GET"),
+                                            url=url,
+                                            params=params,
+                                            data=data,
+                                            headers=headers,
+                                            timeout=step.get("timeout", HTTP_TIMEOUT),
+                                            )
+        except requests.RequestException as e:
+            logger.warning(f"Request to {url} failed: {e}, skipping...")
+            self.failure = self.failure or failure_class(e)
+            return False
+
+        expect = step.get("expect", {})
+        if response.status_code != expect.get("status", 200):
+            (logger.debug if quiet else logger.error)(f"Unexpected status {response.status_code} from {url}, skipping...")
+            return False
+        if contains is not None and contains not in response.text:
+            (logger.debug if quiet else logger.error)(f"Response from {url} doesn't contain \"{contains}\", skipping...")
+            return False
+
+        # tokens from this response are available to the following requests
+        for name, source in step.get("extract", {}).items():
+            value = self._extract(response, source)
+            if value is None:
+                logger.error(f"Can't extract {name} from {url}, skipping...")
+                return False
+            self.variables[name] = value
+
+        return True
+
+    def _run(self, flow: str, quiet: bool = False) -> bool:
+        with self.tracer.phase(flow):
+            for step in self.http.get(flow, []):
+                if flow == "password_reset" and step.get("method", "GET") != "GET":
+                    self.password_submitted = True
+                with self.tracer.phase("request", step=step["path"]):
+                    res = self._request(step, quiet=quiet)
+                if not res:
+                    return False
+
+        return True
+
+    def _fail(self, failure: str) -> bool:
+        self.failure = self.failure or failure
+        return False
+
+    def run(self, new_password: Optional[str], verify: bool) -> bool:
+        """logs in once, then updates dns, reads it back and changes the password, as requested"""
+        if not self._run("login"):
+            logger.error(f"Login failed, skipping...")
+            return self._fail(FAILURE_LOGIN)
+
+        # the verify requests tell whether the servers already match
+        if self.dns_servers and self.skip_compliant and self.http.get("verify") and self._run("verify", quiet=True):
+            logger.info("DNS settings are already compliant, not submitting")
+            self.compliant = True
+        elif self.dns_servers:
+            logger.info(f"Updating DNS server settings")
+            if not self._run("dns"):
+                return self._fail(FAILURE_ELEMENT)
+            logger.info("DNS settings were updated")
+
+            if verify and self.http.get("verify"):
+                if not self._run("verify"):
+                    return self._fail(FAILURE_VERIFY)
+                logger.info("DNS settings were verified")
+
+        if new_password:
+            logger.info(f"Resetting password")
+            self.variables["new_password"] = new_password
+            if not self._run("password_reset"):
+                return self._fail(FAILURE_ELEMENT)
+            logger.info(f"Password has been updated")
+
+        return True
+
+
+class RunSummary:
+    """thread-safe tally of router outcomes"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.counts = {outcome: 0 for outcome in OUTCOMES}
+        self.failed = []
+        self.unconfirmed = []
+
+    def add(self, outcome: str, router_ip: str) -> None:
+        with self._lock:
+            self.counts[outcome] += 1
+            if outcome == OUTCOME_FAILED:
+                self.failed.append(router_ip)
+            elif outcome == OUTCOME_UNCONFIRMED:
+                self.unconfirmed.append(router_ip)
+
+    def totals(self) -> dict:
+        with self._lock:
+            return dict(self.counts)
+
+    def report(self) -> None:
+        logger.info(", ".join(f"{outcome}: {self.counts[outcome]}" for outcome in OUTCOMES))
+        if self.failed:
+            logger.info(f"Failed routers: {' '.join(self.failed)}")
+        if self.unconfirmed:
+            logger.warning(f"Routers that may have the new password already: {' '.join(self.unconfirmed)}")
+
+
+def _label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels) -> str:
+    return "{" + ",".join(f'{name}="{_label_value(value)}"' for name, value in labels.items()) + "}"
+
+
+class Metrics:
+    """live counters of a run, served as prometheus text and json status by --metrics-port"""
+
+    def __init__(self, summary: RunSummary) -> None:
+        self.summary = summary
+        # rows the run will go through, when they could be counted up front
+        self.total = None
+        # returns the routers waiting for a retry, set by the runner once its retry scheduler exists
+        self.retrying = None
+        self._lock = threading.Lock()
+        self._started_at = time.monotonic()
+        self._submitted = 0
+        self._finished = 0
+        self._finished_at = deque()
+        self._last_finished = None
+        self._outcomes = Counter()
+        self._failures = Counter()
+        self._retries = Counter()
+        # router ip, model group and start of the routers in progress, by worker thread
+        self._sessions = {}
+        self._buckets = defaultdict(lambda: [0] * (len(METRIC_BUCKETS) + 1))
+        self._sums = Counter()
+
+    def submitted(self) -> None:
+        with self._lock:
+            self._submitted += 1
+
+    def session_started(self, router_ip: str, model_group: str) -> None:
+        with self._lock:
+            self._sessions[threading.get_ident()] = (router_ip, model_group, time.monotonic())
+
+    def session_ended(self, model_group: str, outcome: str, failure: str) -> None:
+        with self._lock:
+            self._sessions.pop(threading.get_ident(), None)
+            if outcome == OUTCOME_FAILED:
+                self._failures[(model_group, failure or "unknown")] += 1
+
+    def retried(self, model_group: str) -> None:
+        with self._lock:
+            self._retries[model_group] += 1
+
+    def finished(self, model_group: str, outcome: str) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._finished += 1
+            self._outcomes[(model_group, outcome)] += 1
+            self._last_finished = now
+            self._finished_at.append(now)
+            self._expire(now)
+
+    def _expire(self, now: float) -> None:
+        while self._finished_at and self._finished_at[0] < now - METRIC_RATE_WINDOW:
+            self._finished_at.popleft()
+
+    def observe(self, model_group: str, phase: str, duration: float) -> None:
+        if phase not in METRIC_PHASES:
+            return
+
+        with self._lock:
+            buckets = self._buckets[(model_group, phase)]
+            buckets[bisect.bisect_left(METRIC_BUCKETS, duration)] += 1
+            self._sums[(model_group, phase)] += duration
+
+    def status(self) -> dict:
+        """progress, throughput and eta of the run, for dashboards and progress bars"""
+        now = time.monotonic()
+        outcomes = self.summary.totals()
+        with self._lock:
+            self._expire(now)
+            elapsed = now - self._started_at
+            rate = len(self._finished_at) / min(METRIC_RATE_WINDOW, max(elapsed, 1.0))
+            in_flight = len(self._sessions)
+            sessions = sorted(({"router_ip": router_ip, "model_group": model_group, "seconds": round(now - started, 1)}
+                               for router_ip, model_group, started in self._sessions.values()),
+                              key=lambda session: -session["seconds"])
+            groups = defaultdict(lambda: {outcome: 0 for outcome in OUTCOMES})
+            for (model_group, outcome), count in self._outcomes.items():
+                groups[model_group][outcome] = count
+            status = {
+                "elapsed": round(elapsed, 1),
+                "total": self.total,
+                "submitted": self._submitted,
+                "in_flight": in_flight,
+                "queued": self._submitted - self._finished - in_flight,
+                "retrying": self.retrying() if self.retrying else 0,
+                "outcomes": outcomes,
+                "rate_per_minute": round(rate * 60, 2),
+                "last_finished_seconds_ago": round(now - self._last_finished, 1) if self._last_finished else None,
+                "sessions": sessions[:METRIC_SESSIONS],
+                "model_groups": dict(groups),
+            }
+
+        done = sum(outcomes.values())
+        status["done"] = done
+        # without a total the routers submitted so far are the lower bound of what is left,
+        # a router waiting for a retry takes another attempt on top of it
+        remaining = (self.total - done) if self.total is not None else (status["queued"] + in_flight)
+        remaining += status["retrying"]
+        status["progress"] = round(min(done / self.total, 1.0), 4) if self.total else None
+        status["eta_seconds"] = round(max(remaining, 0) / rate) if rate else None
+        for counts in status["model_groups"].values():
+            finished = sum(counts.values())
+            counts["failure_rate"] = round(counts[OUTCOME_FAILED] / finished, 4) if finished else 0.0
+
+        return status
+
+    def render(self) -> str:
+        """prometheus text exposition format"""
+        status = self.status()
+        lines = [
+            "# HELP router_reset_routers_total Routers finished, skipped ones included, by outcome",
+            "# TYPE router_reset_routers_total counter",
+        ]
+        lines += [f"router_reset_routers_total{_labels(outcome=outcome)} {count}"
+                  for outcome, count in status["outcomes"].items()]
+        lines += [
+            "# HELP router_reset_routers_submitted_total Routers queued to the workers",
+            "# TYPE router_reset_routers_submitted_total counter",
+            f"router_reset_routers_submitted_total {status['submitted']}",
+            "# HELP router_reset_sessions_in_flight Routers in progress",
+            "# TYPE router_reset_sessions_in_flight gauge",
+            f"router_reset_sessions_in_flight {status['in_flight']}",
+            "# HELP router_reset_queue_depth Routers queued to the workers or waiting for a retry",
+            "# TYPE router_reset_queue_depth gauge",
+            f"router_reset_queue_depth {status['queued']}",
+            "# HELP router_reset_retries_pending Routers waiting for a retry",
+            "# TYPE router_reset_retries_pending gauge",
+            f"router_reset_retries_pending {status['retrying']}",
+            "# HELP router_reset_oldest_session_seconds Seconds the longest running router has been in progress",
+            "# TYPE router_reset_oldest_session_seconds gauge",
+            f"router_reset_oldest_session_seconds {status['sessions'][0]['seconds'] if status['sessions'] else 0}",
+        ]
+        if self.total is not None:
+            lines += [
+                "# HELP router_reset_routers_expected Routers of the run",
+                "# TYPE router_reset_routers_expected gauge",
+                f"router_reset_routers_expected {self.total}",
+            ]
+
+        with self._lock:
+            lines += [
+                "# HELP router_reset_model_outcomes_total Routers finished by model group and outcome",
+                "# TYPE router_reset_model_outcomes_total counter",
+            ]
+            lines += [f"router_reset_model_outcomes_total{_labels(model_group=model_group, outcome=outcome)} {count}"
+                      for (model_group, outcome), count in sorted(self._outcomes.items())]
+            lines += [
+                "# HELP router_reset_failures_total Failed attempts by model group and failure class, retried ones included",
+                "# TYPE router_reset_failures_total counter",
+            ]
+            lines += [f"router_reset_failures_total{_labels(model_group=model_group, failure=failure)} {count}"
+                      for (model_group, failure), count in sorted(self._failures.items())]
+            lines += [
+                "# HELP router_reset_retries_total Retries scheduled by model group",
+                "# TYPE router_reset_retries_total counter",
+            ]
+            lines += [f"router_reset_retries_total{_labels(model_group=model_group)} {count}"
+                      for model_group, count in sorted(self._retries.items())]
+            lines += [
+                "# HELP router_reset_phase_duration_seconds Durations of router phases by model group",
+                "# TYPE router_reset_phase_duration_seconds histogram",
+            ]
+            for (model_group, phase), buckets in sorted(self._buckets.items()):
+                cumulative = 0
+                for bound, count in zip(METRIC_BUCKETS + ("+Inf",), buckets):
+                    cumulative += count
+                    labels = _labels(model_group=model_group, phase=phase, le=bound)
+                    lines.append(f"router_reset_phase_duration_seconds_bucket{labels} {cumulative}")
+                labels = _labels(model_group=model_group, phase=phase)
+                lines.append(f"router_reset_phase_duration_seconds_sum{labels} {self._sums[(model_group, phase)]:.4f}")
+                lines.append(f"router_reset_phase_duration_seconds_count{labels} {cumulative}")
+
+        return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """GET /metrics in prometheus text format and GET /status as json"""
+
+    def log_message(self, format: str, *args) -> None:
+        logger.trace(f"{self.client_address[0]} {format % args}")
+
+    def _reply(self, body: bytes, content_type: str, status: int = 200) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        if self.path == "/metrics":
+            self._reply(self.server.metrics.render().encode(), "text/plain; version=0.0.4; charset=utf-8")
+        elif self.path == "/status":
+            self._reply(json.dumps(self.server.metrics.status()).encode(), "application/json")
+        else:
+            self._reply(json.dumps({"error": "not found"}).encode(), "application/json", status=404)
+
+
+class Journal:
+    """append-only jsonl log of router outcomes, used to resume interrupted runs"""
+
+    def __init__(self, path: str, resume: bool, fsync_every: int = 50, fsync_interval: float = 5.0) -> None:
+        self.path = path
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.state = {}
+        if resume and os.path.exists(path):
+            self._load()
+
+        self._lock = threading.Lock()
+        self._file = open(path, mode="a", encoding="utf8")
+        self._pending = 0
+        self._synced_at = time.monotonic()
+
+    @staticmethod
+    def key(router_ip: str, router_port: str, action: str) -> str:
+        return f"{router_ip}:{router_port}:{action}"
 
+    def _load(self) -> None:
+        with open(self.path, mode="r", encoding="utf8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # torn write from an interrupted run
+
+                self.state[self.key(entry["ip"], entry["port"], entry["action"])] = entry["status"]
+
+        done = sum(1 for status in self.state.values() if status in JOURNAL_DONE)
+        logger.info(f"Journal {self.path}: {done} of {len(self.state)} routers are done")
+
+    def is_done(self, router_ip: str, router_port: str, action: str) -> bool:
+        return self.state.get(self.key(router_ip, router_port, action)) in JOURNAL_DONE
+
+    def record(self, router_ip: str, router_port: str, action: str, status: str) -> None:
+        line = json.dumps({"ts": time.time(), "ip": router_ip, "port": router_port, "action": action,
+                           "status": status})
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+            self._pending += 1
+            if self._pending >= self.fsync_every or time.monotonic() - self._synced_at >= self.fsync_interval:
+                self._sync()
+
+    def _sync(self) -> None:
+        os.fsync(self._file.fileno())
+        self._pending = 0
+        self._synced_at = time.monotonic()
+
+    def close(self) -> None:
+        with self._lock:
+            if not self._file.closed:
+                self._sync()
+                self._file.close()
+
+
+def pending_routers(rows: Iterable, journal: Journal, action: str) -> Iterator[tuple]:
+    already_done = 0
+    for idx, row in rows:
+        if journal.is_done(row[0], row[1], action):
+            already_done += 1
+            continue
+
+        yield idx, row
+
+    if already_done:
+        logger.info(f"{already_done} routers were already done according to the journal")
+
+
+class WorkerPool:
+    """worker threads fed through a bounded queue, each logging with its own context"""
+
+    def __init__(self, workers: int, handler: Callable, name: str = "w") -> None:
+        self.handler = handler
+        self._queue = queue.Queue(maxsize=workers * 2)
+        self._threads = [threading.Thread(target=self._work, args=(f"{name}{n}",), daemon=True)
+                         for n in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def _work(self, worker_name: str) -> None:
+        with logger.contextualize(worker=worker_name):
+            while True:
+                job = self._queue.get()
+                if job is None:
+                    break
+                try:
+                    self.handler(job)
+                except Exception:
+                    logger.exception("Worker failed to process job")
+
+    def submit(self, job) -> None:
+        """blocks while the queue is full, so a producer never runs far ahead of the workers"""
+        self._queue.put(job)
+
+    def join(self) -> None:
+        for _ in self._threads:
+            self._queue.put(None)
+
+        for thread in self._threads:
+            thread.join()
+
+
+def read_routers(routers: str, skip_header: bool) -> Iterator[tuple]:
+    """lazily yields (index, row) from the routers file, "-" reads stdin"""
+    if routers == "-":
+        csv_file = io.TextIOWrapper(sys.stdin.buffer, encoding="utf8", errors="ignore")
+    else:
+        csv_file = open(routers, mode="r", encoding="utf8", errors="ignore")
+
+    with csv_file:
+        csv_reader = csv.reader(csv_file, delimiter=";")
+        if skip_header:
+            next(csv_reader, None)  # skip header
+        for idx, row in enumerate(csv_reader):
+            yield idx, row
+
+
+def validate_router_row(row: list) -> str:
+    """returns the reason the row can't be processed, empty string if it is valid"""
+    if len(row) < 6:
+        return f"expected at least 6 fields, got {len(row)}"
+    if not row[0]:
+        return "ip is empty"
+    if not row[1].isdigit():
+        return f"port \"{row[1]}\" is not a number"
+    if not row[5]:
+        return "model is empty"
+
+    return ""
+
+
+def valid_routers(rows: Iterable, summary: "RunSummary") -> Iterator[tuple]:
+    for idx, row in rows:
+        if not any(row):
+            continue
+
+        reason = validate_router_row(row)
+        if reason:
+            logger.warning(f"Skipping line {idx}: {reason}")
+            summary.add(OUTCOME_SKIPPED, row[0] if row else "")
+            continue
+
+        yield idx, row
+
+
+def reachable_routers(rows: Iterable, summary: "RunSummary", report_writer, batch_size: int, concurrency: int,
+                      timeout: float, http_head: bool) -> Iterator[tuple]:
+    """probes routers in batches, so only one batch is held in memory"""
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+
+        unreachable = preflight(routers_data=[row for _, row in batch],
+                                concurrency=concurrency,
+                                timeout=timeout,
+                                http_head=http_head,
+                                )
+        logger.info(f"{len(unreachable)} of {len(batch)} routers are unreachable")
+        for idx, row in batch:
+            reason = unreachable.get((row[0], row[1]))
+            if reason:
+                report_writer.writerow(row[:6] + [reason])
+                summary.add(OUTCOME_SKIPPED, row[0])
+            else:
+                yield idx, row
+
+
+def failure_class(e: Exception) -> str:
+    """failure class of an exception, empty for exceptions that are never retried"""
+    if isinstance(e, (TimeoutException, requests.Timeout, PlaywrightTimeoutError, asyncio.TimeoutError)):
+        return FAILURE_TIMEOUT
+    if isinstance(e, (NoSuchElementException, NoSuchFrameException)):
+        return FAILURE_ELEMENT
+    if isinstance(e, (WebDriverException, requests.ConnectionError, PlaywrightError, urllib3.exceptions.HTTPError,
+                      ConnectionError)):
+        return FAILURE_CONNECTION
+
+    return ""
+
+
+def driver_broken(e: Exception) -> bool:
+    """whether the error means the browser session is gone, element and wait errors leave it usable"""
+    if isinstance(e, (InvalidSessionIdException, NoSuchWindowException, urllib3.exceptions.HTTPError, ConnectionError)):
+        return True
+
+    # chrome not reachable, disconnected from devtools and crashed tabs are raised as plain WebDriverException
+    return type(e) is WebDriverException
+
+
+def process_router(plan: ModelPlan,
+                   idx: int,
+                   router_data: list,
+                   dns_servers: tuple,
+                   new_password: str,
+                   pool: Union[DriverPool, "PlaywrightPool"],
+                   http_adapter: HTTPAdapter,
+                   tracer: Tracer,
+                   latency: LatencyStats,
+                   fill_mode: str,
+                   verify: bool,
+                   skip_compliant: bool,
+                   sessions: Optional[SessionCache],
+                   ) -> tuple:
+    """returns the outcome and, for failed routers, the failure class"""
+    logger.info(f"Started {idx} router {router_data[0]} {router_data[5]}")
+
+    if ":" in router_data[4]:
+        router_user, router_password = router_data[4].split(":")
+    else:
+        router_user = ""
+        router_password = router_data[4]
+
+    driver = None
+    if plan.engine == "http":
+        session = requests.Session()
+        session.mount("http://", http_adapter)
+        session.mount("https://", http_adapter)
+        router = HttpRouter(
+            http=plan.http,
+            router_ip=router_data[0],
+            router_port=router_data[1],
+            router_user=router_user,
+            router_password=router_password,
+            dns_servers=dns_servers,
+            session=session,
+            tracer=tracer,
+            skip_compliant=skip_compliant,
+        )
+    elif isinstance(pool, PlaywrightPool):
+        router = PlaywrightRouter(
+            plan=plan,
+            router_ip=router_data[0],
+            router_port=router_data[1],
+            router_user=router_user,
+            router_password=router_password,
+            dns_servers=dns_servers,
+            pool=pool,
+            tracer=tracer,
+            latency=latency,
+            fill_mode=fill_mode,
+            skip_compliant=skip_compliant,
+            sessions=sessions,
+        )
+    else:
+        driver = pool.acquire()
         router = Router(
-            cfg=cfg["routers"][group_model],
+            plan=plan,
             router_ip=router_data[0],
             router_port=router_data[1],
             router_user=router_user,
             router_password=router_password,
             dns_servers=dns_servers,
-            driver_srv=srv,
-            driver_options=op,
+            driver=driver,
+            tracer=tracer,
+            latency=latency,
+            fill_mode=fill_mode,
+            skip_compliant=skip_compliant,
+            sessions=sessions,
         )
 
-        if dns_servers:
+    broken = False
+    try:
+        outcome = OUTCOME_SUCCEEDED
+        try:
+            if not router.run(new_password=new_password, verify=verify):
+                outcome = OUTCOME_FAILED
+            elif router.compliant and not new_password:
+                outcome = OUTCOME_COMPLIANT
+        except Exception as e:
+            logger.exception("Failed to update router")
+            outcome = OUTCOME_FAILED
+            router.failure = router.failure or failure_class(e)
+            broken = driver_broken(e)
+    finally:
+        if driver is not None:
+            pool.release(driver, broken=broken)
+
+    if outcome == OUTCOME_FAILED and router.password_submitted:
+        # a retry would log in with the old password, the router is left to be checked by hand
+        logger.warning(f"Password was submitted but the change was not confirmed ({router.failure}), not retrying")
+        return OUTCOME_UNCONFIRMED, router.failure
+
+    return outcome, router.failure if outcome == OUTCOME_FAILED else ""
+
+
+class RetryScheduler:
+    """holds failed routers until their retry is due, then hands them back to submit"""
+
+    def __init__(self, submit: Callable) -> None:
+        self.submit = submit
+        self._due = []
+        self._retries = 0
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def pending(self) -> int:
+        """routers waiting for a retry, not the ones put off because their ip was busy"""
+        with self._cond:
+            return self._retries
+
+    def schedule(self, delay: float, job, retry: bool = False) -> None:
+        with self._cond:
+            heapq.heappush(self._due, (time.monotonic() + delay, next(self._seq), job, retry))
+            self._retries += retry
+            self._cond.notify()
+
+    def _run(self) -> None:
+        with logger.contextualize(worker="retry"):
+            while True:
+                with self._cond:
+                    while not self._due or self._due[0][0] > time.monotonic():
+                        self._cond.wait(self._due[0][0] - time.monotonic() if self._due else None)
+                    _, _, job, retry = heapq.heappop(self._due)
+                    self._retries -= retry
+
+                try:
+                    self.submit(job)
+                except Exception:
+                    logger.exception("Failed to resubmit router")
+
+
+class HostLimiter:
+    """limits the routers of one ip processed at once, and how often they are started"""
+
+    def __init__(self, concurrency: int, interval: float) -> None:
+        self.concurrency = concurrency
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._running = Counter()
+        self._started = {}
+
+    def acquire(self, router_ip: str) -> float:
+        """0 when the router can start now, otherwise seconds to wait before asking again"""
+        now = time.monotonic()
+        with self._lock:
+            if self._running[router_ip] >= self.concurrency:
+                return HOST_BUSY_DELAY
+
+            wait = self._started.get(router_ip, now - self.interval) + self.interval - now
+            if wait > 0:
+                return wait
+
+            self._running[router_ip] += 1
+            if self.interval:
+                self._started[router_ip] = now
+
+        return 0
+
+    def release(self, router_ip: str) -> None:
+        with self._lock:
+            self._running[router_ip] -= 1
+            if not self._running[router_ip]:
+                del self._running[router_ip]
+
+
+def backoff(attempt: int, delay: float, max_delay: float) -> float:
+    """exponential backoff with jitter, between half and all of delay * 2^(attempt - 1), capped at max_delay"""
+    ceiling = min(max_delay, delay * 2 ** (attempt - 1))
+    return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+
+def setup_logging() -> None:
+    logger.configure(extra={"worker": "main", "router": "-"})
+    logger.remove()
+    logger.add(sys.stderr, format=LOG_FORMAT)
+
+
+def parse_failure_classes(ctx: click.Context, param: click.Parameter, value: str) -> tuple:
+    failure_classes = tuple(failure for failure in value.split(",") if failure)
+    for failure in failure_classes:
+        if failure not in FAILURE_CLASSES:
+            raise click.BadParameter(f"{failure} is not one of {', '.join(FAILURE_CLASSES)}")
+
+    return failure_classes
+
+
+def router_options(command: Callable) -> Callable:
+    """options of the commands that process routers"""
+    options = [
+        click.option("-d", "--driver-path", type=click.Path(), help="Chromium driver path"),
+        click.option("--dns", help="Comma separated list of dns servers: 8.8.8.8,1.1.1.1"),
+        click.option("--verify/--no-verify", default=False, help="Read the dns servers back after saving them"),
+        click.option("--skip-compliant/--no-skip-compliant", default=False,
+                     help="Read the dns servers first and don't submit them when they already match"),
+        click.option("-c", "--config", type=click.Path(), help="Config file, yaml"),
+        click.option("--fuzzy-models/--no-fuzzy-models", default=False,
+                     help="Guess the group of unconfigured models by the longest alias prefix or shared words"),
+        click.option("--docker-runtime/--no-docker-runtime", default=False),
+        click.option("--new-password", help="Password will be updated, if specified"),
+        click.option("--dns-fill", default="fields", type=click.Choice(["fields", "script"]),
+                     help="Fill dns fields one by one or all at once with a script, config dns.fill overrides it per model"),
+        click.option("-w", "--workers", default=1, type=click.IntRange(min=1),
+                     help="Number of routers processed concurrently"),
+        click.option("--http-workers", default=100, type=click.IntRange(min=1),
+                     help="Number of http engine routers processed concurrently"),
+        click.option("--max-driver-uses", default=50, type=click.IntRange(min=1),
+                     help="Restart a browser after N routers"),
+        click.option("--max-browser-rss", default=1024, type=click.IntRange(min=0),
+                     help="Kill a browser, driver included, using more than N MB, 0 for no limit"),
+        click.option("--max-session-time", default=900.0, type=click.FloatRange(min=0),
+                     help="Kill a browser that has been on one router for N seconds, 0 for no limit"),
+        click.option("--browser-engine", default="selenium", type=click.Choice(["selenium", "playwright"]),
+                     help="Drive a browser per worker with chromedriver, or shared browsers with playwright contexts"),
+        click.option("--browsers", default=os.cpu_count() or 1, type=click.IntRange(min=1),
+                     help="Browsers shared by the workers of the playwright engine"),
+        click.option("--browser-path", type=click.Path(),
+                     help="Chrome binary of the playwright engine, playwright's own chromium by default"),
+        click.option("--lean/--no-lean", default=False,
+                     help="Run browsers without extensions, gpu, background networking and caches"),
+        click.option("--trace", type=click.Path(), help="JSONL file for per-phase timings"),
+        click.option("--cache-dir", default=DEFAULT_CACHE_DIR, type=click.Path(),
+                     help="Directory for compiled config plans"),
+        click.option("--plan-cache/--no-plan-cache", default=True, help="Reuse plans compiled from an unchanged config"),
+        click.option("--locator-cache", type=click.Path(),
+                     help="Locators written by optimize-locators, locators.json in --cache-dir by default"),
+        click.option("--optimized-locators/--no-optimized-locators", default=True,
+                     help="Prefer optimized locators over the configured xpaths"),
+        click.option("--wait-timeout", default=WAIT_TIMEOUTS["element"], type=click.FloatRange(min=0),
+                     help="Element wait timeout before latencies are learned, and its upper bound, seconds"),
+        click.option("--alert-timeout", default=WAIT_TIMEOUTS["alert"], type=click.FloatRange(min=0),
+                     help="Alert wait timeout before latencies are learned, and its upper bound, seconds"),
+        click.option("--adaptive-timeouts/--no-adaptive-timeouts", default=True,
+                     help="Derive wait timeouts from the latencies observed for each model"),
+        click.option("--timeout-factor", default=3.0, type=click.FloatRange(min=1),
+                     help="Learned timeout is p99 latency times N"),
+        click.option("--timeout-floor", default=5.0, type=click.FloatRange(min=0),
+                     help="Learned timeouts are at least N seconds"),
+        click.option("--latency-stats", type=click.Path(),
+                     help="Latency stats file, latency.json in --cache-dir by default"),
+        click.option("--retries", default=2, type=click.IntRange(min=0), help="Retries of a failed router"),
+        click.option("--retry-on", default=f"{FAILURE_TIMEOUT},{FAILURE_CONNECTION}", callback=parse_failure_classes,
+                     help=f"Comma separated failure classes that are retried: {', '.join(FAILURE_CLASSES)}, "
+                          f"timeout includes pages whose elements didn't show up in time"),
+        click.option("--retry-delay", default=30.0, type=click.FloatRange(min=0),
+                     help="Delay before the first retry, doubled for every next one, seconds"),
+        click.option("--retry-max-delay", default=600.0, type=click.FloatRange(min=0), help="Longest retry delay, seconds"),
+        click.option("--host-concurrency", default=1, type=click.IntRange(min=1),
+                     help="Routers of the same ip processed at once"),
+        click.option("--host-interval", default=0.0, type=click.FloatRange(min=0),
+                     help="Seconds between starting routers of the same ip"),
+        click.option("--session-cache/--no-session-cache", default=False,
+                     help="Reuse the sessions of earlier logins, confirmed with the model's check_login"),
+        click.option("--session-ttl", default=600, type=click.IntRange(min=1), help="Seconds a cached session is used"),
+        click.option("--session-key", envvar="ROUTER_SESSION_KEY",
+                     help="Fernet key the cached sessions are encrypted with, generated in --cache-dir by default"),
+        click.option("--metrics-port", type=click.IntRange(min=0, max=65535),
+                     help="Serve prometheus metrics on /metrics and progress on /status at this port"),
+        click.option("--metrics-host", default="127.0.0.1", help="Address the metrics are served on"),
+    ]
+    for option in reversed(options):
+        command = option(command)
+
+    return command
+
+
+class Runner:
+    """compiled config, browsers, http sessions and worker pools shared by the routers of a run"""
+
+    def __init__(self,
+                 on_start: Callable,
+                 on_done: Callable,
+                 summary: RunSummary,
+                 driver_path: str,
+                 dns: str,
+                 verify: bool,
+                 skip_compliant: bool,
+                 config: str,
+                 fuzzy_models: bool,
+                 docker_runtime: bool,
+                 new_password: str,
+                 dns_fill: str,
+                 workers: int,
+                 http_workers: int,
+                 max_driver_uses: int,
+                 max_browser_rss: int,
+                 max_session_time: float,
+                 browser_engine: str,
+                 browsers: int,
+                 browser_path: Optional[str],
+                 lean: bool,
+                 trace: Optional[str],
+                 cache_dir: str,
+                 plan_cache: bool,
+                 locator_cache: Optional[str],
+                 optimized_locators: bool,
+                 wait_timeout: float,
+                 alert_timeout: float,
+                 adaptive_timeouts: bool,
+                 timeout_factor: float,
+                 timeout_floor: float,
+                 latency_stats: Optional[str],
+                 retries: int,
+                 retry_on: tuple,
+                 retry_delay: float,
+                 retry_max_delay: float,
+                 host_concurrency: int,
+                 host_interval: float,
+                 session_cache: bool,
+                 session_ttl: int,
+                 session_key: Optional[str],
+                 metrics_port: Optional[int],
+                 metrics_host: str,
+                 ) -> None:
+        self.on_start = on_start
+        self.on_done = on_done
+        self.retries = retries
+        self.retry_on = retry_on
+        self.retry_delay = retry_delay
+        self.retry_max_delay = retry_max_delay
+        self.host_limiter = HostLimiter(concurrency=host_concurrency, interval=host_interval)
+        # port and model group of every submitted router, by ip
+        self._hosts = defaultdict(set)
+        self.new_password = new_password
+        self.dns_fill = dns_fill
+        self.verify = verify
+        self.skip_compliant = skip_compliant
+
+        self.supervisor = Supervisor(max_rss=max_browser_rss * 1024 * 1024, max_session=max_session_time,
+                                     xvfb=docker_runtime)
+        atexit.register(self.supervisor.close)
+        # SIGTERM unwinds like Ctrl-C, so browsers and displays are torn down on the way out
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+
+        try:
+            self.cfg = load_config(config, cache_dir=cache_dir if plan_cache else None)
+        except ConfigError as e:
+            logger.error(f"Config file {config} is invalid:\n{e}")
+            exit(1)
+
+        if self.cfg.version != VERSION:
+            logger.error(f"Config file version \"{self.cfg.version}\" is not compatible with script version \"{VERSION}\"")
+            exit(1)
+
+        if optimized_locators:
+            self.cfg = apply_locator_cache(self.cfg, locator_cache or os.path.join(cache_dir, "locators.json"))
+
+        op = webdriver.ChromeOptions()
+
+        op.add_argument("--disable-notifications")
+        op.add_argument("--disable-popup-blocking")
+
+        if docker_runtime:
+            op.add_argument("--headless")
+            op.add_argument("--no-sandbox")
+            op.add_argument("--disable-dev-shm-usage")
+
+        if lean:
+            for argument in LEAN_CHROME_ARGUMENTS:
+                op.add_argument(argument)
+
+        # a single server is a tuple of one too, not a string that indexes and iterates by character
+        self.dns_servers = tuple(dns.split(",")) if dns else ()
+
+        self.sessions = None
+        if session_cache:
+            if Fernet is None:
+                logger.error("--session-cache needs cryptography: pip3 install cryptography")
+                exit(1)
             try:
-                router.reset_dns()
-            except Exception:
-                logger.exception("Failed to reset dns")
-                pass
+                self.sessions = SessionCache(directory=os.path.join(cache_dir, "sessions"), key=session_key,
+                                             ttl=session_ttl)
+            except (OSError, ValueError) as e:
+                logger.error(f"Can't use the session cache: {e}")
+                exit(1)
+
+        self.model_index = ModelIndex(self.cfg.models, fuzzy=fuzzy_models)
+        self.metrics = Metrics(summary=summary)
+        self.metrics_server = None
+        if metrics_port is not None:
+            try:
+                self.metrics_server = ThreadingHTTPServer((metrics_host, metrics_port), MetricsHandler)
+            except OSError as e:
+                logger.error(f"Can't serve metrics on {metrics_host}:{metrics_port}: {e}")
+                exit(1)
+            self.metrics_server.daemon_threads = True
+            self.metrics_server.metrics = self.metrics
+            threading.Thread(target=self.metrics_server.serve_forever, daemon=True).start()
+            logger.info(f"Serving metrics on {metrics_host}:{self.metrics_server.server_port}")
+        self.tracer = Tracer(path=trace, metrics=self.metrics)
+        self.latency = LatencyStats(path=latency_stats or os.path.join(cache_dir, "latency.json"),
+                                    limits={"element": wait_timeout, "alert": alert_timeout},
+                                    factor=timeout_factor,
+                                    floor=timeout_floor,
+                                    adaptive=adaptive_timeouts,
+                                    )
+        if browser_engine == "playwright":
+            if async_playwright is None:
+                logger.error("--browser-engine playwright needs playwright: pip3 install playwright")
+                exit(1)
+            # playwright starts chrome headless on its own
+            arguments = [argument for argument in op.arguments if argument != "--headless"]
+            self.pool = PlaywrightPool(browsers=browsers, arguments=arguments, executable_path=browser_path,
+                                       tracer=self.tracer)
+        else:
+            self.pool = DriverPool(driver_path=driver_path, driver_options=op, max_uses=max_driver_uses,
+                                   tracer=self.tracer, supervisor=self.supervisor)
+        atexit.register(self.pool.close)
+
+        self.http_adapter = HTTPAdapter(pool_connections=http_workers, pool_maxsize=http_workers)
+        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+        self._browser_workers = WorkerPool(workers=workers, handler=self._handle)
+        # http engine routers don't need a browser, they get their own, much larger, pool of workers,
+        # started only when the config has such models
+        self._http_workers = None
+        if any(plan.engine == "http" for plan in self.cfg.plans.values()):
+            self._http_workers = WorkerPool(workers=http_workers, handler=self._handle, name="h")
+        self._retry_scheduler = RetryScheduler(submit=self._dispatch)
+        self.metrics.retrying = self._retry_scheduler.pending
+        # routers submitted and not finished yet, waiting retries included
+        self._unfinished = 0
+        # keys of those routers, job ids of a worker
+        self._keys = set()
+        self._finished = threading.Condition()
+
+    def submit(self, key, idx: int, router_data: list) -> bool:
+        """queues a router to the workers of its model's engine, False for unknown models and duplicates"""
+        group_model = self.model_index.lookup(router_data[5])
+        if not group_model:
+            logger.warning(f"Model {router_data[5]} for {router_data[0]} was not found in configured models, skipping ...")
+            return False
+
+        host = (router_data[1], group_model)
+        # jobs of the coordinator's queue are unique already, and one leased again after its lease expired is redone
+        if key is None and host in self._hosts[router_data[0]]:
+            logger.info(f"Router {router_data[0]}:{router_data[1]} {group_model} on line {idx} is a duplicate, skipping ...")
+            return False
+        self._hosts[router_data[0]].add(host)
+
+        with self._finished:
+            self._unfinished += 1
+            if key is not None:
+                self._keys.add(key)
+        self.metrics.submitted()
+        self._dispatch((key, idx, router_data, group_model, 1))
+
+        return True
+
+    def running(self, key) -> bool:
+        """whether the router submitted with this key is not finished yet"""
+        with self._finished:
+            return key in self._keys
+
+    def _dispatch(self, job: tuple) -> None:
+        if self.cfg.plans[job[3]].engine == "http":
+            self._http_workers.submit(job)
+        else:
+            self._browser_workers.submit(job)
+
+    def _handle(self, job: tuple) -> None:
+        key, idx, router_data, group_model, attempt = job
+        with logger.contextualize(router=router_data[0]):
+            wait = self.host_limiter.acquire(router_data[0])
+            if wait:
+                # other routers of the same ip are running, the worker moves on to the next router meanwhile
+                self._retry_scheduler.schedule(wait, job)
+                return
+
+            try:
+                outcome, failure = self._process(job)
+            finally:
+                self.host_limiter.release(router_data[0])
 
-        if new_password:
             try:
-                router.reset_password(password=new_password)
+                if outcome == OUTCOME_FAILED and failure in self.retry_on and attempt <= self.retries:
+                    delay = backoff(attempt, self.retry_delay, self.retry_max_delay)
+                    logger.warning(f"Failed with {failure}, retry {attempt} of {self.retries} in {delay:.1f} seconds")
+                    self._retry_scheduler.schedule(delay, (key, idx, router_data, group_model, attempt + 1),
+                                                   retry=True)
+                    self.metrics.retried(group_model)
+                    return
+
+                self.metrics.finished(group_model, outcome)
+                self.on_done(key, router_data, outcome)
             except Exception:
-                logger.exception("Failed to reset password")
-                pass
+                logger.exception("Failed to finish router")
+
+            with self._finished:
+                self._unfinished -= 1
+                self._keys.discard(key)
+                self._finished.notify_all()
+
+    def _process(self, job: tuple) -> tuple:
+        key, idx, router_data, group_model, attempt = job
+        self.on_start(key, router_data)
+        self.tracer.start_router(router_ip=router_data[0], model_group=group_model)
+        self.metrics.session_started(router_data[0], group_model)
+        outcome, failure = OUTCOME_FAILED, ""
+        try:
+            with self.tracer.phase("router"):
+                outcome, failure = process_router(plan=self.cfg.plans[group_model],
+                                      idx=idx,
+                                      router_data=router_data,
+                                      dns_servers=self.dns_servers,
+                                      new_password=self.new_password,
+                                      pool=self.pool,
+                                      http_adapter=self.http_adapter,
+                                      tracer=self.tracer,
+                                      latency=self.latency,
+                                      fill_mode=self.dns_fill,
+                                      verify=self.verify,
+                                      skip_compliant=self.skip_compliant,
+                                      sessions=self.sessions,
+                                      )
+        except Exception:
+            logger.exception("Failed to process router")
+        finally:
+            self.metrics.session_ended(group_model, outcome, failure)
+
+        return outcome, failure
+
+    def join(self) -> None:
+        """waits for every submitted router, retries included"""
+        with self._finished:
+            while self._unfinished:
+                self._finished.wait()
+
+        self._browser_workers.join()
+        if self._http_workers:
+            self._http_workers.join()
+
+    def close(self) -> None:
+        if self.metrics_server:
+            self.metrics_server.shutdown()
+            self.metrics_server.server_close()
+        self.pool.close()
+        self.supervisor.close()
+        self.http_adapter.close()
+        self.latency.save()
+
+    def report(self) -> None:
+        self.model_index.report_unmatched()
+        for router_ip, hosts in self._hosts.items():
+            if len(hosts) > 1:
+                listed = ", ".join(f"port {port} {group_model}" for port, group_model in sorted(hosts))
+                logger.warning(f"IP {router_ip} is listed {len(hosts)} times: {listed}")
+        self.tracer.report()
+        self.latency.report()
+
+
+@cli.command()
+@click.option("-r", "--routers", type=click.Path(allow_dash=True), help="CSV file containing router data, - for stdin")
+@click.option("--start-from", default=0, help="Start from line N in router-data file")
+@click.option("--limit", type=click.IntRange(min=1), help="Process at most N lines of router-data file")
+@click.option("--skip-header/--no-skip-header", default=True)
+@click.option("--debug/--no-debug", default=False)
+@click.option("--preflight/--no-preflight", "preflight_check", default=True,
+              help="Skip routers that don't accept tcp connections before starting a browser")
+@click.option("--preflight-head/--no-preflight-head", default=False, help="Also require a response to HTTP HEAD")
+@click.option("--preflight-concurrency", default=256, type=click.IntRange(min=1), help="Concurrent reachability probes")
+@click.option("--preflight-timeout", default=5.0, help="Reachability probe timeout, seconds")
+@click.option("--journal", default="journal.jsonl", type=click.Path(), help="Journal of router outcomes")
+@click.option("--resume/--no-resume", default=False, help="Skip routers the journal has as done")
+@click.option("--skip-report", default="skipped.csv", type=click.Path(), help="CSV file for unreachable routers")
+@router_options
+def reset(routers: str, start_from: int, limit: Optional[int], skip_header: bool, debug: bool, preflight_check: bool,
+          preflight_head: bool, preflight_concurrency: int, preflight_timeout: float, journal: str, resume: bool,
+          skip_report: str, **options):
+    setup_logging()
+
+    if debug:
+        limit = 1
+
+    summary = RunSummary()
+    action = "+".join(name for name, enabled in (("dns", options["dns"]), ("password", options["new_password"]))
+                      if enabled)
+    run_journal = Journal(path=journal, resume=resume)
+    atexit.register(run_journal.close)
+
+    def on_start(key, router_data: list) -> None:
+        run_journal.record(router_data[0], router_data[1], action, JOURNAL_STARTED)
+
+    def on_done(key, router_data: list, outcome: str) -> None:
+        summary.add(outcome, router_data[0])
+        run_journal.record(router_data[0], router_data[1], action, outcome)
+
+    runner = Runner(on_start=on_start, on_done=on_done, summary=summary, **options)
+
+    stop = None if limit is None else start_from + limit
+    if options["metrics_port"] is not None and routers != "-":
+        # counted up front for the progress and eta, stdin can't be read twice
+        rows = islice(read_routers(routers, skip_header), start_from, stop)
+        runner.metrics.total = sum(1 for _, row in rows
+                                   if any(row) and not (resume and len(row) > 1
+                                                        and run_journal.is_done(row[0], row[1], action)))
+    routers_data = valid_routers(islice(read_routers(routers, skip_header), start_from, stop), summary)
+    if resume:
+        routers_data = pending_routers(rows=routers_data, journal=run_journal, action=action)
+
+    report_file = None
+    if preflight_check:
+        report_file = open(skip_report, mode="w", encoding="utf8", newline="")
+        report_writer = csv.writer(report_file, delimiter=";")
+        report_writer.writerow(SKIP_REPORT_HEADER)
+        routers_data = reachable_routers(rows=routers_data,
+                                         summary=summary,
+                                         report_writer=report_writer,
+                                         batch_size=preflight_concurrency * PREFLIGHT_BATCH_FACTOR,
+                                         concurrency=preflight_concurrency,
+                                         timeout=preflight_timeout,
+                                         http_head=preflight_head,
+                                         )
+
+    try:
+        for idx, router_data in routers_data:
+            if not runner.submit(None, idx, router_data):
+                summary.add(OUTCOME_SKIPPED, router_data[0])
+
+        runner.join()
+    finally:
+        runner.close()
+        run_journal.close()
+        if report_file:
+            report_file.close()
+
+    summary.report()
+    runner.report()
+
+
+class JobQueue:
+    """sqlite backed queue of routers, leased to workers for a limited time"""
+
+    def __init__(self, path: str, lease_seconds: float, max_attempts: int) -> None:
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY,
+                    idx INTEGER NOT NULL,
+                    ip TEXT NOT NULL,
+                    port TEXT NOT NULL,
+                    row TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    outcome TEXT,
+                    worker TEXT,
+                    lease_until REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    UNIQUE (ip, port)
+                )""")
+            self._db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, lease_until)")
+
+    def load(self, rows: Iterable) -> int:
+        """adds routers that are not queued yet, returns the number of added routers"""
+        rows = iter(rows)
+        added = 0
+        while True:
+            batch = [(idx, row[0], row[1], json.dumps(row)) for idx, row in islice(rows, JOB_QUEUE_BATCH)]
+            if not batch:
+                return added
+
+            with self._lock, self._db:
+                before = self._db.total_changes
+                self._db.executemany("INSERT OR IGNORE INTO jobs (idx, ip, port, row) VALUES (?, ?, ?, ?)", batch)
+                added += self._db.total_changes - before
+
+    def _expire(self, now: float) -> None:
+        """puts jobs of workers that stopped renewing their leases back to the queue"""
+        expired = self._db.execute("SELECT ip, worker, attempts FROM jobs WHERE status = ? AND lease_until < ?",
+                                   (JOB_LEASED, now)).fetchall()
+        for ip, worker, attempts in expired:
+            logger.warning(f"Lease of {ip} by {worker} expired after attempt {attempts}")
+
+        self._db.execute("UPDATE jobs SET status = ?, outcome = ?, worker = NULL, lease_until = NULL "
+                         "WHERE status = ? AND lease_until < ? AND attempts >= ?",
+                         (JOB_DONE, OUTCOME_FAILED, JOB_LEASED, now, self.max_attempts))
+        self._db.execute("UPDATE jobs SET status = ?, worker = NULL, lease_until = NULL "
+                         "WHERE status = ? AND lease_until < ?",
+                         (JOB_PENDING, JOB_LEASED, now))
+
+    def lease(self, worker: str, count: int) -> list:
+        now = time.time()
+        with self._lock, self._db:
+            self._expire(now)
+            jobs = self._db.execute("SELECT id, idx, row FROM jobs WHERE status = ? ORDER BY id LIMIT ?",
+                                    (JOB_PENDING, count)).fetchall()
+            self._db.executemany("UPDATE jobs SET status = ?, worker = ?, lease_until = ?, attempts = attempts + 1 "
+                                 "WHERE id = ?",
+                                 [(JOB_LEASED, worker, now + self.lease_seconds, job_id) for job_id, _, _ in jobs])
+
+        return [{"id": job_id, "idx": idx, "row": json.loads(row)} for job_id, idx, row in jobs]
+
+    def renew(self, worker: str, job_ids: list) -> None:
+        with self._lock, self._db:
+            self._db.executemany("UPDATE jobs SET lease_until = ? WHERE id = ? AND status = ? AND worker = ?",
+                                 [(time.time() + self.lease_seconds, job_id, JOB_LEASED, worker)
+                                  for job_id in job_ids])
+
+    def complete(self, job_id: int, outcome: str) -> None:
+        """the first reported outcome wins, a late result of an expired lease is ignored"""
+        with self._lock, self._db:
+            self._db.execute("UPDATE jobs SET status = ?, outcome = ?, lease_until = NULL WHERE id = ? AND status != ?",
+                             (JOB_DONE, outcome, job_id, JOB_DONE))
+
+    def status(self) -> dict:
+        with self._lock:
+            rows = self._db.execute("SELECT status, outcome, count(*) FROM jobs GROUP BY status, outcome").fetchall()
+
+        status = {JOB_PENDING: 0, JOB_LEASED: 0}
+        status.update({outcome: 0 for outcome in OUTCOMES})
+        for job_status, outcome, count in rows:
+            status[outcome if job_status == JOB_DONE else job_status] += count
+
+        return status
+
+    def unfinished(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT count(*) FROM jobs WHERE status != ?", (JOB_DONE,)).fetchone()[0]
+
+    def failed(self) -> Iterator[str]:
+        with self._lock:
+            rows = self._db.execute("SELECT ip FROM jobs WHERE status = ? AND outcome = ? ORDER BY id",
+                                    (JOB_DONE, OUTCOME_FAILED)).fetchall()
+
+        return (ip for ip, in rows)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class CoordinatorHandler(BaseHTTPRequestHandler):
+    """json api of the job queue: POST /lease, /renew, /complete and GET /status, with a bearer token"""
+
+    def log_message(self, format: str, *args) -> None:
+        logger.trace(f"{self.client_address[0]} {format % args}")
+
+    def _reply(self, payload: dict, status: int = 200) -> None:
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _authorized(self) -> bool:
+        """leases carry router credentials, so every request needs the shared token"""
+        token = self.headers.get("Authorization", "")
+        if hmac.compare_digest(token.encode(), f"Bearer {self.server.token}".encode()):
+            return True
+
+        self._reply({"error": "unauthorized"}, status=401)
+        return False
+
+    def do_GET(self) -> None:
+        if not self._authorized():
+            return
+
+        if self.path != "/status":
+            self._reply({"error": "not found"}, status=404)
+            return
+
+        self._reply(self.server.job_queue.status())
+
+    def do_POST(self) -> None:
+        if not self._authorized():
+            return
+
+        job_queue = self.server.job_queue
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if self.path == "/lease":
+                jobs = job_queue.lease(worker=request["worker"], count=int(request["count"]))
+                self._reply({"jobs": jobs,
+                             "lease_seconds": job_queue.lease_seconds,
+                             "done": not jobs and not job_queue.unfinished(),
+                             })
+            elif self.path == "/renew":
+                job_queue.renew(worker=request["worker"], job_ids=request["ids"])
+                self._reply({})
+            elif self.path == "/complete":
+                if request["outcome"] not in OUTCOMES:
+                    raise ValueError(f"unknown outcome {request['outcome']}")
+                job_queue.complete(job_id=request["id"], outcome=request["outcome"])
+                self._reply({})
+            else:
+                self._reply({"error": "not found"}, status=404)
+        except (KeyError, ValueError, TypeError) as e:
+            self._reply({"error": f"bad request: {e}"}, status=400)
+
+
+class QueueClient:
+    """worker side of the coordinator api, renews the leases of jobs in progress"""
+
+    def __init__(self, url: str, worker: str, token: str) -> None:
+        self.url = url.rstrip("/")
+        self.worker = worker
+        self.session = requests.Session()
+        self.session.headers["Authorization"] = f"Bearer {token}"
+        self.lease_seconds = None
+        self._held = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._heartbeat = threading.Thread(target=self._renew, daemon=True)
+
+    def _post(self, path: str, payload: dict) -> dict:
+        response = self.session.post(f"{self.url}{path}", json=payload, timeout=HTTP_TIMEOUT)
+        response.raise_for_status()
+        return response.json()
+
+    def lease(self, count: int) -> tuple:
+        """leased jobs, and whether the queue has no unfinished jobs left"""
+        reply = self._post("/lease", {"worker": self.worker, "count": count})
+        self.lease_seconds = reply["lease_seconds"]
+        with self._lock:
+            self._held.update(job["id"] for job in reply["jobs"])
+        if not self._heartbeat.is_alive():
+            self._heartbeat.start()
+
+        return reply["jobs"], reply["done"]
+
+    def _renew(self) -> None:
+        while not self._stop.wait(self.lease_seconds / 3):
+            with self._lock:
+                held = list(self._held)
+            if not held:
+                continue
 
-        del router
+            try:
+                self._post("/renew", {"worker": self.worker, "ids": held})
+            except requests.RequestException as e:
+                logger.warning(f"Can't renew leases: {e}")
+
+    def complete(self, job_id: int, outcome: str) -> None:
+        try:
+            self._post("/complete", {"id": job_id, "outcome": outcome})
+        except requests.RequestException as e:
+            logger.error(f"Can't report outcome {outcome} of job {job_id}, it will be retried after its lease expires: {e}")
+        finally:
+            with self._lock:
+                self._held.discard(job_id)
+
+    def close(self) -> None:
+        self._stop.set()
+        self.session.close()
+
+
+@cli.command()
+@click.option("-r", "--routers", type=click.Path(allow_dash=True),
+              help="CSV file containing router data, - for stdin, routers already in the queue are kept")
+@click.option("--start-from", default=0, help="Start from line N in router-data file")
+@click.option("--limit", type=click.IntRange(min=1), help="Queue at most N lines of router-data file")
+@click.option("--skip-header/--no-skip-header", default=True)
+@click.option("--queue", "queue_path", default="queue.sqlite", type=click.Path(), help="SQLite job queue")
+@click.option("--host", default="127.0.0.1", help="Address to listen on, use a tunnel or a TLS proxy across hosts")
+@click.option("--port", default=8765, help="Port to listen on")
+@click.option("--token", envvar="ROUTER_QUEUE_TOKEN", required=True,
+              help="Shared token the workers authenticate with, also read from ROUTER_QUEUE_TOKEN")
+@click.option("--lease", "lease_seconds", default=600.0, type=click.FloatRange(min=1),
+              help="Seconds before the routers of a worker that stopped renewing are queued again")
+@click.option("--max-attempts", default=3, type=click.IntRange(min=1), help="Leases of a router before it is failed")
+@click.option("--linger", default=10.0, help="Seconds to keep serving after the queue is finished, so workers exit")
+def coordinator(routers: Optional[str], start_from: int, limit: Optional[int], skip_header: bool, queue_path: str,
+                host: str, port: int, token: str, lease_seconds: float, max_attempts: int, linger: float):
+    setup_logging()
+
+    summary = RunSummary()
+    job_queue = JobQueue(path=queue_path, lease_seconds=lease_seconds, max_attempts=max_attempts)
+    if routers:
+        stop = None if limit is None else start_from + limit
+        added = job_queue.load(valid_routers(islice(read_routers(routers, skip_header), start_from, stop), summary))
+        logger.info(f"Queued {added} routers")
+
+    server = ThreadingHTTPServer((host, port), CoordinatorHandler)
+    server.daemon_threads = True
+    server.job_queue = job_queue
+    server.token = token
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"Serving the job queue on {host}:{port}")
+
+    try:
+        while job_queue.unfinished():
+            sleep(COORDINATOR_STATUS_INTERVAL)
+            logger.info(", ".join(f"{key}: {count}" for key, count in job_queue.status().items()))
+
+        logger.info(f"All routers are processed, exiting in {linger} seconds")
+        sleep(linger)
+    finally:
+        server.shutdown()
+
+    status = job_queue.status()
+    logger.info(", ".join(f"{outcome}: {status[outcome] + summary.counts[outcome]}" for outcome in OUTCOMES))
+    failed = " ".join(job_queue.failed())
+    if failed:
+        logger.info(f"Failed routers: {failed}")
+    job_queue.close()
+
+
+@cli.command()
+@click.option("--coordinator", "coordinator_url", required=True, help="Coordinator url: http://host:8765")
+@click.option("--token", envvar="ROUTER_QUEUE_TOKEN", required=True,
+              help="Token of the coordinator, also read from ROUTER_QUEUE_TOKEN")
+@click.option("--name", default=f"{socket.gethostname()}-{os.getpid()}", help="Worker name, for the coordinator logs")
+@click.option("--poll-interval", default=2.0, help="Seconds between lease requests while no router is queued")
+@router_options
+def worker(coordinator_url: str, token: str, name: str, poll_interval: float, **options):
+    setup_logging()
+
+    summary = RunSummary()
+    client = QueueClient(url=coordinator_url, worker=name, token=token)
+    # at most this many routers are leased at once, so idle workers on other hosts are not starved
+    slots = threading.BoundedSemaphore(options["workers"] * 2)
+
+    def on_done(job_id: int, router_data: list, outcome: str) -> None:
+        summary.add(outcome, router_data[0])
+        client.complete(job_id, outcome)
+        slots.release()
+
+    runner = Runner(on_start=lambda job_id, router_data: None, on_done=on_done, summary=summary, **options)
+
+    try:
+        while True:
+            slots.acquire()
+            count = 1
+            while slots.acquire(blocking=False):
+                count += 1
+
+            try:
+                jobs, done = client.lease(count)
+            except requests.RequestException as e:
+                logger.warning(f"Can't lease routers from {coordinator_url}: {e}")
+                jobs, done = [], False
+
+            for _ in range(count - len(jobs)):
+                slots.release()
+
+            for job in jobs:
+                if runner.running(job["id"]):
+                    # leased again while it is still in progress here, the run in progress reports it
+                    slots.release()
+                    continue
+                if not runner.submit(job["id"], job["idx"], job["row"]):
+                    on_done(job["id"], job["row"], OUTCOME_SKIPPED)
+
+            if done:
+                break
+            if not jobs:
+                sleep(poll_interval)
+
+        runner.join()
+    finally:
+        runner.close()
+        client.close()
+
+    summary.report()
+    runner.report()
+
+
+def _locator_candidates(element) -> Iterator[Tuple[str, str]]:
+    """(type, location) of shorter locators of a snapshot element, cheapest first"""
+    tag = element.tag
+    if element.get("id"):
+        yield "id", element.get("id")
+
+    for attributes in (("name",), ("type", "value")):
+        values = [_xpath_literal(element.get(attribute)) if element.get(attribute) else None
+                  for attribute in attributes]
+        if all(values):
+            yield "xpath", f"//{tag}" + "".join(f"[@{attribute}={value}]"
+                                                for attribute, value in zip(attributes, values))
+
+    text = " ".join(element.text_content().split())
+    if text and len(text) <= LOCATOR_TEXT_LENGTH and _xpath_literal(text):
+        yield "xpath", f"//{tag}[normalize-space()={_xpath_literal(text)}]"
+
+    # shortest unique tail of the element's absolute path, then the path below its closest ancestor with an id
+    steps = element.getroottree().getpath(element).split("/")[1:]
+    for count in range(1, len(steps)):
+        yield "xpath", "//" + "/".join(steps[-count:])
+
+    for depth, ancestor in enumerate(element.iterancestors(), start=1):
+        if ancestor.get("id") and _xpath_literal(ancestor.get("id")):
+            yield "xpath", f"//*[@id={_xpath_literal(ancestor.get('id'))}]/" + "/".join(steps[-depth:])
+            break
+
+
+def optimize_xpath(xpath: str, pages: list) -> Optional[dict]:
+    """shorter locator that selects the same elements as xpath in every page, None if there is none"""
+    try:
+        matches = [page.xpath(xpath) for page in pages]
+    except lxml.etree.XPathError as e:
+        logger.warning(f"Can't evaluate {xpath}: {e}")
+        return None
+
+    element = next((found[0] for found in matches if len(found) == 1), None)
+    if element is None:
+        return None
+
+    for kind, location in _locator_candidates(element):
+        if kind == "xpath" and len(location) >= len(xpath):
+            continue
+        candidate = f"//*[@id={_xpath_literal(location)}]" if kind == "id" else location
+        try:
+            if all(page.xpath(candidate) == found for page, found in zip(pages, matches)):
+                return {"type": kind, "location": location}
+        except lxml.etree.XPathError:
+            continue
+
+    return None
+
+
+@cli.command("optimize-locators")
+@click.option("-c", "--config", required=True, type=click.Path(exists=True), help="Config file, yaml")
+@click.option("--snapshots", required=True, type=click.Path(exists=True, file_okay=False),
+              help="Directory with a directory of html pages per model group")
+@click.option("-o", "--output", type=click.Path(), help="Locator cache, locators.json in --cache-dir by default")
+@click.option("--cache-dir", default=DEFAULT_CACHE_DIR, type=click.Path(), help="Directory for the locator cache")
+def optimize_locators(config: str, snapshots: str, output: Optional[str], cache_dir: str):
+    """finds ids and short xpaths for the configured xpaths in page snapshots and writes them to the locator cache"""
+    setup_logging()
+    if lxml is None:
+        logger.error("optimize-locators needs lxml: pip3 install lxml")
+        exit(1)
+
+    try:
+        cfg = load_config(config, cache_dir=None)
+    except ConfigError as e:
+        logger.error(f"Config file {config} is invalid:\n{e}")
+        exit(1)
+
+    models = {}
+    total = optimized = 0
+    for name, plan in sorted(cfg.plans.items()):
+        model_dir = os.path.join(snapshots, name)
+        files = sorted(os.listdir(model_dir)) if os.path.isdir(model_dir) else []
+        pages = [lxml.html.parse(os.path.join(model_dir, file)).getroot()
+                 for file in files if file.endswith((".html", ".htm"))]
+        if not pages:
+            logger.debug(f"No snapshots of {name}")
+            continue
+
+        xpaths = []
+
+        def collect(locator: Locator) -> Locator:
+            # select steps keep their xpath, a value is only selected on id steps
+            if locator.kind == "xpath" and locator.value is None:
+                xpaths.append(locator.location)
+            return locator
+
+        _map_locators(plan, collect)
+
+        locators = {}
+        for xpath in dict.fromkeys(xpaths):
+            total += 1
+            found = optimize_xpath(xpath, pages)
+            if found:
+                logger.info(f"{name}: {xpath} -> {found['type']} {found['location']}")
+                locators[xpath] = found
+            else:
+                logger.warning(f"{name}: no shorter locator for {xpath}")
+        optimized += len(locators)
+        models[name] = locators
+
+    output = output or os.path.join(cache_dir, "locators.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    tmp_file = f"{output}.{os.getpid()}"
+    with open(tmp_file, "w") as f:
+        json.dump({"format": LOCATOR_CACHE_FORMAT, "models": models}, f, indent=2)
+    os.replace(tmp_file, output)
+
+    logger.info(f"Optimized {optimized} of {total} xpaths of {len(models)} models, written to {output}")
 
 
 if __name__ == "__main__":
@@ -1,11 +1,108 @@
 from flask import Flask
 from flask import request
+import atexit
+import fcntl
+import gzip
 import json
+import os
+import shutil
+import threading
+import time
 
 
-LOG_FILE="/logs/data.log"
+LOG_FILE = os.environ.get("LOG_FILE", "/logs/data.log")
+# buffered records are written once there are this many of them, or after FLUSH_SECONDS
+FLUSH_RECORDS = int(os.environ.get("FLUSH_RECORDS", 1000))
+FLUSH_SECONDS = float(os.environ.get("FLUSH_SECONDS", 1.0))
+# log file is rotated to a gzipped, timestamped file when it grows past this size
+ROTATE_BYTES = int(os.environ.get("ROTATE_BYTES", 100 * 1024 * 1024))
+# uploads are refused with 503 while this many records wait to be written, e.g. while the disk is full
+MAX_BUFFER_RECORDS = int(os.environ.get("MAX_BUFFER_RECORDS", 100000))
+MAX_BATCH_RECORDS = 10000
+
+
+class LogWriter:
+    """buffers log lines in memory, a background thread appends them to the log file"""
+
+    def __init__(self, path: str, flush_records: int, flush_seconds: float, rotate_bytes: int,
+                 max_records: int) -> None:
+        self.path = path
+        self.flush_records = flush_records
+        self.flush_seconds = flush_seconds
+        self.rotate_bytes = rotate_bytes
+        self.max_records = max_records
+        self._lines = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def write(self, lines: list) -> bool:
+        """False when the buffer is full and the lines were not taken"""
+        with self._lock:
+            if len(self._lines) + len(lines) > self.max_records:
+                return False
+            self._lines += lines
+            full = len(self._lines) >= self.flush_records
+
+        if full:
+            self._wakeup.set()
+        return True
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait(self.flush_seconds)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except OSError as e:
+                app.logger.error(f"Can't write {self.path}: {e}")
+
+    def _requeue(self, lines: list) -> None:
+        """puts lines that could not be written back in front of the buffer, they are retried on the next flush"""
+        with self._lock:
+            self._lines[:0] = lines
+
+    def flush(self) -> None:
+        with self._lock:
+            lines, self._lines = self._lines, []
+        if not lines:
+            return
+
+        rotated = None
+        written = False
+        try:
+            # every uwsgi worker has its own writer, the lock file keeps their writes and rotations apart
+            with open(f"{self.path}.lock", "w") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                with open(self.path, "a") as f:
+                    f.write("\n".join(lines) + "\n")
+                    size = f.tell()
+                written = True
+
+                if size >= self.rotate_bytes:
+                    rotated = f"{self.path}.{time.strftime('%Y%m%d-%H%M%S')}.{os.getpid()}"
+                    n = 0
+                    while os.path.exists(f"{rotated}.{n}.gz"):
+                        n += 1
+                    rotated = f"{rotated}.{n}"
+                    os.rename(self.path, rotated)
+        except OSError:
+            if not written:
+                self._requeue(lines)
+            raise
+
+        if rotated:
+            with open(rotated, "rb") as src, gzip.open(f"{rotated}.gz", "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(rotated)
+
 
 app = Flask(__name__)
+writer = LogWriter(path=LOG_FILE, flush_records=FLUSH_RECORDS, flush_seconds=FLUSH_SECONDS, rotate_bytes=ROTATE_BYTES,
+                   max_records=MAX_BUFFER_RECORDS)
+atexit.register(writer.flush)
+
 
 @app.route("/", methods=["GET", "POST"])
 def default():
@@ -15,7 +112,23 @@ def default():
         data = request.form
         data = json.dumps(data)
 
-        with open(LOG_FILE, "a") as f:
-            f.write(f"{data}\n")
+        if not writer.write([data]):
+            return "log buffer is full", 503
 
         return ""
+
+
+@app.route("/batch", methods=["POST"])
+def batch():
+    """accepts a json list of records, every record is written as one log line"""
+    records = request.get_json(silent=True)
+    if not isinstance(records, list) or not all(isinstance(record, dict) for record in records):
+        return {"error": "expected a json list of objects"}, 400
+
+    if len(records) > MAX_BATCH_RECORDS:
+        return {"error": f"at most {MAX_BATCH_RECORDS} records per request"}, 413
+
+    if not writer.write([json.dumps(record) for record in records]):
+        return {"error": "log buffer is full, retry later"}, 503
+
+    return {"accepted": len(records)}
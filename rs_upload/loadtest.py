@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+"""Posts records to the collector from concurrent clients and reports requests per second and latency"""
+import http.client
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode, urlsplit
+
+import click
+
+
+def percentile(sorted_values: list, pct: float) -> float:
+    idx = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[idx]
+
+
+def record(n: int) -> dict:
+    return {"ip": f"10.0.{n // 256 % 256}.{n % 256}", "model": "ZTE ZXHN H298A", "dns": "8.8.8.8,1.1.1.1",
+            "status": "ok"}
+
+
+def start_local_app(log_dir: str) -> tuple:
+    """serves the collector from this process with the werkzeug server, logging to log_dir"""
+    os.environ["LOG_FILE"] = os.path.join(log_dir, "data.log")
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "app"))
+    from main import app, writer
+    from werkzeug.serving import make_server
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", writer
+
+
+def client(url: str, batch: int, deadline: float, latencies: list, errors: list) -> None:
+    parts = urlsplit(url)
+    connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+    n = 0
+    while time.monotonic() < deadline:
+        if batch:
+            path = "/batch"
+            body = json.dumps([record(n + i) for i in range(batch)])
+            headers = {"Content-Type": "application/json"}
+        else:
+            path = "/"
+            body = urlencode(record(n))
+            headers = {"Content-Type": "application/x-www-form-urlencoded"}
+        n += max(batch, 1)
+
+        started = time.monotonic()
+        try:
+            connection.request("POST", path, body=body, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            if response.status != 200:
+                errors.append(response.status)
+        except (OSError, http.client.HTTPException) as e:
+            errors.append(str(e))
+            connection.close()
+            continue
+        latencies.append(time.monotonic() - started)
+
+
+@click.command()
+@click.option("--url", help="Collector url, by default the app is served locally with a temporary log directory")
+@click.option("-c", "--concurrency", default=16, help="Concurrent clients")
+@click.option("-t", "--duration", default=10.0, help="Seconds to run")
+@click.option("-b", "--batch", default=0, help="Records per request to /batch, 0 posts single records to /")
+def loadtest(url: str, concurrency: int, duration: float, batch: int):
+    with tempfile.TemporaryDirectory() as log_dir:
+        writer = None
+        if not url:
+            url, writer = start_local_app(log_dir)
+
+        latencies, errors = [], []
+        deadline = time.monotonic() + duration
+        threads = [threading.Thread(target=client, args=(url, batch, deadline, latencies, errors))
+                   for _ in range(concurrency)]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+
+        if writer:
+            writer.flush()
+            with open(writer.path) as f:
+                written = sum(1 for _ in f)
+
+    if not latencies:
+        click.echo(f"No successful requests, errors: {errors[:10]}")
+        sys.exit(1)
+
+    latencies.sort()
+    click.echo(f"{'/batch' if batch else '/'}: {len(latencies)} requests in {elapsed:.1f}s, {len(errors)} errors")
+    click.echo(f"requests/s: {len(latencies) / elapsed:.0f}, records/s: {len(latencies) * max(batch, 1) / elapsed:.0f}")
+    click.echo(f"latency p50: {percentile(latencies, 50) * 1000:.1f}ms, p99: {percentile(latencies, 99) * 1000:.1f}ms")
+    if writer:
+        click.echo(f"records written: {written}")
+
+
+if __name__ == "__main__":
+    loadtest()
@@ -5,7 +5,7 @@ NEW_PASSWORD = "1111"
 
 
 @task
-def test_password_change(ctx, start_from=0):
+def test_password_change(ctx, start_from=0, resume=False):
     if start_from > 2:
         start_from = start_from - 2
 
@@ -15,13 +15,14 @@ def test_password_change(ctx, start_from=0):
   --new-password {NEW_PASSWORD} \
   --config config.yaml \
   --start-from {start_from} \
+  {'--resume' if resume else ''} \
   --debug"
 
     print(cmd)
     ctx.run(cmd)\
 
 @task
-def test_dns_change(ctx, start_from=0):
+def test_dns_change(ctx, start_from=0, resume=False):
     if start_from > 2:
         start_from = start_from - 2
 
@@ -31,7 +32,20 @@ def test_dns_change(ctx, start_from=0):
   --routers routers_test_all.csv \
   --config config.yaml \
   --start-from {start_from} \
+  {'--resume' if resume else ''} \
   --debug"
 
     print(cmd)
     ctx.run(cmd)
+
+
+@task
+def bench(ctx, routers=20, workers=1, delay=0.0):
+    cmd = f"./bench/benchmark.py \
+  --driver-path {DRIVER_PATH} \
+  --routers {routers} \
+  --workers {workers} \
+  --delay {delay}"
+
+    print(cmd)
+    ctx.run(cmd)
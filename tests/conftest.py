@@ -0,0 +1,5 @@
+import os
+import sys
+
+# router_reset_dns.py is a script at the root of the repo, not an installed package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
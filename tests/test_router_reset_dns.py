@@ -0,0 +1,526 @@
+import asyncio
+import csv
+import gzip
+import importlib.util
+import io
+import json
+import os
+import random
+import socket
+import ssl
+import threading
+
+import pytest
+import yaml
+
+import router_reset_dns as r
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIG = os.path.join(ROOT, "config.yaml")
+
+
+def _row(ip: str, model: str = "ZTE_ZXHN_H298A") -> list:
+    return [ip, "80", "", "", "admin:admin", model]
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(r.time, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def monotonic(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(r.time, "monotonic", clock)
+    return clock
+
+
+@pytest.fixture
+def job_queue(tmp_path, clock):
+    job_queue = r.JobQueue(str(tmp_path / "jobs.sqlite"), lease_seconds=60, max_attempts=2)
+    yield job_queue
+    job_queue.close()
+
+
+@pytest.fixture
+def models():
+    with open(CONFIG) as f:
+        return yaml.safe_load(f)["models"]
+
+
+def test_job_queue_skips_routers_already_queued(job_queue):
+    assert job_queue.load(enumerate([_row("10.0.0.1"), _row("10.0.0.2")])) == 2
+    assert job_queue.load(enumerate([_row("10.0.0.1"), _row("10.0.0.3")])) == 1
+    assert job_queue.status()[r.JOB_PENDING] == 3
+
+
+def test_job_queue_leases_every_job_once(job_queue):
+    job_queue.load(enumerate([_row("10.0.0.1"), _row("10.0.0.2"), _row("10.0.0.3")]))
+
+    first = job_queue.lease("a", 2)
+    second = job_queue.lease("b", 2)
+
+    assert [job["row"][0] for job in first] == ["10.0.0.1", "10.0.0.2"]
+    assert [job["row"][0] for job in second] == ["10.0.0.3"]
+    assert job_queue.lease("c", 2) == []
+
+
+def test_job_queue_requeues_expired_leases(job_queue, clock):
+    job_queue.load(enumerate([_row("10.0.0.1")]))
+    job = job_queue.lease("a", 1)[0]
+
+    clock.now += 30
+    assert job_queue.lease("b", 1) == []
+
+    clock.now += 31
+    assert [leased["id"] for leased in job_queue.lease("b", 1)] == [job["id"]]
+
+
+def test_job_queue_renewed_leases_do_not_expire(job_queue, clock):
+    job_queue.load(enumerate([_row("10.0.0.1")]))
+    job = job_queue.lease("a", 1)[0]
+
+    clock.now += 50
+    job_queue.renew("a", [job["id"]])
+    clock.now += 50
+
+    assert job_queue.lease("b", 1) == []
+
+
+def test_job_queue_fails_jobs_out_of_attempts(job_queue, clock):
+    job_queue.load(enumerate([_row("10.0.0.1")]))
+    job_queue.lease("a", 1)
+    clock.now += 61
+    job_queue.lease("b", 1)
+    clock.now += 61
+
+    assert job_queue.lease("c", 1) == []
+    assert job_queue.status()[r.OUTCOME_FAILED] == 1
+    assert list(job_queue.failed()) == ["10.0.0.1"]
+    assert job_queue.unfinished() == 0
+
+
+def test_job_queue_first_outcome_wins(job_queue, clock):
+    job_queue.load(enumerate([_row("10.0.0.1")]))
+    job = job_queue.lease("a", 1)[0]
+    clock.now += 61
+    job_queue.lease("b", 1)
+
+    job_queue.complete(job["id"], r.OUTCOME_SUCCEEDED)
+    # the late result of the expired lease
+    job_queue.complete(job["id"], r.OUTCOME_FAILED)
+
+    status = job_queue.status()
+    assert status[r.OUTCOME_SUCCEEDED] == 1
+    assert status[r.OUTCOME_FAILED] == 0
+    assert status[r.JOB_LEASED] == 0
+
+
+@pytest.mark.parametrize("attempt", [1, 2, 3, 8])
+def test_backoff_is_between_half_and_all_of_the_delay(attempt):
+    random.seed(attempt)
+    ceiling = min(60.0, 5.0 * 2 ** (attempt - 1))
+    for _ in range(1000):
+        delay = r.backoff(attempt, delay=5.0, max_delay=60.0)
+        assert ceiling / 2 <= delay <= ceiling
+
+
+def test_backoff_is_capped():
+    assert max(r.backoff(20, delay=5.0, max_delay=60.0) for _ in range(1000)) <= 60.0
+
+
+@pytest.mark.parametrize("model, expected", [
+    ("ZTE ZXHN H298A V1.1, firmware: V1.1.20_ROS_T20", "zte zxhn h298a v1.1"),
+    ("ZTE_ZXHN_H298A", "zte zxhn h298a"),
+    ("  TP-LINK   TL-WR841N  ", "tp link tl wr841n"),
+    ("Tenda 11N Wireless Router, hardware: V1.0, firmware: V5.07.64_en", "tenda 11n wireless router"),
+])
+def test_normalize_model(model, expected):
+    assert r.normalize_model(model) == expected
+
+
+def test_model_index_matches_aliases_exactly(models):
+    index = r.ModelIndex(models)
+
+    assert index.lookup("zte zxhn h298a") == "ZTE_ZXHN_H298A"
+    assert index.lookup("ZTE ZXHN H298A, firmware: V1.1.20") == "ZTE_ZXHN_H298A"
+    assert index.lookup("ZTE ZXHN H298A Pro") == ""
+    assert index.unmatched["ZTE ZXHN H298A Pro"] == 1
+
+
+def test_model_index_does_not_match_group_names():
+    index = r.ModelIndex({"Group": ["Some Router"]})
+
+    assert index.lookup("Group") == ""
+
+
+def test_model_index_guesses_only_when_fuzzy(models):
+    index = r.ModelIndex(models, fuzzy=True)
+
+    assert index.lookup("ZTE ZXHN H298A Pro") == "ZTE_ZXHN_H298A"
+    assert index.guessed[("ZTE ZXHN H298A Pro", "ZTE_ZXHN_H298A")] == 1
+    assert index.lookup("Unknown Router") == ""
+
+
+def test_config_yaml_compiles():
+    with open(CONFIG) as f:
+        compiled = r.compile_config(yaml.safe_load(f))
+
+    assert set(compiled.plans) >= set(compiled.models)
+
+
+def test_compile_config_reports_every_model():
+    cfg = {
+        "models": {"A": ["a"], "B": ["b"], "C": ["c"]},
+        "routers": {
+            "A": {"login": {}, "steps": [{"type": "css", "location": "x"}]},
+            "B": {"engine": "ftp"},
+        },
+    }
+    with pytest.raises(r.ConfigError) as e:
+        r.compile_config(cfg)
+
+    errors = str(e.value).splitlines()
+    assert any(error.startswith("A.") for error in errors)
+    assert "B.engine should be browser or http, got 'ftp'" in errors
+    assert "models.C has no entry in routers" in errors
+
+
+@pytest.mark.parametrize("template", ["{}", "{0}", "{dns_1", "dns}", "{dns.real}"])
+def test_compile_config_rejects_bad_http_templates(template):
+    model = {"engine": "http", "http": {"dns": [{"path": "/dns", "data": {"dns": template}}]}}
+
+    with pytest.raises(r.ConfigError, match=r"M\.http\.dns\[0\]\.data\.dns"):
+        r.compile_model("M", model)
+
+
+def test_cached_plans_load_back_unchanged(tmp_path):
+    compiled = r.load_config(CONFIG, str(tmp_path))
+
+    assert r.load_config(CONFIG, str(tmp_path)) == compiled
+    cache_file, = tmp_path.iterdir()
+    json.loads(cache_file.read_text())
+
+
+def test_journal_resumes_done_routers_only(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    journal = r.Journal(path, resume=False)
+    for ip, status in (("10.0.0.1", r.OUTCOME_SUCCEEDED), ("10.0.0.2", r.OUTCOME_COMPLIANT),
+                       ("10.0.0.3", r.OUTCOME_UNCONFIRMED), ("10.0.0.4", r.OUTCOME_FAILED),
+                       ("10.0.0.5", r.JOURNAL_STARTED)):
+        journal.record(ip, "80", "dns", r.JOURNAL_STARTED)
+        journal.record(ip, "80", "dns", status)
+    journal.close()
+    # torn write of an interrupted run
+    with open(path, "a") as f:
+        f.write('{"ip": "10.0.0.6", "po')
+
+    resumed = r.Journal(path, resume=True)
+    resumed.close()
+
+    assert [ip for ip in ("10.0.0.1", "10.0.0.2", "10.0.0.3", "10.0.0.4", "10.0.0.5")
+            if resumed.is_done(ip, "80", "dns")] == ["10.0.0.1", "10.0.0.2", "10.0.0.3"]
+    assert not resumed.is_done("10.0.0.1", "80", "dns+password")
+    assert not resumed.is_done("10.0.0.1", "8080", "dns")
+
+
+def test_journal_without_resume_starts_over(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    journal = r.Journal(path, resume=False)
+    journal.record("10.0.0.1", "80", "dns", r.OUTCOME_SUCCEEDED)
+    journal.close()
+
+    journal = r.Journal(path, resume=False)
+    journal.close()
+
+    assert not journal.is_done("10.0.0.1", "80", "dns")
+
+
+def test_pending_routers_skips_journaled_routers(tmp_path):
+    journal = r.Journal(str(tmp_path / "journal.jsonl"), resume=False)
+    journal.record("10.0.0.1", "80", "dns", r.OUTCOME_SUCCEEDED)
+    journal.close()
+    journal = r.Journal(journal.path, resume=True)
+    journal.close()
+
+    rows = [(0, _row("10.0.0.1")), (1, _row("10.0.0.2"))]
+
+    assert list(r.pending_routers(rows, journal, "dns")) == [(1, _row("10.0.0.2"))]
+
+
+def test_host_limiter_limits_routers_of_one_ip(monotonic):
+    limiter = r.HostLimiter(concurrency=2, interval=0)
+
+    assert limiter.acquire("10.0.0.1") == 0
+    assert limiter.acquire("10.0.0.1") == 0
+    assert limiter.acquire("10.0.0.1") == r.HOST_BUSY_DELAY
+    assert limiter.acquire("10.0.0.2") == 0
+
+    limiter.release("10.0.0.1")
+    assert limiter.acquire("10.0.0.1") == 0
+
+
+def test_host_limiter_spaces_starts_of_one_ip(monotonic):
+    limiter = r.HostLimiter(concurrency=5, interval=10)
+
+    assert limiter.acquire("10.0.0.1") == 0
+    limiter.release("10.0.0.1")
+    monotonic.now += 4
+    assert limiter.acquire("10.0.0.1") == pytest.approx(6)
+    assert limiter.acquire("10.0.0.2") == 0
+
+    monotonic.now += 6
+    assert limiter.acquire("10.0.0.1") == 0
+
+
+def test_retry_scheduler_submits_in_due_order():
+    submitted = []
+    done = threading.Event()
+
+    def submit(job):
+        submitted.append(job)
+        if len(submitted) == 4:
+            done.set()
+
+    scheduler = r.RetryScheduler(submit=submit)
+    scheduler.schedule(0.3, "third", retry=True)
+    scheduler.schedule(0.1, "first", retry=True)
+    scheduler.schedule(0.2, "second")
+    scheduler.schedule(0.3, "fourth", retry=True)
+    # routers put off because their ip was busy are not retries
+    assert scheduler.pending() == 3
+
+    assert done.wait(5)
+    assert submitted == ["first", "second", "third", "fourth"]
+    assert scheduler.pending() == 0
+
+
+def test_retry_backoff_jitter_spreads_retries():
+    random.seed(1)
+    delays = {round(r.backoff(2, delay=30.0, max_delay=600.0), 3) for _ in range(100)}
+
+    assert len(delays) > 90
+    assert min(delays) >= 30.0 and max(delays) <= 60.0
+
+
+def test_read_routers_skips_the_header(tmp_path):
+    path = tmp_path / "routers.csv"
+    path.write_text("IP;Port;None;None;User:pass;Model\n10.0.0.1;80;;;admin:admin;ZTE\n\n10.0.0.2;443;;;a:b;TP\n")
+
+    assert list(r.read_routers(str(path), skip_header=True)) == [
+        (0, ["10.0.0.1", "80", "", "", "admin:admin", "ZTE"]),
+        (1, []),
+        (2, ["10.0.0.2", "443", "", "", "a:b", "TP"]),
+    ]
+    assert list(r.read_routers(str(path), skip_header=False))[0][1][0] == "IP"
+
+
+@pytest.mark.parametrize("row, reason", [
+    (["10.0.0.1", "80", "", "", "a:b", "ZTE"], ""),
+    (["10.0.0.1", "80", "", "", "a:b"], "expected at least 6 fields, got 5"),
+    (["", "80", "", "", "a:b", "ZTE"], "ip is empty"),
+    (["10.0.0.1", "http", "", "", "a:b", "ZTE"], 'port "http" is not a number'),
+    (["10.0.0.1", "80", "", "", "a:b", ""], "model is empty"),
+])
+def test_validate_router_row(row, reason):
+    assert r.validate_router_row(row) == reason
+
+
+def test_valid_routers_counts_invalid_rows_as_skipped():
+    summary = r.RunSummary()
+    rows = [(0, _row("10.0.0.1")), (1, []), (2, ["10.0.0.2", "x"]), (3, _row("10.0.0.3"))]
+
+    assert [idx for idx, _ in r.valid_routers(rows, summary)] == [0, 3]
+    assert summary.counts[r.OUTCOME_SKIPPED] == 1
+
+
+@pytest.fixture
+def listening_port():
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+    responses = []
+
+    def serve():
+        while True:
+            try:
+                connection, _ = server.accept()
+            except OSError:
+                return
+            with connection:
+                connection.settimeout(1)
+                try:
+                    connection.recv(1024)
+                    connection.sendall(responses[0] if responses else b"")
+                except OSError:
+                    pass
+
+    threading.Thread(target=serve, daemon=True).start()
+    yield server.getsockname()[1], responses
+    server.close()
+
+
+@pytest.fixture
+def closed_port():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def _probe(port, http_head: bool = False, ssl_context=None) -> str:
+    return asyncio.run(r._probe_router("127.0.0.1", str(port), timeout=2, http_head=http_head,
+                                       semaphore=asyncio.Semaphore(1), ssl_context=ssl_context))
+
+
+def test_probe_router_is_a_tcp_connect(listening_port, closed_port):
+    port, _ = listening_port
+
+    assert _probe(port) == ""
+    assert _probe(closed_port).startswith("connect failed")
+
+
+def test_probe_router_head_needs_an_http_answer(listening_port):
+    port, responses = listening_port
+
+    assert _probe(port, http_head=True) == "no http response"
+    responses.append(b"HTTP/1.0 200 OK\r\n\r\n")
+    assert _probe(port, http_head=True) == ""
+
+
+def test_probe_router_only_talks_tls_for_head_requests(monkeypatch):
+    contexts = []
+
+    async def open_connection(host, port, ssl=None):
+        contexts.append(ssl)
+        raise ConnectionRefusedError("refused")
+
+    monkeypatch.setattr(r.asyncio, "open_connection", open_connection)
+    ssl_context = r._preflight_ssl_context()
+    _probe(443, ssl_context=ssl_context)
+    _probe(443, http_head=True, ssl_context=ssl_context)
+
+    assert contexts == [None, ssl_context]
+
+
+def test_probe_router_counts_failed_tls_handshakes_as_reachable(monkeypatch):
+    async def open_connection(host, port, ssl=None):
+        raise r.ssl.SSLError("unsupported protocol")
+
+    monkeypatch.setattr(r.asyncio, "open_connection", open_connection)
+
+    assert _probe(443, http_head=True, ssl_context=r._preflight_ssl_context()) == ""
+
+
+def test_preflight_ssl_context_accepts_old_firmware():
+    ssl_context = r._preflight_ssl_context()
+
+    assert ssl_context.verify_mode == ssl.CERT_NONE
+    assert not ssl_context.check_hostname
+    assert ssl_context.minimum_version == ssl.TLSVersion.TLSv1
+
+
+def test_unreachable_routers_are_written_to_the_skip_report(listening_port, closed_port):
+    port, _ = listening_port
+    summary = r.RunSummary()
+    report = io.StringIO()
+    rows = [(0, ["127.0.0.1", str(port), "", "", "a:b", "ZTE", "extra"]),
+            (1, ["127.0.0.1", str(closed_port), "", "", "a:b", "ZTE"])]
+
+    reachable = list(r.reachable_routers(iter(rows), summary, csv.writer(report, delimiter=";"), batch_size=1,
+                                         concurrency=2, timeout=2, http_head=False))
+
+    assert [idx for idx, _ in reachable] == [0]
+    skipped, = csv.reader(io.StringIO(report.getvalue()), delimiter=";")
+    assert skipped[:6] == rows[1][1]
+    assert skipped[6].startswith("connect failed")
+    assert summary.counts[r.OUTCOME_SKIPPED] == 1
+
+
+@pytest.fixture
+def collector(tmp_path, monkeypatch):
+    pytest.importorskip("flask")
+    monkeypatch.setenv("LOG_FILE", str(tmp_path / "unused.log"))
+    spec = importlib.util.spec_from_file_location("rs_upload_main", os.path.join(ROOT, "rs_upload", "app", "main.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _log_writer(collector, path, **options):
+    # flushed by the tests only
+    options = {"flush_records": 10 ** 6, "flush_seconds": 3600, "rotate_bytes": 10 ** 6, "max_records": 100,
+               **options}
+    return collector.LogWriter(path=str(path), **options)
+
+
+def test_log_writer_appends_lines(collector, tmp_path):
+    writer = _log_writer(collector, tmp_path / "data.log")
+
+    assert writer.write(["a", "b"])
+    writer.flush()
+    assert writer.write(["c"])
+    writer.flush()
+
+    assert (tmp_path / "data.log").read_text() == "a\nb\nc\n"
+
+
+def test_log_writer_keeps_lines_it_could_not_write(collector, tmp_path):
+    writer = _log_writer(collector, tmp_path / "logs" / "data.log")
+    writer.write(["a", "b"])
+
+    with pytest.raises(OSError):
+        writer.flush()
+    writer.write(["c"])
+    (tmp_path / "logs").mkdir()
+    writer.flush()
+
+    assert (tmp_path / "logs" / "data.log").read_text() == "a\nb\nc\n"
+
+
+def test_log_writer_refuses_lines_past_the_buffer_limit(collector, tmp_path):
+    writer = _log_writer(collector, tmp_path / "data.log", max_records=3)
+
+    assert writer.write(["a", "b"])
+    assert not writer.write(["c", "d"])
+    assert writer.write(["c"])
+    writer.flush()
+    assert writer.write(["d", "e", "f"])
+
+
+def test_log_writer_rotates_to_gzip(collector, tmp_path):
+    writer = _log_writer(collector, tmp_path / "data.log", rotate_bytes=10)
+    writer.write(["0123456789"])
+    writer.flush()
+    writer.write(["next"])
+    writer.flush()
+
+    rotated, = tmp_path.glob("data.log.*.gz")
+    with gzip.open(rotated, "rt") as f:
+        assert f.read() == "0123456789\n"
+    assert (tmp_path / "data.log").read_text() == "next\n"
+    assert sorted(path.name for path in tmp_path.iterdir()) == sorted(["data.log", "data.log.lock", rotated.name])
+
+
+def test_collector_answers_503_while_the_buffer_is_full(collector, tmp_path, monkeypatch):
+    monkeypatch.setattr(collector, "writer", _log_writer(collector, tmp_path / "data.log", max_records=2))
+    client = collector.app.test_client()
+
+    assert client.post("/", data={"ip": "10.0.0.1"}).status_code == 200
+    assert client.post("/batch", json=[{"ip": "10.0.0.2"}]).status_code == 200
+    assert client.post("/", data={"ip": "10.0.0.3"}).status_code == 503
+    assert client.post("/batch", json=[{"ip": "10.0.0.3"}]).status_code == 503
+
+    collector.writer.flush()
+    assert client.post("/batch", json=[{"ip": "10.0.0.3"}]).status_code == 200